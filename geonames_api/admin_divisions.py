@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from geonames_api.config import settings
+from geonames_api.utils import normalize_name_key
+
+logger = logging.getLogger(__name__)
+
+
+class AdminDivision(NamedTuple):
+    """ """
+
+    country_code: str
+    admin1_code: str
+    admin2_code: Optional[str] = None
+
+    @classmethod
+    def from_code(cls, code: str) -> "AdminDivision":
+        """
+        :param code: geonames admin code, e.g. "FR.11" or "FR.11.75"
+        """
+        return cls(*code.split("."))
+
+
+def get_admin_division_key(country_code: str, name: str) -> str:
+    """ """
+    return f"{country_code}:{normalize_name_key(name)}"
+
+
+def build_admin_division_table(
+    admin_divisions: List[dict],
+) -> Mapping[str, Tuple[AdminDivision, ...]]:
+    """
+    Build the admin division lookup table: country code and normalized name (names,
+    ascii names, alternate names and abbreviations, e.g. "Île-de-France", "Bayern",
+    "NSW") => admin divisions (several when a name is shared, e.g. a department and
+    its region)
+
+    :param admin_divisions: [{"code": "FR.11", "names": [...]}, ...]
+    """
+    table: Dict[str, List[AdminDivision]] = {}
+    for x in admin_divisions:
+        division = AdminDivision.from_code(x["code"])
+        for name in x["names"]:
+            divisions = table.setdefault(
+                get_admin_division_key(division.country_code, name), []
+            )
+            if division not in divisions:
+                divisions.append(division)
+    return MappingProxyType({k: tuple(v) for k, v in table.items()})
+
+
+def load_admin_divisions(path: str) -> List[dict]:
+    """
+    Load the admin divisions names generated at index build time (see
+    scripts/index_geonames_data.py), empty if the file doesn't exist
+    """
+    if not path or not os.path.exists(path):
+        logger.info(f"No admin divisions found at: {path}")
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+admin_division_table = build_admin_division_table(
+    load_admin_divisions(settings.admin_divisions_path)
+)
+
+
+def resolve_admin_division(
+    name: str, country_code: str, level: int = None
+) -> Optional[AdminDivision]:
+    """
+    O(1) lookup of the admin division named `name` in the country
+
+    :param level: only consider the admin1 (1) or admin2 (2) divisions
+    :return: the admin1 division if the name matches one (a region takes precedence
+        over the department of the same name), the admin2 division if it's the only
+        one matching, None otherwise
+    """
+    if not name or not country_code:
+        return None
+    divisions = admin_division_table.get(get_admin_division_key(country_code, name))
+    if not divisions:
+        return None
+    admin1 = [x for x in divisions if x.admin2_code is None]
+    admin2 = [x for x in divisions if x.admin2_code is not None]
+    if level != 2 and len(admin1) == 1:
+        return admin1[0]
+    if level != 1 and len(admin2) == 1 and (level == 2 or not admin1):
+        return admin2[0]
+    return None
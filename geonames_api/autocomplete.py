@@ -0,0 +1,91 @@
+import math
+from typing import List
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api.cache import LRUCache
+from geonames_api.config import settings
+from geonames_api.models import AutocompleteSuggestion, GeonameItem
+from geonames_api.ranking import get_feature_rank_feature
+
+SUGGEST_SOURCE_FIELDS = [
+    "geonameid",
+    "name",
+    "country_code",
+    "admin1_name",
+    "admin2_name",
+    "feature_class",
+    "feature_code",
+    "population",
+]
+
+# (prefix, country_code, size) => suggestions, absorbs the repeated prefixes of
+# concurrent users typing the same place
+autocomplete_cache = LRUCache(
+    "autocomplete",
+    maxsize=settings.autocomplete_cache_size,
+    ttl=settings.autocomplete_cache_ttl,
+)
+
+
+def get_suggest_inputs(item: GeonameItem) -> List[str]:
+    """
+    Completion inputs of a place: its names and the "City, Admin1" / "City,
+    Admin2, Admin1" combinations generated by the indexer
+    """
+    inputs = [item.name, item.asciiname]
+    inputs.extend(x.name for x in item.alternative_names if ", " in x.name)
+    return list(dict.fromkeys(x for x in inputs if x))
+
+
+def get_suggest_weight(item: GeonameItem) -> int:
+    """
+    Population (log scale) first, then the feature code rank to order places
+    without population
+    """
+    population_weight = int(100 * math.log10(1 + (item.population or 0)))
+    feature_weight = int(
+        get_feature_rank_feature(item.feature_class, item.feature_code)
+    )
+    return population_weight * 100 + feature_weight
+
+
+def build_suggest_body(prefix: str, country_code: str = None, size: int = 5) -> dict:
+    """ """
+    completion = {"field": "suggest", "size": size, "skip_duplicates": True}
+    if country_code:
+        completion["contexts"] = {"country_code": [country_code]}
+    return {
+        "suggest": {"place": {"prefix": prefix, "completion": completion}},
+        "_source": SUGGEST_SOURCE_FIELDS,
+    }
+
+
+def parse_suggest_response(es_resp: dict) -> List[AutocompleteSuggestion]:
+    """ """
+    suggestions = []
+    for option in es_resp["suggest"]["place"][0]["options"]:
+        suggestions.append(
+            AutocompleteSuggestion(text=option["text"], **option["_source"])
+        )
+    return suggestions
+
+
+async def autocomplete_async(
+    es: AsyncElasticsearch, prefix: str, country_code: str = None, size: int = 5
+) -> List[AutocompleteSuggestion]:
+    """ """
+    prefix = prefix.strip()
+    if not prefix:
+        return []
+    key = (prefix.lower(), country_code, size)
+    suggestions = autocomplete_cache.get(key)
+    if suggestions is None:
+        es_resp = await es.search(
+            index=settings.geonames_index,
+            body=build_suggest_body(prefix, country_code=country_code, size=size),
+            request_timeout=settings.es.get_request_timeout("autocomplete"),
+        )
+        suggestions = parse_suggest_response(es_resp)
+        autocomplete_cache.set(key, suggestions)
+    return suggestions
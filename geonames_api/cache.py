@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional
+
+from geonames_api import metrics
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded, thread safe, in process LRU cache with an optional TTL (seconds)
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = Lock()
+        metrics.register_rate(
+            f"cache.{name}.hit_rate",
+            numerator=f"cache.{name}.hit",
+            denominator=f"cache.{name}.get",
+        )
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, MISSING, count=False) is not MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        """ """
+        if count:
+            metrics.incr(f"cache.{self.name}.get")
+        with self.lock:
+            entry = self.data.get(key, MISSING)
+            if entry is MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+        if count:
+            metrics.incr(f"cache.{self.name}.hit")
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """ """
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data[key] = (value, expires_at)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        """ """
+        with self.lock:
+            self.data.clear()
@@ -0,0 +1,199 @@
+"""
+Circuit breaker of the ES searches: it opens when, over the last `window` searches,
+the rate of failing or of slow searches goes over its threshold. A search of a batch
+counts as failed in proportion of its failed locations (msearch items), so a single
+bad query doesn't fail a whole batch. While it's open the searches aren't sent to ES
+(the degraded mode answers instead, see geonames_api.fallback).
+
+After `open_duration` seconds the breaker is half open: up to `half_open_calls`
+live searches go through as trials, it closes once they all succeed and opens again
+as soon as one fails. ES is also probed periodically while it's open (see
+probe_while_open), the breaker closes once a probe succeeds.
+
+Exposed in the metrics: gauges `breaker.<name>.open` / `half_open`, counters
+`breaker.<name>.opened / rejected / probe_failed`.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api import metrics
+from geonames_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """ """
+
+
+class CircuitBreaker:
+    """ """
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        error_rate: float,
+        slow_rate: float,
+        slow_ms: float,
+        open_duration: float,
+        half_open_calls: int,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        # (failed ratio, slow) of the last searches
+        self.calls: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.state = CLOSED
+        # time of the last state change
+        self.changed_at = time.monotonic()
+        # trial searches let through / succeeded while half open
+        self.n_trials = 0
+        self.n_trials_ok = 0
+        self.update_gauges()
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Open or half open: the searches (but the trials) aren't sent to ES
+        """
+        return self.state != CLOSED
+
+    def update_gauges(self):
+        """ """
+        metrics.set_gauge(f"breaker.{self.name}.open", int(self.state == OPEN))
+        metrics.set_gauge(
+            f"breaker.{self.name}.half_open", int(self.state == HALF_OPEN)
+        )
+
+    def check(self):
+        """
+        Let the search through when the breaker is closed, or as a trial when it's
+        half open
+
+        :raise CircuitOpen: when the breaker is open, or half open with all its
+            trials in flight
+        """
+        elapsed = time.monotonic() - self.changed_at
+        if self.state == OPEN and elapsed >= self.open_duration:
+            self.half_open()
+        elif self.state == HALF_OPEN and elapsed >= self.open_duration:
+            # trials that never completed (e.g. cancelled), new ones
+            self.half_open()
+        if self.state == CLOSED:
+            return
+        if self.state == HALF_OPEN and self.n_trials < self.half_open_calls:
+            self.n_trials += 1
+            return
+        metrics.incr(f"breaker.{self.name}.rejected")
+        raise CircuitOpen(self.name)
+
+    def record(self, latency_ms: float, failed_ratio: float = 0.0):
+        """
+        :param failed_ratio: ratio of the failed searches of the batch (1 when the
+            whole msearch failed)
+        """
+        slow = latency_ms > self.slow_ms
+        if self.state == HALF_OPEN:
+            if failed_ratio >= self.error_rate or slow:
+                self.open()
+                return
+            self.n_trials_ok += 1
+            if self.n_trials_ok >= self.half_open_calls:
+                self.close()
+            return
+        if self.state == OPEN:
+            return
+        self.calls.append((failed_ratio, slow))
+        if len(self.calls) < self.min_calls:
+            return
+        n_failed = sum(failed for failed, _ in self.calls)
+        n_slow = sum(1 for _, slow in self.calls if slow)
+        if (
+            n_failed / len(self.calls) >= self.error_rate
+            or n_slow / len(self.calls) >= self.slow_rate
+        ):
+            self.open()
+
+    def set_state(self, state: str):
+        """ """
+        self.state = state
+        self.changed_at = time.monotonic()
+        self.n_trials = 0
+        self.n_trials_ok = 0
+        self.update_gauges()
+
+    def open(self):
+        """ """
+        logger.warning(f"Circuit breaker {self.name} opened")
+        self.set_state(OPEN)
+        metrics.incr(f"breaker.{self.name}.opened")
+
+    def half_open(self):
+        """ """
+        logger.info(f"Circuit breaker {self.name} half open")
+        self.set_state(HALF_OPEN)
+
+    def close(self):
+        """ """
+        logger.warning(f"Circuit breaker {self.name} closed")
+        self.set_state(CLOSED)
+        self.calls.clear()
+
+
+search_breaker = CircuitBreaker(
+    "search",
+    window=settings.breaker_window,
+    min_calls=settings.breaker_min_calls,
+    error_rate=settings.breaker_error_rate,
+    slow_rate=settings.breaker_slow_rate,
+    slow_ms=settings.breaker_slow_ms,
+    open_duration=settings.breaker_open_duration,
+    half_open_calls=settings.breaker_half_open_calls,
+)
+
+
+async def probe_es(es: AsyncElasticsearch) -> bool:
+    """
+    A cheap search on the geonames index, within the breaker latency budget
+    """
+    try:
+        await es.search(
+            index=settings.geonames_index,
+            body={"query": {"match_all": {}}, "size": 1},
+            request_timeout=settings.breaker_slow_ms / 1000,
+        )
+        return True
+    except Exception as e:
+        logger.info(f"ES probe failed: {e}")
+        return False
+
+
+async def probe_while_open(es: AsyncElasticsearch, breaker: CircuitBreaker):
+    """
+    Background task: probe ES every `breaker_probe_interval` seconds while the
+    breaker is open, and close it once ES answers
+    """
+    while True:
+        await asyncio.sleep(settings.breaker_probe_interval)
+        if not breaker.is_open:
+            continue
+        if await probe_es(es):
+            breaker.close()
+        else:
+            metrics.incr(f"breaker.{breaker.name}.probe_failed")
@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 from pydantic import BaseSettings
 
 
@@ -6,8 +8,32 @@ class EsSettings(BaseSettings):
 
     host: str = "localhost"
     port: str = 9200
+    # several nodes (e.g. ES_HOSTS='["es-1:9200", "es-2:9200"]'), take precedence
+    # over host / port
+    hosts: List[str] = None
     username: str = None
     password: str = None
+    # default timeout and retries of the client
+    timeout: float = 30
+    max_retries: int = 3
+    retry_on_timeout: bool = True
+    # connections kept alive per node, per worker
+    connections_per_node: int = 10
+    # gzip request bodies and accept gzip responses
+    http_compress: bool = False
+    # timeouts (seconds) of the ES requests per kind of route
+    request_timeouts: Dict[str, float] = {
+        "normalize": 10,
+        "autocomplete": 1,
+        "places": 2,
+        "shadow": 10,
+    }
+    # hedged requests: a duplicate search is sent to another node of the pool when
+    # the first one didn't answer after the `hedge_percentile` of the observed
+    # latencies (at least `hedge_min_delay_ms`), only with several hosts
+    hedging: bool = False
+    hedge_percentile: float = 95
+    hedge_min_delay_ms: float = 10
 
     class Config:
         env_file = ".env"
@@ -16,21 +42,122 @@ class EsSettings(BaseSettings):
     @property
     def es_client_params(self) -> dict:
         params = {
-            "hosts": [f"{self.host}:{self.port}"],
-            "timeout": 30,
-            "max_retries": 3,
-            "retry_on_timeout": True,
+            "hosts": self.hosts or [f"{self.host}:{self.port}"],
+            "timeout": self.timeout,
+            "max_retries": self.max_retries,
+            "retry_on_timeout": self.retry_on_timeout,
+            "maxsize": self.connections_per_node,
+            "http_compress": self.http_compress,
         }
         if self.username and self.password:
             params["http_auth"] = f"{self.username}:{self.password}"
         return params
 
+    def get_request_timeout(self, route: str) -> float:
+        """ """
+        return self.request_timeouts.get(route, self.timeout)
+
+    @property
+    def hedging_enabled(self) -> bool:
+        """ """
+        return self.hedging and len(self.hosts or []) > 1
+
 
 class Settings(BaseSettings):
     """ """
 
     es: EsSettings = EsSettings()
     geonames_index = "geonames-v1.5"
+    # documents are routed by country_code at index time, country scoped queries
+    # only hit the matching shard (and are filtered on the country)
+    country_routing: bool = False
+    # the index is split into one index per country group (see COUNTRY_GROUPS),
+    # all of them behind the `geonames_index` alias
+    country_group_indices: bool = False
+    # first try an exact lookup of the normalized name in the country before the
+    # full text search (requires an index with `name_keys`)
+    keyword_first_stage: bool = False
+    # rank the hits by feature code / population in ES (rank_feature fields), the
+    # first hit is then the best match and only a few hits need to be fetched
+    es_ranking: bool = False
+    # search with the stored search templates (registered at index build time and
+    # at startup, see geonames_api.search_templates), only the parameters are sent
+    search_templates: bool = False
+    # number of hits fetched per search (1-3 is enough with es_ranking)
+    search_size: int = 10
+    # localized country names extracted from the geonames PCLI alternate names
+    country_names_path: str = "./data/country_names.json"
+    # resolve the admin names of the locations to admin codes (keyword clauses
+    # instead of full text matches on the admin names), with the admin divisions
+    # names generated at index build time
+    admin_resolution: bool = False
+    admin_divisions_path: str = "./data/admin_divisions.json"
+    # correct the misspelled city names that don't match (e.g. "Marseile") and
+    # search them again, once, with the spelling dictionary generated at index
+    # build time (see geonames_api.spelling)
+    spelling_correction: bool = False
+    spelling_dictionary_path: str = "./data/spelling"
+    # verify the candidates against the query city name (jaro winkler similarity
+    # of their names, scored for a whole batch at once, see geonames_api.similarity):
+    # the candidates under `min_name_similarity` are discarded and the similarity
+    # breaks the feature rank ties
+    candidate_verification: bool = True
+    min_name_similarity: float = 0.5
+    # size of the in process cache of the places fetched by geonameid
+    places_cache_size: int = 50000
+    # autocomplete: cache of the suggestions per prefix
+    autocomplete_cache_size: int = 100000
+    autocomplete_cache_ttl: float = 600
+    # parse the common location shapes with rules instead of libpostal (see
+    # geonames_api.pre_parser and scripts/check_pre_parser_agreement.py)
+    pre_parser: bool = False
+    # known bad / unmatched raw locations, skip parsing and search
+    negative_cache_size: int = 100000
+    negative_cache_ttl: float = 3600
+    # frequent locations replayed at startup before the api is ready (see
+    # health.load_warmup_corpus for the format)
+    warmup_corpus_path: str = None
+    warmup_batch_size: int = 100
+    # adaptive concurrency limit of the ES msearches, per worker: AIMD on the search
+    # latency (msearch latency per search, and errors), the msearches over the limit
+    # wait in a bounded queue and are rejected with a 429 when it's full or after
+    # `limiter_queue_timeout`
+    limiter: bool = False
+    limiter_initial_limit: int = 20
+    limiter_min_limit: int = 2
+    limiter_max_limit: int = 200
+    limiter_latency_target_ms: float = 500
+    limiter_queue_size: int = 100
+    limiter_queue_timeout: float = 1
+    # shadow traffic: a sampled fraction of the normalize searches is mirrored to a
+    # candidate index (searched with its own templates if search_templates), off
+    # the request path, and compared in the metrics (see geonames_api.shadow)
+    shadow_index: str = None
+    shadow_sample_rate: float = 0.0
+    shadow_max_concurrency: int = 4
+    # circuit breaker of the ES searches: opens when over the last `breaker_window`
+    # searches the failing (ratio of the failed locations of each batch) or slow
+    # (> breaker_slow_ms) rate reaches its threshold, the locations are then answered
+    # (flagged stale) from the previous results or the major places generated at
+    # index build time. After `breaker_open_duration` seconds up to
+    # `breaker_half_open_calls` searches are let through as trials, it closes once
+    # they succeed (or once an ES probe succeeds)
+    circuit_breaker: bool = False
+    breaker_window: int = 50
+    breaker_min_calls: int = 10
+    breaker_error_rate: float = 0.5
+    breaker_slow_rate: float = 0.5
+    breaker_slow_ms: float = 2000
+    breaker_probe_interval: float = 5
+    breaker_open_duration: float = 10
+    breaker_half_open_calls: int = 3
+    stale_store_path: str = "./data/stale_results.sqlite"
+    major_places_path: str = "./data/major_places.json"
+    # in memory reverse geocoding data (see scripts/build_reverse_geocoding_data.py)
+    reverse_geocoding_path: str = "./data/reverse_geocoding.npz"
+    # maximum size (bytes) of the request bodies of the batch routes, once
+    # decompressed (see geonames_api.encoding), 413 above
+    max_body_size: int = 32 * 1024 * 1024
 
 
 settings = Settings()
@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+import pycountry
+
+from geonames_api.config import settings
+from geonames_api.utils import normalize_name_key
+
+logger = logging.getLogger(__name__)
+
+
+class Country(NamedTuple):
+    """ """
+
+    alpha_2: str
+    alpha_3: str
+    name: str
+    official_name: Optional[str] = None
+
+
+def build_country_table(
+    localized_names: Dict[str, List[str]] = None,
+) -> Mapping[str, Country]:
+    """
+    Build the country lookup table: codes (as is and normalized), english names
+    (name, official and common names) and localized names (from the geonames PCLI
+    alternate names, e.g. "Deutschland", "Espagne") => Country
+
+    Codes and english names take precedence over localized names when a key is
+    shared by several countries.
+
+    :param localized_names: alpha_2 => localized names
+    """
+    table = {}
+    localized_keys = {}
+    for c in pycountry.countries:
+        country = Country(
+            alpha_2=c.alpha_2,
+            alpha_3=c.alpha_3,
+            name=c.name,
+            official_name=getattr(c, "official_name", None),
+        )
+        keys = [
+            c.alpha_2,
+            c.alpha_3,
+            c.numeric,
+            c.name,
+            country.official_name,
+            getattr(c, "common_name", None),
+        ]
+        for key in keys:
+            if key:
+                table[key] = country
+                table[normalize_name_key(key)] = country
+        #
+        for name in (localized_names or {}).get(c.alpha_2, []):
+            localized_keys.setdefault(normalize_name_key(name), country)
+
+    for key, country in localized_keys.items():
+        table.setdefault(key, country)
+    #
+    return MappingProxyType(table)
+
+
+def load_country_localized_names(path: str) -> Dict[str, List[str]]:
+    """
+    Load the localized country names generated at index build time (see
+    scripts/index_geonames_data.py), empty if the file doesn't exist
+    """
+    if not path or not os.path.exists(path):
+        logger.info(f"No country localized names found at: {path}")
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+country_table = build_country_table(
+    load_country_localized_names(settings.country_names_path)
+)
+
+
+def lookup_country(country: str) -> Optional[Country]:
+    """
+    O(1) lookup of a country by code or (english / localized) name
+    """
+    if not country:
+        return None
+    c = country_table.get(country)
+    if c is None:
+        c = country_table.get(normalize_name_key(country))
+    return c
@@ -0,0 +1,275 @@
+"""
+Content negotiation of the batch routes for internal callers:
+
+    * request bodies: JSON, MessagePack (application/msgpack) or NDJSON
+      (application/x-ndjson, one batch item per line), optionally compressed
+      (Content-Encoding: gzip / zstd)
+    * responses: JSON, MessagePack or NDJSON (one result per line) depending on
+      the Accept header, compressed with gzip / zstd depending on Accept-Encoding
+
+Decoded bodies are validated by the same pydantic models as JSON bodies. Bodies
+are decompressed in a streaming way up to `settings.max_body_size` (413 above,
+e.g. decompression bombs). NDJSON lines are the items of the only list field of
+the body model (the other fields keep their defaults), NDJSON bodies are rejected
+with a 415 by the routes whose body model has no single list field.
+"""
+
+import gzip
+import json
+import zlib
+from contextvars import ContextVar
+from typing import Any, Callable, Optional, Tuple
+
+import msgpack
+import zstandard
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic.fields import SHAPE_LIST
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from geonames_api.config import settings
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+
+MSGPACK_TYPES = {MSGPACK, "application/x-msgpack"}
+
+# compress responses only above this size (bytes)
+MIN_COMPRESS_SIZE = 1024
+# size of the chunks of the decompressed zstd bodies (bytes)
+ZSTD_CHUNK_SIZE = 1024 * 1024
+
+# media type of the response negotiated for the current request
+response_media_type: ContextVar[str] = ContextVar("response_media_type", default=JSON)
+
+
+def get_media_type(content_type: Optional[str]) -> str:
+    """ """
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """ """
+    for media_type in (accept or "").split(","):
+        media_type = get_media_type(media_type)
+        if media_type in MSGPACK_TYPES:
+            return MSGPACK
+        if media_type == NDJSON:
+            return NDJSON
+        if media_type in (JSON, "*/*"):
+            return JSON
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """ """
+    encodings = [x.split(";")[0].strip() for x in (accept_encoding or "").split(",")]
+    if "zstd" in encodings:
+        return "zstd"
+    if "gzip" in encodings:
+        return "gzip"
+    return None
+
+
+def raise_body_too_large(max_size: int):
+    """ """
+    raise HTTPException(
+        status_code=413, detail=f"Request body larger than {max_size} bytes"
+    )
+
+
+def decompress_gzip(body: bytes, max_size: int) -> bytes:
+    """
+    Decompress the gzip members of the body, at most `max_size` bytes
+    """
+    decompressed = bytearray()
+    while body:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        decompressed += decompressor.decompress(body, max_size + 1 - len(decompressed))
+        if len(decompressed) > max_size:
+            raise_body_too_large(max_size)
+        if not decompressor.eof:
+            raise zlib.error("truncated gzip body")
+        body = decompressor.unused_data
+    return bytes(decompressed)
+
+
+def decompress_zstd(body: bytes, max_size: int) -> bytes:
+    """
+    Decompress the zstd frames of the body, at most `max_size` bytes
+    """
+    decompressed = bytearray()
+    with zstandard.ZstdDecompressor().stream_reader(
+        body, read_across_frames=True
+    ) as reader:
+        while True:
+            chunk = reader.read(ZSTD_CHUNK_SIZE)
+            if not chunk:
+                break
+            decompressed += chunk
+            if len(decompressed) > max_size:
+                raise_body_too_large(max_size)
+    return bytes(decompressed)
+
+
+def decompress(
+    body: bytes, content_encoding: Optional[str], max_size: Optional[int] = None
+) -> bytes:
+    """
+    :param max_size: maximum size of the decompressed body, 413 above
+        (settings.max_body_size by default)
+    """
+    max_size = max_size or settings.max_body_size
+    if not content_encoding or content_encoding == "identity":
+        if len(body) > max_size:
+            raise_body_too_large(max_size)
+        return body
+    try:
+        if content_encoding == "gzip":
+            return decompress_gzip(body, max_size)
+        if content_encoding == "zstd":
+            return decompress_zstd(body, max_size)
+    except (zlib.error, zstandard.ZstdError) as e:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid {content_encoding} body: {e}"
+        )
+    raise HTTPException(
+        status_code=415, detail=f"Unsupported content encoding: {content_encoding}"
+    )
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """ """
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5)
+    return zstandard.ZstdCompressor(level=3).compress(body)
+
+
+class NegotiatedRequest(Request):
+    """
+    Request with a decompressed body, MessagePack / NDJSON bodies are decoded by
+    `json()` and announced as JSON so FastAPI validates them as usual
+    """
+
+    def __init__(
+        self,
+        scope,
+        receive,
+        batch_field: Optional[str] = None,
+        accept_ndjson: bool = True,
+    ):
+        super().__init__(scope, receive)
+        self.batch_field = batch_field
+        self.accept_ndjson = accept_ndjson
+        self.body_media_type = get_media_type(super().headers.get("content-type"))
+        if self.body_media_type in MSGPACK_TYPES or self.body_media_type == NDJSON:
+            headers = MutableHeaders(scope=scope)
+            headers["content-type"] = JSON
+            self._headers = Headers(raw=headers.raw)
+
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            self._body = decompress(body, self.headers.get("content-encoding"))
+        return self._body
+
+    async def check_body(self):
+        """
+        Read and decompress the body, checking its encoding and media type: the
+        HTTPExceptions (413 / 415 / 400) must be raised before FastAPI parses the
+        body, which turns the errors of `json()` into 400s
+        """
+        await self.body()
+        if self.body_media_type == NDJSON and not self.accept_ndjson:
+            raise HTTPException(status_code=415, detail="NDJSON bodies not supported")
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = await self.body()
+            if self.body_media_type in MSGPACK_TYPES:
+                self._json = msgpack.unpackb(body)
+            elif self.body_media_type == NDJSON:
+                items = [json.loads(line) for line in body.splitlines() if line.strip()]
+                self._json = {self.batch_field: items} if self.batch_field else items
+            else:
+                self._json = json.loads(body)
+        return self._json
+
+
+class NegotiatedResponse(JSONResponse):
+    """
+    Render the response content in the media type negotiated for the request
+    """
+
+    def render(self, content: Any) -> bytes:
+        media_type = response_media_type.get()
+        self.media_type = media_type
+        if media_type == MSGPACK:
+            return msgpack.packb(content)
+        if media_type == NDJSON and isinstance(content, list):
+            return b"".join(
+                json.dumps(x, ensure_ascii=False, separators=(",", ":")).encode()
+                + b"\n"
+                for x in content
+            )
+        self.media_type = JSON
+        return super().render(content)
+
+
+def get_batch_field(body_field) -> Tuple[Optional[str], bool]:
+    """
+    :return: the field of the body model receiving the NDJSON lines (None for a
+        list body), and whether the route accepts NDJSON bodies (body model with a
+        single list field)
+    """
+    if body_field is None:
+        return None, False
+    fields = getattr(body_field.type_, "__fields__", None)
+    if fields is None:
+        return None, body_field.shape == SHAPE_LIST
+    list_fields = [name for name, x in fields.items() if x.shape == SHAPE_LIST]
+    if len(list_fields) == 1:
+        return list_fields[0], True
+    return None, False
+
+
+class BatchRoute(APIRoute):
+    """
+    Route negotiating the request / response encodings (see module docstring)
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+        batch_field, accept_ndjson = get_batch_field(self.body_field)
+
+        async def negotiated_route_handler(request: Request) -> Response:
+            request = NegotiatedRequest(
+                request.scope, request.receive, batch_field, accept_ndjson
+            )
+            if self.body_field is not None:
+                await request.check_body()
+            token = response_media_type.set(
+                negotiate_media_type(request.headers.get("accept"))
+            )
+            try:
+                response = await original_route_handler(request)
+            finally:
+                response_media_type.reset(token)
+            #
+            encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+            if (
+                encoding
+                and "content-encoding" not in response.headers
+                and len(response.body) >= MIN_COMPRESS_SIZE
+            ):
+                response.body = compress(response.body, encoding)
+                response.headers["content-encoding"] = encoding
+                response.headers["content-length"] = str(len(response.body))
+                response.headers["vary"] = "Accept-Encoding"
+            return response
+
+        return negotiated_route_handler
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch, AsyncTransport, Connection
+from elasticsearch.exceptions import ConnectionError as EsConnectionError
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+
+from geonames_api import metrics
+from geonames_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+metrics.register_rate("es.hedge_rate", numerator="es.hedged", denominator="es.msearch")
+metrics.register_rate(
+    "es.hedge_win_rate", numerator="es.hedge_won", denominator="es.hedged"
+)
+
+
+def create_es_async() -> AsyncElasticsearch:
+    """ """
+    return AsyncElasticsearch(**settings.es.es_client_params)
+
+
+class HedgeDelay:
+    """
+    Delay (seconds) before sending the duplicate request: the configured percentile
+    of the latencies of the first attempts observed on this worker (the hedged
+    responses would lower it), recomputed (sort of the latency window) at most
+    every `refresh_interval` seconds
+    """
+
+    def __init__(self, refresh_interval: float = 1.0):
+        self.refresh_interval = refresh_interval
+        self.delay: Optional[float] = None
+        self.computed_at = float("-inf")
+
+    def get(self) -> float:
+        """ """
+        now = time.monotonic()
+        if now - self.computed_at >= self.refresh_interval:
+            delay_ms = metrics.latencies["es.msearch.first_attempt"].percentile(
+                settings.es.hedge_percentile
+            )
+            self.delay = max(delay_ms or 0.0, settings.es.hedge_min_delay_ms) / 1000
+            self.computed_at = now
+        return self.delay
+
+
+hedge_delay = HedgeDelay()
+
+
+def get_hedge_delay() -> float:
+    """ """
+    return hedge_delay.get()
+
+
+def get_hedge_connections(
+    es: AsyncElasticsearch,
+) -> Optional[Tuple[Connection, Connection]]:
+    """
+    Connections of the request (picked by the pool selector) and of its duplicate
+    (another live node), None when only one node is live (or before the first
+    request, the async client creates its connections then)
+    """
+    pool = es.transport.connection_pool
+    if len(pool.connections) < 2:
+        return None
+    connection = pool.get_connection()
+    others = [x for x in pool.connections if x is not connection]
+    if not others:
+        return None
+    return connection, random.choice(others)
+
+
+def is_retryable(transport: AsyncTransport, error: TransportError) -> bool:
+    """
+    Same retry rules as the transport: connection errors, timeouts if
+    retry_on_timeout, and the retry_on_status statuses
+    """
+    if isinstance(error, ConnectionTimeout):
+        return transport.retry_on_timeout
+    if isinstance(error, EsConnectionError):
+        return True
+    return error.status_code in transport.retry_on_status
+
+
+async def perform_request_on(
+    es: AsyncElasticsearch,
+    connection: Connection,
+    path: str,
+    body: list,
+    timeout: float,
+    avoid: Connection = None,
+) -> dict:
+    """
+    POST an NDJSON body (msearch) to the given node, instead of the node picked by
+    the transport, with the retries of the transport: on a retryable error the node
+    is marked dead and the request is retried on another node of the pool (not
+    `avoid`, the node of the other attempt, when possible)
+    """
+    transport = es.transport
+    data = "".join(transport.serializer.dumps(x) + "\n" for x in body).encode("utf-8")
+    for attempt in range(transport.max_retries + 1):
+        try:
+            _, headers, resp = await connection.perform_request(
+                "POST",
+                path,
+                body=data,
+                timeout=timeout,
+                headers={"content-type": "application/x-ndjson"},
+            )
+        except TransportError as e:
+            if not is_retryable(transport, e):
+                raise
+            transport.mark_dead(connection)
+            if attempt == transport.max_retries:
+                raise
+            connection = transport.get_connection()
+            others = [
+                x for x in transport.connection_pool.connections if x is not avoid
+            ]
+            if connection is avoid and others:
+                connection = random.choice(others)
+            continue
+        transport.connection_pool.mark_live(connection)
+        content_type = {k.lower(): v for k, v in headers.items()}.get("content-type")
+        return transport.deserializer.loads(resp, content_type)
+
+
+async def timed_first_attempt(request: Awaitable[dict]) -> dict:
+    """
+    Latency of the first attempt of a request, for the hedge delay: until its
+    response, or until it's cancelled (at least that slow) when the duplicate won
+    """
+    start = time.perf_counter()
+    try:
+        return await request
+    finally:
+        metrics.observe_latency(
+            "es.msearch.first_attempt", 1000 * (time.perf_counter() - start)
+        )
+
+
+async def hedged_request(
+    request: Callable[[Connection, Connection], Awaitable[dict]],
+    connections: Tuple[Connection, Connection],
+    delay: float,
+) -> dict:
+    """
+    Run the request on the first connection, send a duplicate one on the second
+    connection (another node) if it didn't complete after `delay` seconds, and
+    return the first successful response. The pending requests are cancelled when
+    the hedged request is
+
+    :param request: request on a connection, avoiding the other one on retries
+    """
+    first = asyncio.ensure_future(
+        timed_first_attempt(request(connections[0], connections[1]))
+    )
+    second = None
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.incr("es.hedged")
+        second = asyncio.ensure_future(request(connections[1], connections[0]))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        metrics.incr("es.hedge_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in (first, second):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def msearch_async(
+    es: AsyncElasticsearch, body: list, route: str, template: bool = False
+) -> dict:
+    """
+    msearch (msearch_template if `template`) with the route timeout, hedged when
+    enabled (and at least two nodes are live)
+    """
+    msearch = es.msearch_template if template else es.msearch
+    timeout = settings.es.get_request_timeout(route)
+
+    def request():
+        return msearch(body=body, request_timeout=timeout)
+
+    def request_on(connection: Connection, avoid: Connection):
+        path = "/_msearch/template" if template else "/_msearch"
+        return perform_request_on(es, connection, path, body, timeout, avoid=avoid)
+
+    metrics.incr("es.msearch")
+    start = time.perf_counter()
+    connections = get_hedge_connections(es) if settings.es.hedging_enabled else None
+    if connections:
+        resp = await hedged_request(request_on, connections, delay=get_hedge_delay())
+    else:
+        resp = await timed_first_attempt(request())
+    metrics.observe_latency("es.msearch", 1000 * (time.perf_counter() - start))
+    return resp
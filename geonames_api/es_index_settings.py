@@ -10,12 +10,27 @@ geoname_index_settings = {
         },
         "bm25_b0": {"type": "BM25", "b": 0},
     },
+    "analysis": {
+        "analyzer": {
+            # whole name, lowercased and ascii folded, for prefix completion
+            "autocomplete_folding": {
+                "type": "custom",
+                "tokenizer": "keyword",
+                "filter": ["lowercase", "asciifolding"],
+            }
+        }
+    },
 }
+# mapping metadata flag: the ids of the documents are their geonameids (required to
+# fetch the places by id, see geonames_api.places)
+GEONAMEID_IDS_META = "geonameid_ids"
 geoname_index_mappings = {
     "properties": {
         "geonameid": {"type": "keyword"},
         "name": {"type": "text"},
         "asciiname": {"type": "text"},
+        # normalized forms of all the names (see utils.normalize_name_key)
+        "name_keys": {"type": "keyword"},
         "alternative_names_string": {"type": "text", "similarity": "bm25_b0"},
         "alternative_names": {
             "type": "nested",
@@ -48,8 +63,38 @@ geoname_index_mappings = {
             "fields": {"raw": {"type": "keyword"}},
         },
         "population": {"type": "integer"},
+        # autocomplete on names and "City, Admin1" combinations, weighted by
+        # population (see geonames_api.autocomplete)
+        "suggest": {
+            "type": "completion",
+            "analyzer": "autocomplete_folding",
+            "contexts": [
+                {"name": "country_code", "type": "category", "path": "country_code"}
+            ],
+        },
+        # ranking signals (see geonames_api.ranking)
+        "feature_rank": {"type": "rank_feature"},
+        "population_rank": {"type": "rank_feature"},
         "elevation": {"type": "integer"},
         "dem": {"type": "integer"},
         "timzeone": {"type": "keyword"},
     }
 }
+
+
+# country groups used when the index is split per group of countries
+# (`settings.country_group_indices`), countries not listed go to DEFAULT_COUNTRY_GROUP
+COUNTRY_GROUPS = {
+    "europe": (
+        "AD AL AT AX BA BE BG BY CH CY CZ DE DK EE ES FI FO FR "
+        "GB GG GI GR HR HU IE IM IS IT JE LI LT LU LV MC MD ME "
+        "MK MT NL NO PL PT RO RS SE SI SJ SK SM UA VA XK"
+    ).split(),
+    "americas": (
+        "AG AI AR AW BB BL BM BO BQ BR BS BZ CA CL CO CR CU CW "
+        "DM DO EC FK GD GF GL GP GT GY HN HT JM KN KY LC MF MQ "
+        "MS MX NI PA PE PM PR PY SR SV SX TC TT US UY VC VE VG "
+        "VI"
+    ).split(),
+}
+DEFAULT_COUNTRY_GROUP = "other"
@@ -0,0 +1,239 @@
+"""
+Degraded mode of the searches, when ES is unavailable (circuit breaker open or
+search failing): the locations are answered, flagged as stale, from
+
+    * the store of the previous search results (sqlite, persisted across restarts
+      and shared by the workers), written in the background as results come in
+    * the table of major places generated at index build time (see
+      scripts/index_geonames_data.py), by name and country
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional
+
+from geonames_api import metrics
+from geonames_api.config import settings
+from geonames_api.models import GeonameItem, GeonameItemES
+from geonames_api.search import SearchResult, SearchStage, build_search_body
+from geonames_api.utils import normalize_name_key
+
+logger = logging.getLogger(__name__)
+
+STORE = "store"
+MAJOR_PLACES = "major_places"
+
+
+def get_stages_key(stages: List[SearchStage]) -> str:
+    """
+    Key of a location in the store: its last (widest) search
+    """
+    stage = stages[-1]
+    body = json.dumps([stage.header, build_search_body(stage)], sort_keys=True)
+    return hashlib.sha1(body.encode()).hexdigest()
+
+
+class StaleResultStore:
+    """
+    Search results by location key, written in batches (`flush`). Used from the
+    event loop (put) and from the executor threads (get, flush): the pending results
+    and the connection are guarded by locks
+    """
+
+    def __init__(self, path: str, max_candidates: int = 3):
+        self.path = path
+        self.max_candidates = max_candidates
+        self.pending: Dict[str, str] = {}
+        self.pending_lock = Lock()
+        self.connection = None
+        self.connection_lock = Lock()
+        self.pid = None
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        One connection per process (the workers are forked), shared by the threads
+        under `connection_lock`
+        """
+        if self.connection is None or self.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(
+                self.path, timeout=5, check_same_thread=False
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self.pid = os.getpid()
+        return self.connection
+
+    def put(self, key: str, candidates: List[GeonameItemES]):
+        """ """
+        value = json.dumps([x.dict() for x in candidates[: self.max_candidates]])
+        with self.pending_lock:
+            self.pending[key] = value
+
+    def get(self, key: str) -> Optional[List[GeonameItemES]]:
+        """
+        :return: None when the key isn't stored or the store can't be read
+        """
+        with self.pending_lock:
+            value = self.pending.get(key)
+        if value is None:
+            try:
+                with self.connection_lock:
+                    row = (
+                        self.connect()
+                        .execute("SELECT value FROM results WHERE key = ?", (key,))
+                        .fetchone()
+                    )
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Stale results store read failed: {e!r}")
+                metrics.incr("fallback.store.errors")
+                return None
+            value = row[0] if row else None
+        if value is None:
+            return None
+        return [GeonameItemES.parse_obj(x) for x in json.loads(value)]
+
+    def flush(self):
+        """
+        Write the pending results, they're kept pending if the store can't be
+        written
+        """
+        with self.pending_lock:
+            if not self.pending:
+                return
+            items, self.pending = list(self.pending.items()), {}
+        try:
+            with self.connection_lock, self.connect() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", items
+                )
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Stale results store write failed: {e!r}")
+            metrics.incr("fallback.store.errors")
+            with self.pending_lock:
+                # the results put in the meantime are newer
+                self.pending = {**dict(items), **self.pending}
+            return
+        metrics.incr("fallback.store.written", len(items))
+
+
+def load_major_places(path: str) -> Mapping[str, GeonameItem]:
+    """
+    Major places lookup table: "<country code>:<name key>" and "<name key>" =>
+    most populated place of that name
+    """
+    if not path or not os.path.exists(path):
+        logger.info(f"No major places found at: {path}")
+        return MappingProxyType({})
+    with open(path) as f:
+        places = [GeonameItem.parse_obj(x) for x in json.load(f)]
+    table = {}
+    for place in sorted(places, key=lambda x: -(x.population or 0)):
+        names = [place.name, place.asciiname] + [
+            x.name for x in place.alternative_names
+        ]
+        for name in names:
+            key = normalize_name_key(name)
+            table.setdefault(f"{place.country_code}:{key}", place)
+            table.setdefault(key, place)
+    return MappingProxyType(table)
+
+
+stale_result_store = StaleResultStore(settings.stale_store_path)
+major_places = load_major_places(settings.major_places_path)
+
+
+def lookup_major_place(name: str, country_code: str = None) -> Optional[GeonameItem]:
+    """ """
+    if not name:
+        return None
+    key = normalize_name_key(name)
+    if country_code:
+        return major_places.get(f"{country_code}:{key}")
+    return major_places.get(key)
+
+
+def get_fallback_result(
+    stages: List[SearchStage], candidates: Optional[List[GeonameItemES]] = None
+) -> SearchResult:
+    """
+    :param candidates: stored results of the location (see get_fallback_results_async)
+    """
+    if candidates is not None:
+        metrics.incr("fallback.store.hit")
+        return SearchResult(candidates=candidates, fallback=STORE)
+    stage = stages[-1]
+    place = lookup_major_place(stage.place_name, stage.country_code)
+    if place is not None:
+        metrics.incr("fallback.major_places.hit")
+        return SearchResult(
+            candidates=[GeonameItemES(score=0.0, **place.dict())],
+            fallback=MAJOR_PLACES,
+        )
+    metrics.incr("fallback.miss")
+    return SearchResult(fallback=MAJOR_PLACES)
+
+
+def get_stored_results(
+    batch_stages: List[List[SearchStage]],
+) -> List[Optional[List[GeonameItemES]]]:
+    """ """
+    return [
+        stale_result_store.get(get_stages_key(stages)) if stages else None
+        for stages in batch_stages
+    ]
+
+
+async def get_fallback_results_async(
+    batch_stages: List[List[SearchStage]],
+) -> List[SearchResult]:
+    """
+    Fallback results of a batch, the store is read in a thread (sqlite I/O)
+    """
+    loop = asyncio.get_running_loop()
+    stored_results = await loop.run_in_executor(None, get_stored_results, batch_stages)
+    return [
+        get_fallback_result(stages, candidates) if stages else SearchResult()
+        for stages, candidates in zip(batch_stages, stored_results)
+    ]
+
+
+def store_search_results(
+    batch_stages: List[List[SearchStage]], search_results: List[SearchResult]
+):
+    """
+    Keep the matched results for the degraded mode (written by flush_periodically)
+    """
+    for stages, search_result in zip(batch_stages, search_results):
+        if stages and search_result.candidates:
+            stale_result_store.put(get_stages_key(stages), search_result.candidates)
+
+
+async def flush_async():
+    """
+    Write the pending results to the store, in a thread
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, stale_result_store.flush)
+
+
+async def flush_periodically(interval: float = 10):
+    """
+    Background task: write the pending results to the store (in a thread)
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_async()
+        except Exception:
+            logger.exception("Stale results store flush failed")
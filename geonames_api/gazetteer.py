@@ -0,0 +1,145 @@
+"""
+Columnar gazetteer artifact: the fully transformed geoname items (output of
+scripts/index_geonames_data.get_index_geoname_items_it) stored as an Arrow IPC
+file, memory-mapped by the readers (bulk indexing, in memory indices, analysis).
+
+The artifact is versioned by the checksums of the source files (and
+GAZETTEER_VERSION, to bump when the transformation changes), so it's only rebuilt
+when the geonames dumps change.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Generator, Iterable, List
+
+import pyarrow as pa
+
+from geonames_api.models import AlternativeName, GeonameItem
+
+GAZETTEER_VERSION = 1
+
+GAZETTEER_SCHEMA = pa.schema(
+    [
+        ("geonameid", pa.string()),
+        ("name", pa.string()),
+        ("asciiname", pa.string()),
+        ("alternative_names", pa.list_(pa.string())),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("feature_class", pa.string()),
+        ("feature_code", pa.string()),
+        ("country_code", pa.string()),
+        ("country", pa.string()),
+        ("admin1_code", pa.string()),
+        ("admin2_code", pa.string()),
+        ("admin3_code", pa.string()),
+        ("admin4_code", pa.string()),
+        ("population", pa.int64()),
+        ("elevation", pa.int64()),
+        ("dem", pa.int64()),
+        ("timezone", pa.string()),
+        ("postal_codes", pa.list_(pa.string())),
+        ("admin1_name", pa.string()),
+        ("admin2_name", pa.string()),
+    ]
+)
+
+
+def get_file_checksum(path: str, chunk_size: int = 1 << 20) -> str:
+    """ """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_sources_checksums(
+    source_paths: Dict[str, str], include_countries: List[str] = None
+) -> Dict[str, str]:
+    """
+    :param source_paths: source name => path
+    :return: source name => checksum, and the resulting artifact `version`
+    """
+    checksums = {name: get_file_checksum(path) for name, path in source_paths.items()}
+    h = hashlib.sha256(f"v{GAZETTEER_VERSION}".encode())
+    for name in sorted(checksums):
+        h.update(f"{name}:{checksums[name]}".encode())
+    if include_countries:
+        h.update(",".join(sorted(include_countries)).encode())
+    return {**checksums, "version": h.hexdigest()[:16]}
+
+
+def get_gazetteer_path(directory: str, version: str) -> str:
+    """ """
+    return os.path.join(directory, f"gazetteer-{version}.arrow")
+
+
+def get_gazetteer_row(item: GeonameItem) -> dict:
+    """ """
+    row = item.dict()
+    row["alternative_names"] = [x.name for x in item.alternative_names]
+    return row
+
+
+def write_gazetteer(
+    items: Iterable[GeonameItem],
+    path: str,
+    metadata: Dict[str, str] = None,
+    batch_size: int = 50000,
+) -> int:
+    """
+    Write the items as an (uncompressed, so memory-mappable) Arrow IPC file, the
+    file is written next to `path` and moved once complete
+
+    :param metadata: stored in the schema metadata (e.g. source checksums)
+    :return: number of items written
+    """
+    schema = GAZETTEER_SCHEMA.with_metadata(
+        {k: json.dumps(v) for k, v in (metadata or {}).items()}
+    )
+    tmp_path = f"{path}.tmp"
+    n_items = 0
+    rows = []
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for item in items:
+                rows.append(get_gazetteer_row(item))
+                if len(rows) >= batch_size:
+                    writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                    n_items += len(rows)
+                    rows = []
+            if rows:
+                writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                n_items += len(rows)
+    os.replace(tmp_path, path)
+    return n_items
+
+
+def read_gazetteer(path: str) -> pa.Table:
+    """
+    Memory-mapped (zero copy) gazetteer table
+    """
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def get_gazetteer_metadata(table: pa.Table) -> Dict[str, str]:
+    """ """
+    metadata = table.schema.metadata or {}
+    return {k.decode(): json.loads(v) for k, v in metadata.items()}
+
+
+def iter_gazetteer_items(table: pa.Table) -> Generator[GeonameItem, None, None]:
+    """
+    GeonameItem of each row, not validated again (validated when the gazetteer
+    was built)
+    """
+    for batch in table.to_batches():
+        for row in batch.to_pylist():
+            row["alternative_names"] = [
+                AlternativeName.construct(name=x, langs=None)
+                for x in row["alternative_names"] or []
+            ]
+            yield GeonameItem.construct(**row)
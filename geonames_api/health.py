@@ -0,0 +1,68 @@
+import logging
+import time
+from typing import List, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api.config import settings
+from geonames_api.models import ParseAndNormalizeRequestData
+from geonames_api.parse_and_normalize import (
+    parse_and_normalize_raw_location_batch_async,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def load_warmup_corpus(path: Optional[str]) -> List[ParseAndNormalizeRequestData]:
+    """
+    Warm-up corpus of frequent locations: one location per line, optionally
+    followed by a tab and its country code
+    """
+    if not path:
+        return []
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if not parts[0].strip():
+                continue
+            corpus.append(
+                ParseAndNormalizeRequestData(
+                    raw_location=parts[0],
+                    country_code=parts[1] if len(parts) > 1 and parts[1] else None,
+                )
+            )
+    return corpus
+
+
+async def warm_up(es: AsyncElasticsearch, corpus: List[ParseAndNormalizeRequestData]):
+    """
+    Replay the corpus through the full parse and normalize pipeline: warms libpostal,
+    the ES caches (filters, routed shards, ...) and the in process caches
+    """
+    start = time.perf_counter()
+    batch_size = settings.warmup_batch_size
+    for i in range(0, len(corpus), batch_size):
+        await parse_and_normalize_raw_location_batch_async(
+            es=es, batch=corpus[i : i + batch_size]
+        )
+    logger.info(
+        f"Warm-up: {len(corpus)} locations in {time.perf_counter() - start:.1f}s"
+    )
+
+
+async def get_es_status(es: AsyncElasticsearch) -> dict:
+    """
+    ES connectivity and the concrete indices behind the geonames index / alias
+    """
+    status = {"connected": False, "indices": None}
+    try:
+        status["connected"] = await es.ping(request_timeout=2)
+        if status["connected"]:
+            aliases = await es.indices.get_alias(
+                index=settings.geonames_index, request_timeout=2
+            )
+            status["indices"] = sorted(aliases.keys())
+    except Exception as e:
+        logger.warning(f"ES health check failed: {e}")
+    return status
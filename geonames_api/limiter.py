@@ -0,0 +1,166 @@
+"""
+Adaptive concurrency limit of the ES searches (AIMD): the limit grows by ~1 per
+window of searches completed under the latency target while it's in use, and is
+multiplied by `backoff` for each search over the target or failing. Searches over
+the limit wait in a bounded queue, and are shed with a 429 (and Retry-After) when
+the queue is full or the wait times out, instead of piling up in the event loop.
+
+A slot is held by one msearch (one stage of a batch, see
+search.staged_msearch_async), and its latency is compared to the target per search
+of the msearch: a batch of 500 locations on a healthy ES takes longer than a single
+location, without being a sign of overload.
+
+Exposed in the metrics: gauges `limiter.<name>.limit / in_flight / queued`,
+counters `limiter.<name>.total / waited / rejected` and the rejection rate.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque
+
+from fastapi import HTTPException
+
+from geonames_api import metrics
+from geonames_api.config import settings
+
+
+class Overloaded(HTTPException):
+    """ """
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail="Too many pending requests, retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class AdaptiveConcurrencyLimiter:
+    """ """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target_ms: float,
+        queue_size: int,
+        queue_timeout: float,
+        backoff: float = 0.9,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_ms = latency_target_ms
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        metrics.register_rate(
+            f"limiter.{name}.rejection_rate",
+            numerator=f"limiter.{name}.rejected",
+            denominator=f"limiter.{name}.total",
+        )
+        self.update_gauges()
+
+    def update_gauges(self):
+        """ """
+        metrics.set_gauge(f"limiter.{self.name}.limit", self.limit)
+        metrics.set_gauge(f"limiter.{self.name}.in_flight", self.in_flight)
+        metrics.set_gauge(f"limiter.{self.name}.queued", len(self.waiters))
+
+    def get_retry_after(self) -> int:
+        """
+        Seconds to drain the queue at the current limit and target latency
+        """
+        batches = (len(self.waiters) + 1) / max(self.limit, 1)
+        return max(1, math.ceil(batches * self.latency_target_ms / 1000))
+
+    def reject(self):
+        """ """
+        metrics.incr(f"limiter.{self.name}.rejected")
+        raise Overloaded(retry_after=self.get_retry_after())
+
+    async def acquire(self):
+        """ """
+        metrics.incr(f"limiter.{self.name}.total")
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            self.update_gauges()
+            return
+        if len(self.waiters) >= self.queue_size:
+            self.reject()
+        #
+        metrics.incr(f"limiter.{self.name}.waited")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.update_gauges()
+        try:
+            # the slot is taken by release() when the waiter is woken up
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.reject()
+        except asyncio.CancelledError:
+            # cancelled (e.g. client gone) after being handed a slot
+            if waiter.done() and not waiter.cancelled():
+                self.in_flight -= 1
+                self.wake_waiters()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            self.update_gauges()
+
+    def release(self, latency_ms: float, ok: bool):
+        """
+        :param latency_ms: latency per search of the msearch
+        """
+        if not ok or latency_ms > self.latency_target_ms:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif self.in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.in_flight -= 1
+        self.wake_waiters()
+        self.update_gauges()
+
+    def wake_waiters(self):
+        """
+        Hand the free slots over to the waiting searches
+        """
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, n_searches: int = 1):
+        """
+        :param n_searches: number of searches of the msearch run in the slot
+        """
+        await self.acquire()
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            latency_ms = 1000 * (time.perf_counter() - start)
+            self.release(latency_ms / max(n_searches, 1), ok)
+
+
+search_limiter = AdaptiveConcurrencyLimiter(
+    "search",
+    initial_limit=settings.limiter_initial_limit,
+    min_limit=settings.limiter_min_limit,
+    max_limit=settings.limiter_max_limit,
+    latency_target_ms=settings.limiter_latency_target_ms,
+    queue_size=settings.limiter_queue_size,
+    queue_timeout=settings.limiter_queue_timeout,
+)
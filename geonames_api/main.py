@@ -1,15 +1,26 @@
+import asyncio
 import logging
 from threading import Lock
-from typing import List
+from typing import List, Optional
 
-from elasticsearch import Elasticsearch, AsyncElasticsearch
-from fastapi import FastAPI, Depends
+from elasticsearch import AsyncElasticsearch
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query
 from postal.parser import parse_address
 from pydantic import BaseModel
 from starlette.requests import Request
+from starlette.responses import Response
 
+from geonames_api import metrics
+from geonames_api.autocomplete import autocomplete_async
+from geonames_api.circuit_breaker import probe_while_open, search_breaker
 from geonames_api.config import settings
+from geonames_api.encoding import BatchRoute, NegotiatedResponse
+from geonames_api.es_client import create_es_async
+from geonames_api.fallback import flush_async, flush_periodically
+from geonames_api.health import get_es_status, load_warmup_corpus, warm_up
 from geonames_api.models import (
+    AutocompleteSuggestion,
+    GeonameItem,
     ParsedAndNormalizedResult,
     JobLocation,
     NormalizedLocationResult,
@@ -18,6 +29,9 @@ from geonames_api.models import (
     NormalizeRequestData,
     NormalizeRequestBatchData,
     ParsedLocation,
+    PlacesBatchRequestData,
+    ReverseGeocodingBatchRequestData,
+    ReverseGeocodingResult,
 )
 from geonames_api.parse_and_normalize import (
     parse_and_normalize_raw_location_async,
@@ -25,39 +39,151 @@ from geonames_api.parse_and_normalize import (
     normalise_location_batch_async,
     parse_raw_location,
 )
+from geonames_api.places import check_geonameid_ids_async, get_places_async
+from geonames_api.reverse_geocoding import (
+    MissingFeatureClass,
+    ReverseGeocoder,
+    load_reverse_geocoder,
+)
+from geonames_api.search_templates import register_search_templates_until_done_async
 
 logger = logging.getLogger(__name__)
 
 
 app = FastAPI(title="geonames-api", openapi_url="/api/v1/openapi.json")
 
+# batch routes, also accepting / returning MessagePack, NDJSON and compressed
+# bodies (see geonames_api.encoding)
+batch_router = APIRouter(
+    route_class=BatchRoute, default_response_class=NegotiatedResponse
+)
+
+
+def load_models():
+    """
+    Load the read-only models and tables (libpostal, reverse geocoding data), only
+    once: the preload launcher (geonames_api.server) calls it before forking the
+    workers so they share these pages
+    """
+    if getattr(app, "models_loaded", False):
+        return
+    logger.info("Loading postal model...")
+    parse_address("21 rue Cujas, Paris")
+    #
+    logger.info("Loading reverse geocoding data...")
+    app.reverse_geocoder = load_reverse_geocoder(settings.reverse_geocoding_path)
+    app.models_loaded = True
+
+
+async def warm_up_and_set_ready():
+    """
+    The api is ready once the search templates are registered (retried until they
+    are, the searches can't run without them) and the warm-up is done (best effort,
+    ready even if it fails)
+    """
+    if settings.search_templates:
+        try:
+            await register_search_templates_until_done_async(app.es_async)
+        except Exception:
+            logger.exception("Search templates registration failed, not ready")
+            return
+    try:
+        await warm_up(app.es_async, load_warmup_corpus(settings.warmup_corpus_path))
+    except Exception:
+        logger.exception("Warm-up failed")
+    app.ready = True
+
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("startup: loading db connection and models...")
+    app.ready = False
     # add mongo, es, ...
-    app.es = Elasticsearch(**settings.es.es_client_params)
-    app.es_async = AsyncElasticsearch(**settings.es.es_client_params)
+    app.es_async = create_es_async()
     #
-    logger.info("Loading postal model...")
-    parse_address("21 rue Cujas, Paris")
+    load_models()
+    # the api is ready once the warm-up is done
+    app.warmup_task = asyncio.create_task(warm_up_and_set_ready())
+    # degraded mode: ES probes while the breaker is open, stale results writes
+    app.breaker_tasks = []
+    if settings.circuit_breaker:
+        app.breaker_tasks = [
+            asyncio.create_task(probe_while_open(app.es_async, search_breaker)),
+            asyncio.create_task(flush_periodically()),
+        ]
     #
     logger.info("startup done.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info("shutdown: closing db connections...")
+    app.warmup_task.cancel()
+    for task in app.breaker_tasks:
+        task.cancel()
+    if settings.circuit_breaker:
+        await flush_async()
+    await app.es_async.close()
+
+
 @app.get("/")
 async def read_root():
     return {"asgard": "geonames-api"}
 
 
-def get_es(request: Request) -> Elasticsearch:
-    return request.app.es
+@app.get("/health/live")
+async def liveness_route():
+    """ """
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def readiness_route(response: Response):
+    """
+    Ready when the models are loaded, the warm-up is done and ES is reachable
+    """
+    es_status = await get_es_status(app.es_async)
+    status = {
+        "ready": False,
+        "libpostal_loaded": getattr(app, "models_loaded", False),
+        "warmup_done": getattr(app, "ready", False),
+        "es": es_status,
+        "index": settings.geonames_index,
+    }
+    status["ready"] = (
+        status["libpostal_loaded"] and status["warmup_done"] and es_status["connected"]
+    )
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@app.get("/metrics")
+async def metrics_route():
+    """ """
+    return metrics.get_metrics()
 
 
 def get_es_async(request: Request) -> AsyncElasticsearch:
     return request.app.es_async
 
 
+async def get_places_es_async(request: Request) -> AsyncElasticsearch:
+    """
+    Client of the places routes, once the index is checked to have the geonameids
+    as document ids (see places.check_geonameid_ids_async)
+    """
+    await check_geonameid_ids_async(request.app.es_async)
+    return request.app.es_async
+
+
+def get_reverse_geocoder(request: Request) -> ReverseGeocoder:
+    reverse_geocoder = request.app.reverse_geocoder
+    if reverse_geocoder is None:
+        raise HTTPException(status_code=503, detail="Reverse geocoding not loaded")
+    return reverse_geocoder
+
+
 @app.post("/parse_and_normalize_raw_location", response_model=ParsedAndNormalizedResult)
 async def parse_and_normalize_raw_location_route(
     data: ParseAndNormalizeRequestData,
@@ -70,7 +196,7 @@ async def parse_and_normalize_raw_location_route(
     return result
 
 
-@app.post(
+@batch_router.post(
     "/parse-and-normalize-raw-location-batch",
     response_model=List[ParsedAndNormalizedResult],
 )
@@ -93,7 +219,7 @@ async def normalize_job_location_route(
     return results[0]
 
 
-@app.post(
+@batch_router.post(
     "/normalize-job-location-batch", response_model=List[NormalizedLocationResult]
 )
 async def normalize_job_location_batch_route(
@@ -144,7 +270,7 @@ async def parse_location_route(location: str):
     )
 
 
-@app.post("/parse-location-batch", response_model=ParseLocationBatchResponse)
+@batch_router.post("/parse-location-batch", response_model=ParseLocationBatchResponse)
 async def parse_location_batch(data: ParseLocationBatchRequestData):
     """ """
     parsed_locations = []
@@ -152,3 +278,84 @@ async def parse_location_batch(data: ParseLocationBatchRequestData):
         parsed_locations.append(parse_raw_location(raw_location=item.location))
     #
     return ParseLocationBatchResponse(success=True, data=parsed_locations)
+
+
+@app.get("/reverse-geocode", response_model=ReverseGeocodingResult)
+async def reverse_geocode_route(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    feature_class: str = Query("P", regex="^[PA]$"),
+    min_population: int = 0,
+    reverse_geocoder: ReverseGeocoder = Depends(get_reverse_geocoder),
+):
+    """ """
+    try:
+        return reverse_geocoder.reverse_geocode(
+            latitude, longitude, feature_class, min_population=min_population
+        )
+    except MissingFeatureClass as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@batch_router.post(
+    "/reverse-geocode-batch", response_model=List[ReverseGeocodingResult]
+)
+async def reverse_geocode_batch_route(
+    data: ReverseGeocodingBatchRequestData,
+    reverse_geocoder: ReverseGeocoder = Depends(get_reverse_geocoder),
+):
+    """
+    The results are already plain dicts of the response model, returned as is
+    (validating them would cost more than the lookups)
+    """
+    try:
+        results = reverse_geocoder.reverse_geocode_batch(
+            [x.latitude for x in data.points],
+            [x.longitude for x in data.points],
+            data.feature_class,
+            min_population=data.min_population,
+        )
+    except MissingFeatureClass as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return NegotiatedResponse(content=results)
+
+
+@app.get("/places/{geonameid}", response_model=GeonameItem)
+async def get_place_route(
+    geonameid: str,
+    es: AsyncElasticsearch = Depends(get_places_es_async),
+):
+    """ """
+    place = (await get_places_async(es, [geonameid]))[0]
+    if place is None:
+        raise HTTPException(status_code=404, detail=f"Unknown geonameid: {geonameid}")
+    return place
+
+
+@batch_router.post("/places-batch", response_model=List[Optional[GeonameItem]])
+async def get_places_batch_route(
+    data: PlacesBatchRequestData,
+    es: AsyncElasticsearch = Depends(get_places_es_async),
+):
+    """
+    Places in the same order as the requested geonameids, null for unknown ids
+    """
+    return await get_places_async(es, data.geonameids)
+
+
+@app.get("/autocomplete", response_model=List[AutocompleteSuggestion])
+async def autocomplete_route(
+    q: str = Query(..., min_length=1, max_length=100),
+    country_code: str = Query(None, min_length=2, max_length=2),
+    size: int = Query(5, ge=1, le=20),
+    es: AsyncElasticsearch = Depends(get_es_async),
+):
+    """
+    Type-ahead suggestions of places for a prefix, by decreasing population
+    """
+    return await autocomplete_async(
+        es, q, country_code=country_code.upper() if country_code else None, size=size
+    )
+
+
+app.include_router(batch_router)
@@ -0,0 +1,94 @@
+from collections import defaultdict, deque
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+lock = Lock()
+
+counters = defaultdict(int)
+
+# rate name => (numerator counter, denominator counter)
+rates: Dict[str, Tuple[str, str]] = {}
+
+# current values (limits, in flight requests, ...)
+gauges: Dict[str, float] = {}
+
+
+class LatencyWindow:
+    """
+    Latencies (ms) of the last `size` observations
+    """
+
+    def __init__(self, size: int = 1000):
+        self.values = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.values)
+
+    def observe(self, value: float):
+        """ """
+        self.values.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """ """
+        if not self.values:
+            return None
+        return percentile(list(self.values), p)
+
+    def summary(self) -> dict:
+        """ """
+        return {
+            "count": len(self.values),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+latencies: Dict[str, LatencyWindow] = defaultdict(LatencyWindow)
+
+
+def incr(name: str, value: int = 1):
+    """ """
+    with lock:
+        counters[name] += value
+
+
+def set_gauge(name: str, value: float):
+    """ """
+    gauges[name] = value
+
+
+def observe_latency(name: str, value: float):
+    """ """
+    latencies[name].observe(value)
+
+
+def register_rate(name: str, numerator: str, denominator: str):
+    """ """
+    rates[name] = (numerator, denominator)
+
+
+def get_rate(name: str) -> float:
+    """ """
+    numerator, denominator = rates[name]
+    total = counters.get(denominator, 0)
+    if not total:
+        return 0.0
+    return counters.get(numerator, 0) / total
+
+
+def get_metrics() -> dict:
+    """ """
+    return {
+        "counters": dict(counters),
+        "rates": {name: get_rate(name) for name in rates},
+        "gauges": dict(gauges),
+        "latencies_ms": {name: x.summary() for name, x in list(latencies.items())},
+    }
+
+
+def percentile(values: List[float], p: float) -> float:
+    """ """
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
@@ -40,12 +40,33 @@ class GeonameItem(BaseModel):
     admin2_name: str = None
 
 
+class AutocompleteSuggestion(BaseModel):
+    """ """
+
+    text: str
+    geonameid: str
+    name: str
+    country_code: str = None
+    admin1_name: str = None
+    admin2_name: str = None
+    feature_class: str = None
+    feature_code: str = None
+    population: int = None
+
+
 class GeonameItemES(GeonameItem):
     """ """
 
     score: float
 
 
+class ReverseGeocodingResult(BaseModel):
+    """ """
+
+    place: GeonameItem
+    distance_km: float
+
+
 class ParsedLocation(BaseModel):
     """
     Object to store result from pypostal parsing
@@ -115,9 +136,34 @@ class NormalizedLocationResult(BaseModel):
     match: Optional[GeonameItemES] = None
     candidates: List[GeonameItemES] = []
     query: dict = None
+    # served in degraded mode (ES unavailable): from a previous result ("store") or
+    # the major places table ("major_places")
+    stale: bool = False
+    fallback: str = None
 
 
 class ParsedAndNormalizedResult(NormalizedLocationResult):
     """ """
 
     parsed_location: ParsedLocation
+
+
+class ReverseGeocodingPoint(BaseModel):
+    """ """
+
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
+
+class ReverseGeocodingBatchRequestData(BaseModel):
+    """ """
+
+    points: List[ReverseGeocodingPoint]
+    feature_class: constr(regex="^[PA]$") = "P"
+    min_population: int = 0
+
+
+class PlacesBatchRequestData(BaseModel):
+    """ """
+
+    geonameids: List[str] = Field(..., max_items=1000)
@@ -0,0 +1,221 @@
+"""
+In process normalizer, for the batch jobs written in Python: the same parsing,
+search and matching as the api routes (the functions of
+geonames_api.parse_and_normalize), without the HTTP round trips and the JSON
+encoding of the batches.
+
+    with GeonamesNormalizer() as normalizer:
+        results = normalizer.normalize_job_locations(locations)
+
+    async with GeonamesNormalizer() as normalizer:
+        results = await normalizer.normalize_job_locations_async(locations)
+
+The locations are split in batches of `batch_size`, `concurrency` batches are
+searched at once. The sync methods run on the normalizer's own event loop (use the
+async methods from a running loop). libpostal parses one location at a time per
+process: with `n_processes`, the sync methods parse and search in a pool of
+processes, each with its own normalizer (ES client, caches). Otherwise the
+normalizer shares the process caches (negative cache, candidate names) with the
+routes.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api.circuit_breaker import probe_while_open, search_breaker
+from geonames_api.config import settings
+from geonames_api.es_client import create_es_async
+from geonames_api.fallback import flush_async, flush_periodically
+from geonames_api.models import (
+    JobLocation,
+    NormalizedLocationResult,
+    ParseAndNormalizeRequestData,
+    ParsedAndNormalizedResult,
+)
+from geonames_api.parse_and_normalize import (
+    normalise_location_batch_async,
+    parse_and_normalize_raw_location_batch_async,
+)
+
+logger = logging.getLogger(__name__)
+
+# normalizer of the pool processes (see init_worker)
+worker_normalizer: Optional["GeonamesNormalizer"] = None
+
+
+class GeonamesNormalizer:
+    """ """
+
+    def __init__(
+        self, batch_size: int = 100, concurrency: int = 4, n_processes: int = 0
+    ):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.n_processes = n_processes
+        # own event loop of the sync methods
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # the async clients are bound to the loop they're created in
+        self.clients: Dict[asyncio.AbstractEventLoop, AsyncElasticsearch] = {}
+        self.tasks: Dict[asyncio.AbstractEventLoop, List[asyncio.Task]] = {}
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self) -> "GeonamesNormalizer":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    async def __aenter__(self) -> "GeonamesNormalizer":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close_async()
+
+    def get_es_async(self) -> AsyncElasticsearch:
+        """
+        Client of the running loop, created with the background tasks of the
+        degraded mode (as at the api startup) on first use
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self.clients:
+            self.clients[loop] = create_es_async()
+            self.tasks[loop] = []
+            if settings.circuit_breaker:
+                self.tasks[loop] = [
+                    loop.create_task(
+                        probe_while_open(self.clients[loop], search_breaker)
+                    ),
+                    loop.create_task(flush_periodically()),
+                ]
+        return self.clients[loop]
+
+    async def map_batches_async(
+        self,
+        function: Callable[[AsyncElasticsearch, list], Awaitable[list]],
+        items: Sequence,
+    ) -> list:
+        """
+        Run `function` on the batches of items, `concurrency` at a time, and return
+        the results in the order of the items
+        """
+        es = self.get_es_async()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch: list) -> list:
+            async with semaphore:
+                return await function(es, batch)
+
+        batches = [
+            list(items[i : i + self.batch_size])
+            for i in range(0, len(items), self.batch_size)
+        ]
+        results = await asyncio.gather(*[run(x) for x in batches])
+        return [x for batch_results in results for x in batch_results]
+
+    async def parse_and_normalize_raw_locations_async(
+        self, items: Sequence[ParseAndNormalizeRequestData]
+    ) -> List[ParsedAndNormalizedResult]:
+        """
+        Same results as the /parse-and-normalize-raw-location-batch route
+        """
+        return await self.map_batches_async(
+            lambda es, batch: parse_and_normalize_raw_location_batch_async(
+                es=es, batch=batch
+            ),
+            items,
+        )
+
+    async def normalize_job_locations_async(
+        self, locations: Sequence[JobLocation]
+    ) -> List[NormalizedLocationResult]:
+        """
+        Same results as the /normalize-job-location-batch route
+        """
+        return await self.map_batches_async(
+            lambda es, batch: normalise_location_batch_async(es=es, locations=batch),
+            locations,
+        )
+
+    def run(self, method: str, items: Sequence) -> list:
+        """
+        Run the async `method` on the own loop of the normalizer, or on chunks of
+        the items in the pool of processes
+        """
+        if self.n_processes > 0 and len(items) > self.batch_size:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    self.n_processes,
+                    initializer=init_worker,
+                    initargs=(self.batch_size, self.concurrency),
+                )
+            size = self.batch_size * self.concurrency
+            chunks = [list(items[i : i + size]) for i in range(0, len(items), size)]
+            results = self.pool.map(run_in_worker, [method] * len(chunks), chunks)
+            return [x for chunk_results in results for x in chunk_results]
+        #
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(getattr(self, method)(items))
+
+    def parse_and_normalize_raw_locations(
+        self, items: Sequence[ParseAndNormalizeRequestData]
+    ) -> List[ParsedAndNormalizedResult]:
+        """ """
+        return self.run("parse_and_normalize_raw_locations_async", items)
+
+    def normalize_job_locations(
+        self, locations: Sequence[JobLocation]
+    ) -> List[NormalizedLocationResult]:
+        """ """
+        return self.run("normalize_job_locations_async", locations)
+
+    async def close_async(self):
+        """
+        Close the client of the running loop (the normalizer can't be used from
+        this loop anymore)
+        """
+        loop = asyncio.get_running_loop()
+        for task in self.tasks.pop(loop, []):
+            task.cancel()
+        if loop in self.clients:
+            await self.clients.pop(loop).close()
+        if settings.circuit_breaker:
+            await flush_async()
+
+    def close(self):
+        """
+        Close the pool of processes and the own loop of the sync methods
+        """
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.loop is not None:
+            self.loop.run_until_complete(self.close_async())
+            self.loop.close()
+            self.loop = None
+        if self.clients:
+            logger.warning(
+                "Normalizer closed with open clients, use close_async from their loop"
+            )
+
+
+def init_worker(batch_size: int, concurrency: int):
+    """
+    Initializer of the pool processes
+    """
+    global worker_normalizer
+    worker_normalizer = GeonamesNormalizer(
+        batch_size=batch_size, concurrency=concurrency
+    )
+    # closed (client, stale results) when the process exits
+    Finalize(worker_normalizer, worker_normalizer.close, exitpriority=10)
+
+
+def run_in_worker(method: str, items: list) -> list:
+    """ """
+    return worker_normalizer.run(method, items)
@@ -1,15 +1,20 @@
+import asyncio
 import logging
 import re
+import time
+from functools import lru_cache, partial
 from threading import Lock
-from typing import List, Optional, Union
+from typing import List, Optional, Set, Tuple, Union
 
-import cytoolz
-import textdistance
-from elasticsearch import Elasticsearch, AsyncElasticsearch
-from ftfy import fix_text
+import numpy as np
+from elasticsearch import Elasticsearch, AsyncElasticsearch, ElasticsearchException
 from postal.parser import parse_address
 
+from geonames_api import metrics
+from geonames_api.cache import LRUCache
+from geonames_api.circuit_breaker import CircuitOpen, search_breaker
 from geonames_api.config import settings
+from geonames_api.fallback import get_fallback_results_async, store_search_results
 from geonames_api.models import (
     ParsedLocation,
     GeonameItemES,
@@ -18,16 +23,33 @@ from geonames_api.models import (
     NormalizedLocationResult,
     ParseAndNormalizeRequestData,
 )
-from geonames_api.queries import (
-    build_query_from_parsed_location,
-    build_query_from_job_location,
+from geonames_api.limiter import search_limiter
+from geonames_api.pre_parser import try_pre_parse_location
+from geonames_api.ranking import get_feature_rank
+from geonames_api.search import (
+    SearchResult,
+    SearchStage,
+    get_job_location_search_stages,
+    get_parsed_location_search_stages,
+    staged_msearch,
+    staged_msearch_async,
 )
-from geonames_api.utils import is_bad_loc
+from geonames_api.shadow import maybe_shadow_search
+from geonames_api.similarity import jaro_winkler_similarities
+from geonames_api.spelling import spelling_corrector
+from geonames_api.text import fix_text
+from geonames_api.utils import is_bad_loc, normalize_name_key
 
 logger = logging.getLogger(__name__)
 
 lock = Lock()
 
+# normalized raw location => parsed location, for the known bad locations and the
+# locations ES couldn't match: they skip the parsing and the search
+negative_cache = LRUCache(
+    "negative", maxsize=settings.negative_cache_size, ttl=settings.negative_cache_ttl
+)
+
 not_none_fields_mappings = [
     {"house_number": "postcode", "road": "city"},
     {"house_number": "postcode", "house": "city"},
@@ -39,6 +61,12 @@ french_city_code_pattern = re.compile("([\w\-'\s]+)\s[\(-]?(\d{2})[\)]?", re.UNI
 
 def parse_raw_location(raw_location: str, country_code: str = None) -> ParsedLocation:
     """ """
+    if settings.pre_parser:
+        parsed_location = try_pre_parse_location(raw_location, country_code)
+        if parsed_location is not None:
+            parsed_location.raw = raw_location
+            return parsed_location
+    #
     with lock:
         p = {k: v.strip(" ,") for v, k in parse_address(raw_location)}
     parsed_location = ParsedLocation.parse_obj(p)
@@ -111,193 +139,460 @@ def group_by_margin(results: List[GeonameItemES], margin: float = 1):
     return groups
 
 
-FEATURE_CODE_RANK = {
-    "A": [
-        "ADM1",  # "a primary administrative division of a country, such as a state in the United States",
-        "ADM2",  # a subdivision of a first-order administrative division
-        "ADM3",  # a subdivision of a second-order administrative division
-        "ADM4",  # a subdivision of a third-order administrative division
-        "ADM5",  # a subdivision of a fourth-order administrative division
-        "ADMD",  # an administrative division of a country, undifferentiated as to administrative level
-        "PCLI",  # countries
-    ],
-    "P": [
-        "PPLC",  # capital
-        "PPLA",  # seat of a first-order administrative division	seat of a first-order administrative division (PPLC takes precedence over PPLA)
-        "PPL",  # a city, town, village, or other agglomeration of buildings where people live and work
-        "PPLA2",  # seat of a second-order administrative division
-        "PPLA3",  # seat of a third-order administrative division
-        "PPLA4",  # seat of a fourth-order administrative division
-        "PPLA5",  # seat of a fifth-order administrative division
-        "PPLS",
-    ],
-    "L": [
-        "RGN",  # region	an area distinguished by one or more observable physical or cultural characteristics
-        "RGNE",  # a region of a country established for economic development or for statistical purposes
-    ],
-}
+# the candidates names come back request after request
+normalize_name_key_cached = lru_cache(maxsize=100000)(normalize_name_key)
 
 
-def check_if_best_result_close_enough(
-    result: GeonameItemES, location: Union[ParsedLocation, JobLocation]
-):
+def get_name_keys_of_candidate(
+    candidate: GeonameItemES, alternative: bool = False
+) -> Set[str]:
     """ """
-    result_name_lower = result.asciiname.lower()
-    s = None
-    if location.city:
-        s = textdistance.jaro_winkler.normalized_similarity(
-            result_name_lower, location.city.lower()
-        )
+    if alternative:
+        names = [x.name for x in candidate.alternative_names]
+    else:
+        names = [candidate.name, candidate.asciiname]
+    return {normalize_name_key_cached(x) for x in names if x}
 
-    if s is not None and s < 0.5:
-        return False
 
-    #
-    return True
+def get_batch_name_similarities(
+    batch_candidates: List[List[GeonameItemES]], query_names: List[Optional[str]]
+) -> List[Optional[np.ndarray]]:
+    """
+    Name similarity (jaro winkler) of the candidates of a whole batch to their query
+    name (city), scored in one vectorized pass: best of the candidate name / ascii
+    name, then of its alternative names (second pass) for the candidates not
+    similar enough by name (e.g. "Koln" for "Cologne")
+
+    :return: similarities of the candidates of each location, None when the location
+        has no query name (not verified)
+    """
+    query_keys = [normalize_name_key(x) if x else None for x in query_names]
+    similarities = [
+        np.zeros(len(candidates)) if query_key else None
+        for candidates, query_key in zip(batch_candidates, query_keys)
+    ]
+    pending = [
+        (k, i)
+        for k, candidates in enumerate(batch_candidates)
+        if query_keys[k]
+        for i in range(len(candidates))
+    ]
+    for alternative in (False, True):
+        pairs, owners = [], []
+        for k, i in pending:
+            for key in get_name_keys_of_candidate(batch_candidates[k][i], alternative):
+                pairs.append((query_keys[k], key))
+                owners.append((k, i))
+        if pairs:
+            # the same names are often shared by several candidates
+            unique_pairs = list(dict.fromkeys(pairs))
+            scores = dict(
+                zip(unique_pairs, jaro_winkler_similarities(*zip(*unique_pairs)))
+            )
+            for (k, i), pair in zip(owners, pairs):
+                similarities[k][i] = max(similarities[k][i], scores[pair])
+        pending = [
+            (k, i)
+            for k, i in pending
+            if similarities[k][i] < settings.min_name_similarity
+        ]
+    return similarities
+
+
+def verify_candidates(
+    results: List[GeonameItemES], similarities: np.ndarray
+) -> Tuple[List[GeonameItemES], List[float]]:
+    """
+    Discard the results whose name is too far from the query name
+    """
+    verified = [
+        (result, similarity)
+        for result, similarity in zip(results, similarities)
+        if similarity >= settings.min_name_similarity
+    ]
+    if len(verified) < len(results):
+        metrics.incr("verification.discarded", len(results) - len(verified))
+    return [x for x, _ in verified], [x for _, x in verified]
 
 
 def select_best_matching_place(
     results: List[GeonameItemES],
     query_location: Union[ParsedLocation, JobLocation] = None,
+    similarities: Optional[np.ndarray] = None,
 ) -> Optional[GeonameItemES]:
-    """ """
+    """
+    With `settings.es_ranking` the feature code / population ranking is already
+    done by ES (rank_feature clauses) and the first hit is the best place,
+    otherwise the best place is the best ranked feature among the hits close to
+    the top score
+
+    :param query_location: location whose city name the results are verified
+        against, when the similarities aren't given
+    :param similarities: name similarities of the results to the query name (see
+        get_batch_name_similarities): the results not similar enough are discarded,
+        and the most similar result breaks the ties of feature rank
+    """
+    if similarities is None and query_location is not None:
+        similarities = get_batch_name_similarities([results], [query_location.city])[0]
+    if similarities is not None:
+        results, similarities = verify_candidates(results, similarities)
     if not results:
         return
 
-    gb = group_by_margin(results, margin=2)
-    #
-    fg = gb[0]
-    #
-    gb_class = cytoolz.groupby(lambda x: x.feature_class, fg)
-    if "P" in gb_class:
-        best_place = sorted(
-            gb_class["P"], key=lambda x: FEATURE_CODE_RANK["P"].index(x.feature_code)
-        )[0]
-    elif "A" in gb_class:
-        best_place = sorted(
-            gb_class["A"], key=lambda x: FEATURE_CODE_RANK["A"].index(x.feature_code)
-        )[0]
-    elif "L" in gb_class:
-        best_place = sorted(
-            gb_class["L"], key=lambda x: FEATURE_CODE_RANK["L"].index(x.feature_code)
-        )[0]
+    if settings.es_ranking:
+        best_place = results[0]
     else:
-        raise ValueError("Items with unknown feature class in results :S")
-
-    #
-    if query_location:
-        if not check_if_best_result_close_enough(best_place, query_location):
-            logger.info(
-                f"Discarding place: {best_place} because string distance is too high compared to {query_location}"
-            )
-            best_place = None
+        gb = group_by_margin(results, margin=2)
+        #
+        fg = gb[0]
+        #
+        similarity = dict(zip(map(id, results), similarities or []))
+        best_place = min(
+            fg,
+            key=lambda x: (
+                get_feature_rank(x.feature_class, x.feature_code),
+                -similarity.get(id(x), 0),
+            ),
+        )
     #
     return best_place
 
 
-def parse_and_normalize_raw_location(
-    es: Elasticsearch, raw_location: str, country_code: str = None
-) -> ParsedAndNormalizedResult:
+def get_locations_name_similarities(
+    locations: List[Optional[Union[ParsedLocation, JobLocation]]],
+    search_results: List[SearchResult],
+) -> List[Optional[np.ndarray]]:
+    """
+    Name similarities of the candidates of a batch to their location city name,
+    when the verification is enabled
+    """
+    if not settings.candidate_verification:
+        return [None] * len(search_results)
+    return get_batch_name_similarities(
+        [x.candidates for x in search_results],
+        [x.city if x is not None else None for x in locations],
+    )
+
+
+def get_negative_cache_key(raw_location: str, country_code: str = None) -> tuple:
     """ """
-    match = None
+    return " ".join(raw_location.lower().split()), country_code
+
+
+def get_raw_location_search_stages(
+    raw_location: str, country_code: str = None
+) -> Tuple[ParsedLocation, List[SearchStage]]:
+    """
+    Parse the raw location and build its search stages, no stages for known bad or
+    unmatched locations (negative cache, checked before parsing)
+    """
+    key = get_negative_cache_key(raw_location, country_code)
+    cached_parsed_location = negative_cache.get(key)
+    if cached_parsed_location is not None:
+        return cached_parsed_location, []
+    #
     raw_location = fix_text(raw_location)
     parsed_location = parse_raw_location(raw_location, country_code=country_code)
-    #
     if is_bad_loc(parsed_location.city or parsed_location.raw):
         logger.info(f"Got a bad location: {parsed_location.raw}")
-        results = []
-        query = None
-    else:
-        query = build_query_from_parsed_location(
-            parsed_location, country_code=country_code
+        negative_cache.set(key, parsed_location)
+        return parsed_location, []
+    #
+    stages = get_parsed_location_search_stages(
+        parsed_location, country_code=country_code
+    )
+    return parsed_location, stages
+
+
+def cache_if_unmatched(
+    raw_location: str,
+    country_code: str,
+    parsed_location: ParsedLocation,
+    search_result: SearchResult,
+):
+    """ """
+    if search_result.stage and not search_result.candidates:
+        negative_cache.set(
+            get_negative_cache_key(raw_location, country_code), parsed_location
         )
-        es_resp = es.search(query=query, index=settings.geonames_index)
-        results = [
-            GeonameItemES.parse_obj({"score": x["_score"], **x["_source"]})
-            for x in es_resp["hits"]["hits"]
-        ]
 
-        if results:
-            match = select_best_matching_place(results)
 
-    result = ParsedAndNormalizedResult(
+def build_parsed_and_normalized_result(
+    parsed_location: ParsedLocation,
+    search_result: SearchResult,
+    similarities: Optional[np.ndarray] = None,
+) -> ParsedAndNormalizedResult:
+    """ """
+    match = None
+    if search_result.candidates:
+        match = select_best_matching_place(
+            search_result.candidates, similarities=similarities
+        )
+    return ParsedAndNormalizedResult(
         match=match,
-        candidates=results,
+        candidates=search_result.candidates,
         parsed_location=parsed_location,
-        query=query,
+        query=search_result.query,
+        stale=bool(search_result.fallback),
+        fallback=search_result.fallback,
     )
 
-    return result
+
+def parse_and_normalize_raw_location(
+    es: Elasticsearch, raw_location: str, country_code: str = None
+) -> ParsedAndNormalizedResult:
+    """
+    Blocking version for scripts and notebooks, not used by the api: same parsing,
+    stages, negative cache and match selection as
+    parse_and_normalize_raw_location_async, but the search goes straight to ES
+    (no circuit breaker and degraded mode, no concurrency limit, no shadow search)
+    and the unmatched city names are not searched again with their spelling
+    correction
+    """
+    parsed_location, stages = get_raw_location_search_stages(
+        raw_location, country_code=country_code
+    )
+    search_result = staged_msearch(es, [stages])[0]
+    cache_if_unmatched(raw_location, country_code, parsed_location, search_result)
+    similarities = get_locations_name_similarities([parsed_location], [search_result])
+    return build_parsed_and_normalized_result(
+        parsed_location, search_result, similarities[0]
+    )
+
+
+async def limited_search_async(
+    es: AsyncElasticsearch, batch_stages: List[List[SearchStage]]
+) -> List[SearchResult]:
+    """
+    Staged search of a batch of locations, each msearch under the adaptive
+    concurrency limit when enabled (see geonames_api.limiter)
+    """
+    limiter = search_limiter if settings.limiter else None
+    return await staged_msearch_async(es, batch_stages, limiter=limiter)
+
+
+async def guarded_search_async(
+    es: AsyncElasticsearch, batch_stages: List[List[SearchStage]]
+) -> List[SearchResult]:
+    """
+    Search behind the circuit breaker (see geonames_api.circuit_breaker): when it's
+    open (but for the half open trials) or the search fails, the locations are answered in degraded mode (see
+    geonames_api.fallback), otherwise the results are kept for the degraded mode
+    and only the locations whose search failed are answered in degraded mode
+    """
+    start = time.perf_counter()
+    try:
+        search_breaker.check()
+        search_results = await limited_search_async(es, batch_stages)
+    except CircuitOpen:
+        return await get_fallback_results_async(batch_stages)
+    except (ElasticsearchException, asyncio.TimeoutError) as e:
+        search_breaker.record(1000 * (time.perf_counter() - start), failed_ratio=1.0)
+        logger.warning(f"Search failed, serving the fallback results: {e!r}")
+        return await get_fallback_results_async(batch_stages)
+    # the searches failing in ES (errors of msearch items) count as failures, in
+    # proportion of the searched locations
+    failed = [i for i, x in enumerate(search_results) if x.error]
+    n_searched = sum(1 for stages in batch_stages if stages)
+    search_breaker.record(
+        1000 * (time.perf_counter() - start),
+        failed_ratio=len(failed) / max(n_searched, 1),
+    )
+    store_search_results(batch_stages, search_results)
+    if failed:
+        fallback_results = await get_fallback_results_async(
+            [batch_stages[i] for i in failed]
+        )
+        search_results = list(search_results)
+        for i, fallback_result in zip(failed, fallback_results):
+            search_results[i] = fallback_result
+    return search_results
+
+
+def get_match_ids(
+    locations: List[Optional[Union[ParsedLocation, JobLocation]]],
+    search_results: List[SearchResult],
+) -> List[Optional[str]]:
+    """
+    geonameid of the best matching place of each location, selected as the
+    responses do (same name verification)
+    """
+    batch_similarities = get_locations_name_similarities(locations, search_results)
+    match_ids = []
+    for search_result, similarities in zip(search_results, batch_similarities):
+        match = None
+        if search_result.candidates:
+            match = select_best_matching_place(
+                search_result.candidates, similarities=similarities
+            )
+        match_ids.append(match.geonameid if match else None)
+    return match_ids
+
+
+async def search_async(
+    es: AsyncElasticsearch,
+    batch_stages: List[List[SearchStage]],
+    locations: List[Optional[Union[ParsedLocation, JobLocation]]],
+) -> List[SearchResult]:
+    """
+    Staged search of a batch of locations, behind the circuit breaker and the
+    adaptive concurrency limit when enabled, and mirrored to the shadow index when
+    enabled (see geonames_api.shadow)
+
+    :param locations: locations searched (their city name verifies the matches
+        compared by the shadow searches)
+    """
+    start = time.perf_counter()
+    if settings.circuit_breaker and any(batch_stages):
+        search_results = await guarded_search_async(es, batch_stages)
+    else:
+        search_results = await limited_search_async(es, batch_stages)
+    if not any(x.fallback or x.error for x in search_results):
+        maybe_shadow_search(
+            es,
+            batch_stages,
+            search_results,
+            primary_latency_ms=1000 * (time.perf_counter() - start),
+            get_match_ids=partial(get_match_ids, locations),
+        )
+    return search_results
+
+
+def get_corrected_search_stages(
+    location: Union[ParsedLocation, JobLocation], country_code: str = None
+) -> Optional[List[SearchStage]]:
+    """
+    Search stages of the location with its city name corrected (see
+    geonames_api.spelling), None when there's no correction
+    """
+    if spelling_corrector is None or not location.city:
+        return None
+    correction = spelling_corrector.correct(location.city)
+    if correction is None:
+        return None
+    location = location.copy(update={"city": correction})
+    if isinstance(location, JobLocation):
+        return get_job_location_search_stages(location)
+    return get_parsed_location_search_stages(location, country_code=country_code)
+
+
+def is_matched(search_result: SearchResult, similarities: Optional[np.ndarray]) -> bool:
+    """
+    Whether the search found a candidate similar enough to the query name (any
+    candidate when the candidates aren't verified)
+    """
+    if similarities is None:
+        return bool(search_result.candidates)
+    return (
+        bool(len(similarities)) and similarities.max() >= settings.min_name_similarity
+    )
+
+
+async def search_corrected_async(
+    es: AsyncElasticsearch,
+    locations: List[Optional[Union[ParsedLocation, JobLocation]]],
+    country_codes: List[Optional[str]],
+    search_results: List[SearchResult],
+    batch_similarities: List[Optional[np.ndarray]],
+) -> Tuple[List[SearchResult], List[Optional[np.ndarray]]]:
+    """
+    Search again, once, the unmatched locations whose city name has a spelling
+    correction, the results of the matching ones replace the unmatched results.
+    The locations with a candidate similar enough to their name are matched and
+    never corrected: a correctly spelled name of a place too small to be in the
+    spelling dictionary would be "corrected" to the name of a bigger place
+
+    :param batch_similarities: name similarities of the candidates of the first
+        search (see get_locations_name_similarities)
+    :return: the search results and their name similarities
+    """
+    indices, batch_stages = [], []
+    for i, (location, search_result) in enumerate(zip(locations, search_results)):
+        # not searched (negative cache, bad location) or answered in degraded mode
+        if location is None or not search_result.stage:
+            continue
+        if is_matched(search_result, batch_similarities[i]):
+            continue
+        stages = get_corrected_search_stages(location, country_code=country_codes[i])
+        if stages:
+            indices.append(i)
+            batch_stages.append(stages)
+    if not indices:
+        return search_results, batch_similarities
+    #
+    metrics.incr("spelling.corrected", len(indices))
+    corrected_locations = [locations[i] for i in indices]
+    corrected_results = await search_async(es, batch_stages, corrected_locations)
+    corrected_similarities = get_locations_name_similarities(
+        corrected_locations, corrected_results
+    )
+    search_results, batch_similarities = list(search_results), list(batch_similarities)
+    for i, search_result, similarities in zip(
+        indices, corrected_results, corrected_similarities
+    ):
+        if is_matched(search_result, similarities):
+            metrics.incr("spelling.matched")
+            search_results[i] = search_result
+            batch_similarities[i] = similarities
+    return search_results, batch_similarities
 
 
 async def parse_and_normalize_raw_location_async(
     es: AsyncElasticsearch, raw_location: str, country_code: str = None
 ) -> ParsedAndNormalizedResult:
     """ """
-    match = None
-    raw_location = fix_text(raw_location)
-    parsed_location = parse_raw_location(raw_location, country_code=country_code)
-    if is_bad_loc(parsed_location.city or parsed_location.raw):
-        logger.info(f"Got a bad location: {parsed_location.raw}")
-        results = []
-        query = None
-    else:
-        query = build_query_from_parsed_location(
-            parsed_location, country_code=country_code
+    parsed_location, stages = get_raw_location_search_stages(
+        raw_location, country_code=country_code
+    )
+    search_results = await search_async(es, [stages], [parsed_location])
+    similarities = get_locations_name_similarities([parsed_location], search_results)
+    if settings.spelling_correction:
+        search_results, similarities = await search_corrected_async(
+            es, [parsed_location], [country_code], search_results, similarities
         )
-        es_resp = await es.search(query=query, index=settings.geonames_index)
-        results = [
-            GeonameItemES.parse_obj({"score": x["_score"], **x["_source"]})
-            for x in es_resp["hits"]["hits"]
-        ]
-        if results:
-            match = select_best_matching_place(results)
-
-    result = ParsedAndNormalizedResult(
-        match=match, candidates=results, parsed_location=parsed_location, query=query
+    search_result = search_results[0]
+    cache_if_unmatched(raw_location, country_code, parsed_location, search_result)
+    return build_parsed_and_normalized_result(
+        parsed_location, search_result, similarities[0]
     )
 
-    return result
-
 
 async def parse_and_normalize_raw_location_batch_async(
     es: AsyncElasticsearch, batch: List[ParseAndNormalizeRequestData]
 ) -> List[ParsedAndNormalizedResult]:
     """ """
-    queries = []
-    batch_parsed_locations = []
+    batch_parsed_locations, batch_stages = [], []
     for item in batch:
-        raw_location = fix_text(item.raw_location)
-        parsed_location = parse_raw_location(
-            raw_location, country_code=item.country_code
+        parsed_location, stages = get_raw_location_search_stages(
+            item.raw_location, country_code=item.country_code
         )
         batch_parsed_locations.append(parsed_location)
-        #
-        query = build_query_from_parsed_location(
-            parsed_location, country_code=item.country_code
-        )
-        queries.append({"index": settings.geonames_index})
-        queries.append({"query": query})
+        batch_stages.append(stages)
 
-    es_responses = (await es.msearch(body=queries))["responses"]
+    search_results = await search_async(es, batch_stages, batch_parsed_locations)
+    batch_similarities = get_locations_name_similarities(
+        batch_parsed_locations, search_results
+    )
+    if settings.spelling_correction:
+        search_results, batch_similarities = await search_corrected_async(
+            es,
+            batch_parsed_locations,
+            [x.country_code for x in batch],
+            search_results,
+            batch_similarities,
+        )
     batch_results = []
-    for i, es_resp in enumerate(es_responses):
-        if "error" in es_resp:
-            raise NotImplementedError()
-        else:
-            geonames_items = [
-                GeonameItemES.parse_obj({"score": x["_score"], **x["_source"]})
-                for x in es_resp["hits"]["hits"]
-            ]
-            match = select_best_matching_place(geonames_items)
-            batch_results.append(
-                ParsedAndNormalizedResult(
-                    match=match,
-                    candidates=geonames_items,
-                    parsed_location=batch_parsed_locations[i],
-                )
+    for item, parsed_location, search_result, similarities in zip(
+        batch, batch_parsed_locations, search_results, batch_similarities
+    ):
+        cache_if_unmatched(
+            item.raw_location, item.country_code, parsed_location, search_result
+        )
+        batch_results.append(
+            build_parsed_and_normalized_result(
+                parsed_location, search_result, similarities
             )
-
+        )
     return batch_results
 
 
@@ -335,74 +630,70 @@ def is_raw_location(location: JobLocation):
     return all(getattr(location, x) is None for x in fields)
 
 
+def get_normalize_job_location_search_stages(
+    location: JobLocation,
+) -> Tuple[Optional[ParsedLocation], List[SearchStage]]:
+    """
+    :return: the parsed location (raw locations only) and the search stages
+    """
+    if is_raw_location(location):
+        return get_raw_location_search_stages(
+            location.raw, country_code=location.country_code
+        )
+    return None, get_job_location_search_stages(location)
+
+
 async def normalise_location_batch_async(
     es: AsyncElasticsearch, locations: List[JobLocation]
 ) -> List[NormalizedLocationResult]:
     """ """
-    indices, queries = [], []
-    # batch_parsed_locations = []
-    for i, location in enumerate(locations):
-        if is_raw_location(location):
-            raw_location = fix_text(location.raw)
-            parsed_location = parse_raw_location(
-                raw_location, country_code=location.country_code
-            )
-            if is_bad_loc(parsed_location.city or parsed_location.raw):
-                logger.info(f"Got a bad location: {parsed_location.raw}")
-                continue
-            else:
-                query = build_query_from_parsed_location(
-                    parsed_location, country_code=location.country_code
-                )
-        else:
-            query = build_query_from_job_location(job_location=location)
-        #
-        queries.append({"index": settings.geonames_index})
-        queries.append({"query": query})
-        indices.append(i)
-
-    es_responses = (await es.msearch(body=queries))["responses"]
-    index_to_es_resp = {i: es_resp for i, es_resp in zip(indices, es_responses)}
-
+    batch_parsed_locations, batch_stages = [], []
+    for location in locations:
+        parsed_location, stages = get_normalize_job_location_search_stages(location)
+        batch_parsed_locations.append(parsed_location)
+        batch_stages.append(stages)
+    # the parsed location of the raw locations, the location itself otherwise
+    query_locations = [
+        location if parsed_location is None else parsed_location
+        for location, parsed_location in zip(locations, batch_parsed_locations)
+    ]
+    search_results = await search_async(es, batch_stages, query_locations)
+    batch_similarities = get_locations_name_similarities(
+        query_locations, search_results
+    )
+    if settings.spelling_correction:
+        search_results, batch_similarities = await search_corrected_async(
+            es,
+            query_locations,
+            [x.country_code for x in locations],
+            search_results,
+            batch_similarities,
+        )
     batch_results = []
-    for i in range(len(locations)):
-        es_resp = index_to_es_resp.get(i)
-        if "error" in es_resp:
-            raise NotImplementedError()
-
-        if not es_resp:
-            match = None
-            candidates = []
-        else:
-            candidates = [
-                GeonameItemES.parse_obj({"score": x["_score"], **x["_source"]})
-                for x in es_resp["hits"]["hits"]
-            ]
-            match = select_best_matching_place(candidates)
+    for location, parsed_location, search_result, similarities in zip(
+        locations, batch_parsed_locations, search_results, batch_similarities
+    ):
+        if parsed_location is not None:
+            cache_if_unmatched(
+                location.raw, location.country_code, parsed_location, search_result
+            )
+        candidates = search_result.candidates
+        match = None
+        if candidates:
+            match = select_best_matching_place(candidates, similarities=similarities)
 
         batch_results.append(
             NormalizedLocationResult(
                 match=match,
                 candidates=candidates,
                 # parsed_location=batch_parsed_locations[i],
+                stale=bool(search_result.fallback),
+                fallback=search_result.fallback,
             )
         )
     return batch_results
 
 
-def test():
-    es = Elasticsearch(**settings.es_client_params)
-    raw_location = "Tréflévenez (29)"
-    raw_location = "Rezé"
-    # raw_location = "Paris, Île-De-France"
-    country_code = "ES"
-
-    match = parse_and_normalize_raw_location(
-        es=es, raw_location=raw_location, country_code=country_code
-    )
-    print(match.json(indent=4))
-
-
 """
 The goal of this API is to parse and normalize locations from job posts.
 Different cases are possible
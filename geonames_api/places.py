@@ -0,0 +1,130 @@
+import logging
+from typing import Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch, ElasticsearchException
+from fastapi import HTTPException
+
+from geonames_api.cache import LRUCache
+from geonames_api.config import settings
+from geonames_api.es_index_settings import GEONAMEID_IDS_META
+from geonames_api.models import GeonameItem
+
+logger = logging.getLogger(__name__)
+
+# hot documents, geonameid => GeonameItem (unknown ids aren't cached, they may be
+# indexed later)
+places_cache = LRUCache("places", maxsize=settings.places_cache_size)
+
+# result of the index check of the places routes, checked again after the TTL (the
+# index may be rebuilt meanwhile)
+GEONAMEID_IDS_CHECK_TTL = 60
+geonameid_ids_cache = LRUCache("geonameid_ids", maxsize=1, ttl=GEONAMEID_IDS_CHECK_TTL)
+
+
+def can_use_mget() -> bool:
+    """
+    mget needs a single concrete index and the routing of the documents, with
+    routed / split indices the documents are fetched with an ids query instead
+    """
+    return not (settings.country_routing or settings.country_group_indices)
+
+
+async def has_geonameid_ids_async(es: AsyncElasticsearch) -> bool:
+    """
+    Whether all the indices behind the geonames index were built with the
+    geonameids as document ids (flag in the mappings metadata, see
+    scripts/index_geonames_data.py), otherwise no place can be found by id
+    """
+    resp = await es.indices.get_mapping(
+        index=settings.geonames_index,
+        request_timeout=settings.es.get_request_timeout("places"),
+    )
+    return bool(resp) and all(
+        (x["mappings"].get("_meta") or {}).get(GEONAMEID_IDS_META, False)
+        for x in resp.values()
+    )
+
+
+async def check_geonameid_ids_async(es: AsyncElasticsearch):
+    """
+    The places are fetched by document id: refuse to serve them (instead of
+    answering null for every id) when the index wasn't built with the geonameids as
+    ids. The result of the check is cached for GEONAMEID_IDS_CHECK_TTL seconds
+
+    :raise HTTPException: 503 when the index has other ids or can't be checked
+    """
+    has_ids = geonameid_ids_cache.get(settings.geonames_index, count=False)
+    if has_ids is None:
+        try:
+            has_ids = await has_geonameid_ids_async(es)
+        except ElasticsearchException as e:
+            logger.warning(f"Check of the geonames index ids failed: {e!r}")
+            raise HTTPException(status_code=503, detail="Elasticsearch unavailable")
+        geonameid_ids_cache.set(settings.geonames_index, has_ids)
+        if not has_ids:
+            logger.error(
+                f"Index {settings.geonames_index} wasn't built with the geonameids as "
+                f"document ids, the places routes are disabled until it's rebuilt"
+            )
+    if not has_ids:
+        raise HTTPException(
+            status_code=503,
+            detail="Index built without geonameid document ids, re-index it",
+        )
+
+
+async def fetch_places_async(
+    es: AsyncElasticsearch, geonameids: List[str]
+) -> Dict[str, GeonameItem]:
+    """
+    Fetch places by geonameid (requires documents indexed with use_geoname_id=True)
+    """
+    if can_use_mget():
+        resp = await es.mget(
+            index=settings.geonames_index,
+            ids=geonameids,
+            request_timeout=settings.es.get_request_timeout("places"),
+        )
+        sources = [x["_source"] for x in resp["docs"] if x.get("found")]
+    else:
+        resp = await es.search(
+            index=settings.geonames_index,
+            query={"ids": {"values": geonameids}},
+            size=len(geonameids),
+            track_total_hits=False,
+            request_timeout=settings.es.get_request_timeout("places"),
+        )
+        sources = [x["_source"] for x in resp["hits"]["hits"]]
+    #
+    places = {}
+    for source in sources:
+        place = GeonameItem.parse_obj(source)
+        places[place.geonameid] = place
+    return places
+
+
+async def get_places_async(
+    es: AsyncElasticsearch, geonameids: List[str]
+) -> List[Optional[GeonameItem]]:
+    """
+    Places from the hot documents cache, the missing ones are fetched in a single
+    round trip
+    """
+    places = {}
+    missing = []
+    for geonameid in dict.fromkeys(geonameids):
+        place = places_cache.get(geonameid)
+        if place is None:
+            missing.append(geonameid)
+        else:
+            places[geonameid] = place
+
+    if missing:
+        fetched = await fetch_places_async(es, missing)
+        for geonameid in missing:
+            place = fetched.get(geonameid)
+            if place is not None:
+                places_cache.set(geonameid, place)
+            places[geonameid] = place
+    #
+    return [places[geonameid] for geonameid in geonameids]
@@ -0,0 +1,112 @@
+"""
+Deterministic pre-parser for the most common location shapes, producing the same
+ParsedLocation as libpostal (lowercased values) without going through the CRF
+parser and its global lock:
+
+    * "City (NN)" / "City NN" / "City -NN" (France, department number)
+    * "City, ST" (US state code, for US locations)
+    * "City, Country" (not conflicting with the given country code)
+    * bare postcodes
+
+Anything else returns None and goes through libpostal.
+"""
+
+import re
+from typing import Optional
+
+from geonames_api import metrics
+from geonames_api.countries import lookup_country
+from geonames_api.models import ParsedLocation
+from geonames_api.utils import normalize_name_key
+
+metrics.register_rate(
+    "pre_parser.bypass_rate",
+    numerator="pre_parser.bypass",
+    denominator="pre_parser.total",
+)
+
+US_STATE_CODES = frozenset(
+    (
+        "AL AK AZ AR CA CO CT DE DC FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN "
+        "MS MO MT NE NV NH NJ NM NY NC ND OH OK OR PA RI SC SD TN TX UT VT VA WA "
+        "WV WI WY PR"
+    ).split()
+)
+
+# normalized (see utils.normalize_name_key), some are also country names (Georgia)
+US_STATE_NAMES = frozenset(
+    (
+        "alabama,alaska,arizona,arkansas,california,colorado,connecticut,delaware,"
+        "district of columbia,florida,georgia,hawaii,idaho,illinois,indiana,iowa,"
+        "kansas,kentucky,louisiana,maine,maryland,massachusetts,michigan,minnesota,"
+        "mississippi,missouri,montana,nebraska,nevada,new hampshire,new jersey,"
+        "new mexico,new york,north carolina,north dakota,ohio,oklahoma,oregon,"
+        "pennsylvania,rhode island,south carolina,south dakota,tennessee,texas,utah,"
+        "vermont,virginia,washington,west virginia,wisconsin,wyoming,puerto rico"
+    ).split(",")
+)
+
+# letters (any script), spaces, hyphens, apostrophes and dots, at most 5 words
+CITY_PATTERN = r"[^\W\d_]+(?:[\s\-'’.]+[^\W\d_]+){0,4}\.?"
+
+# same shape as parse_and_normalize.french_city_code_pattern
+french_city_code_pattern = re.compile(rf"\s*({CITY_PATTERN})\s[\(-]?(\d{{2}})\)?\s*")
+city_region_pattern = re.compile(rf"\s*({CITY_PATTERN})\s*,\s*({CITY_PATTERN})\s*")
+postcode_pattern = re.compile(r"\s*(\d{4,5})\s*")
+
+
+def pre_parse_location(
+    raw_location: str, country_code: str = None
+) -> Optional[ParsedLocation]:
+    """ """
+    m = french_city_code_pattern.fullmatch(raw_location)
+    if m:
+        if country_code != "FR":
+            return None
+        dep_code = m.group(2)
+        return ParsedLocation(
+            city=m.group(1).strip(" -").lower(), postcode=f"{dep_code}000"
+        )
+
+    m = city_region_pattern.fullmatch(raw_location)
+    if m:
+        city, region = m.group(1), m.group(2)
+        # 2 letters codes are ambiguous (country or state, e.g. "Berlin, DE"), only
+        # taken as a state code for US locations, left to libpostal otherwise
+        if region in US_STATE_CODES and country_code == "US":
+            return ParsedLocation(city=city.lower(), state=region.lower())
+        if len(region) <= 2:
+            return None
+        country = lookup_country(region)
+        if country is None:
+            return None
+        # country names that are also states ("Atlanta, Georgia") or that conflict
+        # with the given country ("Springfield, Jersey" in the US) are left to
+        # libpostal
+        if country_code and country.alpha_2 != country_code:
+            return None
+        if (
+            country_code in (None, "US")
+            and normalize_name_key(region) in US_STATE_NAMES
+        ):
+            return None
+        return ParsedLocation(city=city.lower(), country=region.lower())
+
+    m = postcode_pattern.fullmatch(raw_location)
+    if m:
+        return ParsedLocation(postcode=m.group(1))
+
+    return None
+
+
+def try_pre_parse_location(
+    raw_location: str, country_code: str = None
+) -> Optional[ParsedLocation]:
+    """
+    Pre-parse the location, counting the bypass rate of libpostal
+    """
+    metrics.incr("pre_parser.total")
+    parsed_location = pre_parse_location(raw_location, country_code=country_code)
+    if parsed_location is not None:
+        metrics.incr("pre_parser.bypass")
+    return parsed_location
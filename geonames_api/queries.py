@@ -1,12 +1,40 @@
-from typing import List
+from typing import List, Optional, Tuple
 
+from geonames_api.admin_divisions import resolve_admin_division
 from geonames_api.models import ParsedLocation, JobLocation
-from geonames_api.utils import deaccent, get_pycountry
+from geonames_api.config import settings
+from geonames_api.countries import lookup_country
+from geonames_api.text import deaccent
+from geonames_api.utils import normalize_name_key
 
+# weights of the rank features, a capital has a feature_rank of ~20 and the
+# scores of the name matches are usually in the 5-20 range
+FEATURE_RANK_PIVOT = 10
+FEATURE_RANK_BOOST = 2.0
+POPULATION_RANK_BOOST = 0.5
+# constant score of a matching admin code (exact identifiers, the term frequencies
+# of the codes shouldn't weigh in the score)
+ADMIN_CODE_BOOST = 3.0
 
-def build_query_from_parsed_location(
+
+def get_parsed_location_country_code(
     parsed_location: ParsedLocation, country_code: str = None
-) -> dict:
+) -> Optional[str]:
+    """
+    Country code of a parsed location: the parsed country if it can be resolved,
+    the given country_code otherwise
+    """
+    cc = None
+    if parsed_location.country:
+        c = lookup_country(parsed_location.country)
+        if c:
+            cc = c.alpha_2
+    if cc is None and country_code:
+        cc = country_code
+    return cc
+
+
+def get_parsed_location_name(parsed_location: ParsedLocation) -> str:
     """ """
     if parsed_location.city:
         name = parsed_location.city
@@ -18,11 +46,72 @@ def build_query_from_parsed_location(
         name = parsed_location.country
     else:
         name = parsed_location.raw
+    return name
 
-    should = [
-        # {"match": {"asciiname": deaccent(name)}},
-        # {"match": {"name": name}},
-    ]
+
+def get_job_location_name(job_location: JobLocation) -> str:
+    """ """
+    if job_location.city:
+        name = job_location.city
+    else:
+        name = job_location.raw
+    return name
+
+
+def resolve_admin_names(
+    admin1_name: Optional[str], admin2_name: Optional[str], country_code: str
+) -> Tuple[dict, Optional[str], Optional[str]]:
+    """
+    Resolve the admin names of a location to admin codes in its country (see
+    admin_divisions.resolve_admin_division): when both names are given, the admin1
+    name (state) is resolved among the admin1 divisions and the admin2 name (state
+    district) among the admin2 divisions, a single name is resolved at either level
+
+    :return: the admin codes params, and the admin names that couldn't be resolved
+        (still matched as text)
+    """
+    params = {}
+    if not settings.admin_resolution or not country_code:
+        return params, admin1_name, admin2_name
+    if admin1_name == admin2_name:
+        levels = {admin1_name: None}
+    else:
+        levels = {admin1_name: 1, admin2_name: 2}
+    for name, level in levels.items():
+        if not name:
+            continue
+        division = resolve_admin_division(name, country_code, level=level)
+        if division is None:
+            continue
+        if division.admin2_code:
+            params["admin2_code"] = division.admin2_code
+        params.setdefault("admin1_code", division.admin1_code)
+        if admin1_name == name:
+            admin1_name = None
+        if admin2_name == name:
+            admin2_name = None
+    return params, admin1_name, admin2_name
+
+
+def build_country_filter(country_code: str) -> List[dict]:
+    """ """
+    return [{"term": {"country_code": country_code}}]
+
+
+def get_parsed_location_query_params(
+    parsed_location: ParsedLocation,
+    country_code: str = None,
+    country_filter: bool = False,
+) -> dict:
+    """
+    Parameters of the location query (see build_location_query), also used as is
+    by the stored search template
+
+    :param country_filter: restrict the query to the country of the location
+        (used for country routed searches)
+    """
+    name = get_parsed_location_name(parsed_location)
+    params = {"name": name, "asciiname": deaccent(name)}
 
     admin1_name, admin2_name = None, None
     if parsed_location.state and not parsed_location.state_district:
@@ -35,47 +124,92 @@ def build_query_from_parsed_location(
         admin1_name = parsed_location.state_district
         admin2_name = parsed_location.state_district
 
+    cc = get_parsed_location_country_code(parsed_location, country_code=country_code)
+
+    admin_params, admin1_name, admin2_name = resolve_admin_names(
+        admin1_name, admin2_name, cc
+    )
+    params.update(admin_params)
     if admin1_name:
-        should.append({"match": {"admin1_name": deaccent(admin1_name)}})
+        params["admin1_name"] = deaccent(admin1_name)
     if admin2_name:
-        should.append({"match": {"admin2_name": deaccent(admin2_name)}})
+        params["admin2_name"] = deaccent(admin2_name)
 
     # to help US with state codes (NY, TX, ...)
     if admin1_name and len(admin1_name) == 2:
-        should.append({"match": {"admin1_code": admin1_name.upper()}})
+        params["admin1_code"] = admin1_name.upper()
 
     # postal_code = None
     if parsed_location.postcode:
         postal_code = parsed_location.postcode
-        should.append({"match": {"postal_codes": postal_code}})
+        params["postal_code"] = postal_code
 
-        # case France, admin2_code = department number (case 91000 => 91)
-        if len(postal_code) == 5:
-            admin_code = postal_code[:2]
-            should.append({"match": {"admin2_code": admin_code}})
+        # case France, admin2_code = department number (case 91000 => 91), unless
+        # already resolved from the admin names
+        if len(postal_code) == 5 and not params.get("admin2_code"):
+            params["admin2_code"] = postal_code[:2]
     #
-    cc = None
-    if parsed_location.country:
-        c = get_pycountry(parsed_location.country)
-        if c:
-            cc = c.alpha_2
-    if cc is None and country_code:
-        cc = country_code
-
     if cc:
-        should.append({"match": {"country_code": {"query": cc, "boost": 5}}})
+        params["country_code"] = cc
+        params["country_filter"] = country_filter
+    return params
+
+
+def build_location_query(params: dict) -> dict:
+    """
+    Full text query of a location given its parameters (see
+    get_parsed_location_query_params / get_job_location_query_params), mirrored by
+    the stored search template (see geonames_api.search_templates)
+    """
+    should = [
+        # {"match": {"asciiname": deaccent(name)}},
+        # {"match": {"name": name}},
+    ]
+    if params.get("admin1_name"):
+        should.append({"match": {"admin1_name": params["admin1_name"]}})
+    if params.get("admin2_name"):
+        should.append({"match": {"admin2_name": params["admin2_name"]}})
+    if params.get("postal_code"):
+        should.append({"match": {"postal_codes": params["postal_code"]}})
+    if params.get("country_code"):
+        should.append(
+            {"match": {"country_code": {"query": params["country_code"], "boost": 5}}}
+        )
 
     #
     query = {
         "bool": {
-            "must": [build_must_dis_max_name_query(name)],
+            "must": [build_must_dis_max_name_query(params["name"])],
             # "should": should,
             "should": build_should_dis_max_query(should, tie_breaker=0.5),
         }
     }
+    for field in ("admin1_code", "admin2_code"):
+        if params.get(field):
+            query["bool"]["should"].append(build_admin_code_query(field, params[field]))
+    if settings.es_ranking:
+        query["bool"]["should"].extend(build_rank_feature_queries())
+    if params.get("country_code") and params.get("country_filter"):
+        query["bool"]["filter"] = build_country_filter(params["country_code"])
     return query
 
 
+def build_query_from_parsed_location(
+    parsed_location: ParsedLocation,
+    country_code: str = None,
+    country_filter: bool = False,
+) -> dict:
+    """
+    :param country_filter: restrict the query to the country of the location
+        (used for country routed searches)
+    """
+    return build_location_query(
+        get_parsed_location_query_params(
+            parsed_location, country_code=country_code, country_filter=country_filter
+        )
+    )
+
+
 def build_must_dis_max_name_query(name, tie_breaker: float = 0.3):
     """ """
     return {
@@ -96,6 +230,61 @@ def build_must_dis_max_name_query(name, tie_breaker: float = 0.3):
     }
 
 
+def build_admin_code_query(field: str, code: str) -> dict:
+    """
+    Constant score boost of the places in the admin division (a boost, not a
+    filter: the codes guessed from state abbreviations or postal codes can be wrong)
+    """
+    return {
+        "constant_score": {
+            "filter": {"term": {field: code}},
+            "boost": ADMIN_CODE_BOOST,
+        }
+    }
+
+
+def build_rank_feature_queries() -> List[dict]:
+    """
+    Ranking of the places by feature code (capital > city > admin division > ...)
+    and population, the should clauses are added to the name queries when
+    `settings.es_ranking` is enabled
+    """
+    return [
+        {
+            "rank_feature": {
+                "field": "feature_rank",
+                "saturation": {"pivot": FEATURE_RANK_PIVOT},
+                "boost": FEATURE_RANK_BOOST,
+            }
+        },
+        {
+            "rank_feature": {
+                "field": "population_rank",
+                "log": {"scaling_factor": 1},
+                "boost": POPULATION_RANK_BOOST,
+            }
+        },
+    ]
+
+
+def build_keyword_name_query(name: str, country_code: str) -> dict:
+    """
+    Cheap exact lookup of the normalized name in the country, only ranked by the
+    rank features (if enabled)
+    """
+    query = {
+        "bool": {
+            "filter": [
+                {"terms": {"name_keys": [normalize_name_key(name)]}},
+                *build_country_filter(country_code),
+            ]
+        }
+    }
+    if settings.es_ranking:
+        query["bool"]["should"] = build_rank_feature_queries()
+    return query
+
+
 def build_should_dis_max_query(should: List[dict], tie_breaker: float = 0.3):
     """ """
     dis_max_should = []
@@ -113,17 +302,17 @@ def build_should_dis_max_query(should: List[dict], tie_breaker: float = 0.3):
     return dis_max_should
 
 
-def build_query_from_job_location(job_location: JobLocation) -> dict:
-    """ """
-    if job_location.city:
-        name = job_location.city
-    else:
-        name = job_location.raw
+def get_job_location_query_params(
+    job_location: JobLocation, country_filter: bool = False
+) -> dict:
+    """
+    Parameters of the location query (see build_location_query)
 
-    should = [
-        # {"match": {"asciiname": deaccent(name)}},
-        # {"match": {"name": name}},
-    ]
+    :param country_filter: restrict the query to the country of the location
+        (used for country routed searches)
+    """
+    name = get_job_location_name(job_location)
+    params = {"name": name, "asciiname": deaccent(name)}
 
     admin1_name, admin2_name = None, None
     if job_location.state and not job_location.region:
@@ -136,34 +325,37 @@ def build_query_from_job_location(job_location: JobLocation) -> dict:
         admin1_name = job_location.region
         admin2_name = job_location.region
 
+    admin_params, admin1_name, admin2_name = resolve_admin_names(
+        admin1_name, admin2_name, job_location.country_code
+    )
+    params.update(admin_params)
     if admin1_name:
-        should.append({"match": {"admin1_name": deaccent(admin1_name)}})
+        params["admin1_name"] = deaccent(admin1_name)
     if admin2_name:
-        should.append({"match": {"admin2_name": deaccent(admin2_name)}})
+        params["admin2_name"] = deaccent(admin2_name)
 
     # to help US with state codes (NY, TX, ...)
     if admin1_name and len(admin1_name) == 2:
-        should.append({"match": {"admin1_code": admin1_name}})
+        params["admin1_code"] = admin1_name
 
     # postal_code = None
     if job_location.postal_code:
-        should.append({"match": {"postal_codes": job_location.postal_code}})
+        params["postal_code"] = job_location.postal_code
 
     #
     if job_location.country_code:
-        should.append(
-            {
-                "match": {
-                    "country_code": {"query": job_location.country_code, "boost": 5}
-                }
-            }
-        )
+        params["country_code"] = job_location.country_code
+        params["country_filter"] = country_filter
+    return params
 
-    #
-    query = {
-        "bool": {
-            "must": [build_must_dis_max_name_query(name)],
-            "should": build_should_dis_max_query(should, tie_breaker=0.5),
-        }
-    }
-    return query
+
+def build_query_from_job_location(
+    job_location: JobLocation, country_filter: bool = False
+) -> dict:
+    """
+    :param country_filter: restrict the query to the country of the location
+        (used for country routed searches)
+    """
+    return build_location_query(
+        get_job_location_query_params(job_location, country_filter=country_filter)
+    )
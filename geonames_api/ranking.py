@@ -0,0 +1,67 @@
+from typing import Optional
+
+# feature classes by order of preference when selecting the best matching place
+FEATURE_CLASS_PRIORITY = ["P", "A", "L"]
+
+FEATURE_CODE_RANK = {
+    "A": [
+        "ADM1",  # "a primary administrative division of a country, such as a state in the United States",
+        "ADM2",  # a subdivision of a first-order administrative division
+        "ADM3",  # a subdivision of a second-order administrative division
+        "ADM4",  # a subdivision of a third-order administrative division
+        "ADM5",  # a subdivision of a fourth-order administrative division
+        "ADMD",  # an administrative division of a country, undifferentiated as to administrative level
+        "PCLI",  # countries
+    ],
+    "P": [
+        "PPLC",  # capital
+        "PPLA",  # seat of a first-order administrative division	seat of a first-order administrative division (PPLC takes precedence over PPLA)
+        "PPL",  # a city, town, village, or other agglomeration of buildings where people live and work
+        "PPLA2",  # seat of a second-order administrative division
+        "PPLA3",  # seat of a third-order administrative division
+        "PPLA4",  # seat of a fourth-order administrative division
+        "PPLA5",  # seat of a fifth-order administrative division
+        "PPLS",
+    ],
+    "L": [
+        "RGN",  # region	an area distinguished by one or more observable physical or cultural characteristics
+        "RGNE",  # a region of a country established for economic development or for statistical purposes
+    ],
+}
+
+# (feature_class, feature_code) => global rank (0 is the best), features of a
+# known class with an unknown code come after the known codes of their class
+FEATURE_RANK = {}
+for _feature_class in FEATURE_CLASS_PRIORITY:
+    for _feature_code in FEATURE_CODE_RANK[_feature_class]:
+        FEATURE_RANK[(_feature_class, _feature_code)] = len(FEATURE_RANK)
+    FEATURE_RANK[(_feature_class, None)] = len(FEATURE_RANK)
+UNKNOWN_FEATURE_RANK = len(FEATURE_RANK)
+
+
+def get_feature_rank(feature_class: str, feature_code: str) -> int:
+    """ """
+    rank = FEATURE_RANK.get((feature_class, feature_code))
+    if rank is None:
+        rank = FEATURE_RANK.get((feature_class, None), UNKNOWN_FEATURE_RANK)
+    return rank
+
+
+def get_feature_rank_feature(feature_class: str, feature_code: str) -> float:
+    """
+    Value of the `feature_rank` rank_feature field: rank_feature values must be
+    strictly positive and higher is better
+    """
+    return float(
+        UNKNOWN_FEATURE_RANK + 1 - get_feature_rank(feature_class, feature_code)
+    )
+
+
+def get_population_rank_feature(population: Optional[int]) -> Optional[float]:
+    """
+    Value of the `population_rank` rank_feature field, not set for places without
+    population (rank_feature values must be strictly positive)
+    """
+    if not population or population <= 0:
+        return None
+    return float(population)
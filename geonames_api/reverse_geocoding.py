@@ -0,0 +1,368 @@
+import logging
+import os
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+from scipy.spatial import cKDTree
+
+from geonames_api.gazetteer import read_gazetteer
+from geonames_api.models import GeonameItem, ReverseGeocodingResult
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+REVERSE_GEOCODING_FEATURE_CLASSES = ("P", "A")
+
+# string columns with few distinct values, stored as codes into their values
+CATEGORY_COLUMNS = [
+    "feature_class",
+    "feature_code",
+    "country_code",
+    "country",
+    "admin1_code",
+    "admin2_code",
+    "admin1_name",
+    "admin2_name",
+]
+# string columns with (mostly) distinct values, stored as utf-8 bytes and offsets,
+# decoded only for the returned places
+TEXT_COLUMNS = ["geonameid", "name", "asciiname"]
+STRING_COLUMNS = TEXT_COLUMNS + CATEGORY_COLUMNS
+SOURCE_FIELDS = STRING_COLUMNS + ["latitude", "longitude", "population"]
+
+# fields of GeonameItem not stored, with their defaults (same results as the model)
+PLACE_DEFAULTS = {name: field.default for name, field in GeonameItem.__fields__.items()}
+
+# above this number of points the KD-tree queries use all the cores
+PARALLEL_MIN_POINTS = 10000
+
+# coordinates are stored as int32 fixed point numbers of 1e-5 degrees: the 5
+# decimals of the geonames coordinates, exactly, in the size of a float32
+COORDINATES_SCALE = 100000
+# stored population of the places whose population is unknown (returned as None)
+UNKNOWN_POPULATION = -1
+
+
+class MissingFeatureClass(LookupError):
+    """
+    No place of the requested feature class in the reverse geocoding data
+    """
+
+
+def encode_text_column(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: utf-8 bytes of the values and offsets of each value in them
+    """
+    encoded = [x.encode() for x in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_text_column(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """ """
+    data = data.tobytes()
+    bounds = offsets.tolist()
+    return [data[i:j].decode() for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def decode_text_rows(data: np.ndarray, offsets: np.ndarray, rows: np.ndarray) -> list:
+    """
+    Values of the rows, gathered in one buffer (NUL separated) and decoded at once
+    (one at a time for a few rows)
+    """
+    if len(rows) < 16:
+        return [
+            data[offsets[i] : offsets[i + 1]].tobytes().decode() or None for i in rows
+        ]
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    # position of each byte in its value (the separator at the end of each value)
+    sizes = lengths + 1
+    positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    is_char = positions < np.repeat(lengths, sizes)
+    buffer = np.zeros(len(positions), dtype=np.uint8)
+    buffer[is_char] = data[np.repeat(starts, sizes)[is_char] + positions[is_char]]
+    values = buffer.tobytes().decode().split("\0")[:-1]
+    if lengths.min(initial=1) == 0:
+        return [x or None for x in values]
+    return values
+
+
+def encode_category_column(values: List[str]) -> Dict[str, np.ndarray]:
+    """ """
+    categories, codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+    data, offsets = encode_text_column(categories.tolist())
+    return {"codes": codes.astype(np.uint32), "data": data, "offsets": offsets}
+
+
+def to_unit_vectors(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Points on the unit sphere: the euclidean (chord) distance between them is
+    monotonic with the great circle distance, so a plain KD-tree can be used
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=1)
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """ """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+class ReverseGeocoder:
+    """
+    In memory reverse geocoding over the indexed P / A features: coordinates (see
+    COORDINATES_SCALE), population and the fields of the returned places are stored
+    as compact NumPy arrays (see CATEGORY_COLUMNS / TEXT_COLUMNS), with one KD-tree
+    per feature class
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+        self.latitude = columns["latitude"]
+        self.longitude = columns["longitude"]
+        self.population = columns["population"]
+        # decoded category values (a few thousands strings, None for empty ones)
+        self.categories = {
+            field: np.array(
+                [
+                    x or None
+                    for x in decode_text_column(
+                        columns[f"{field}.data"], columns[f"{field}.offsets"]
+                    )
+                ],
+                dtype=object,
+            )
+            for field in CATEGORY_COLUMNS
+        }
+        #
+        self.trees = {}
+        self.tree_indices = {}
+        points = to_unit_vectors(
+            self.latitude / COORDINATES_SCALE, self.longitude / COORDINATES_SCALE
+        )
+        feature_class = self.categories["feature_class"][columns["feature_class.codes"]]
+        for fc in REVERSE_GEOCODING_FEATURE_CLASSES:
+            indices = np.flatnonzero(feature_class == fc)
+            if len(indices):
+                self.tree_indices[fc] = indices
+                self.trees[fc] = cKDTree(points[indices])
+
+    def __len__(self):
+        return len(self.latitude)
+
+    @classmethod
+    def from_items(cls, items: Iterable[dict]) -> "ReverseGeocoder":
+        """
+        :param items: GeonameItem like dicts (e.g. ES sources)
+        """
+        values = {field: [] for field in SOURCE_FIELDS}
+        for item in items:
+            if item.get("feature_class") not in REVERSE_GEOCODING_FEATURE_CLASSES:
+                continue
+            if item.get("latitude") is None or item.get("longitude") is None:
+                continue
+            for field in SOURCE_FIELDS:
+                values[field].append(item.get(field))
+        #
+        columns = {
+            "latitude": np.round(
+                np.array(values["latitude"], dtype=np.float64) * COORDINATES_SCALE
+            ).astype(np.int32),
+            "longitude": np.round(
+                np.array(values["longitude"], dtype=np.float64) * COORDINATES_SCALE
+            ).astype(np.int32),
+            "population": np.array(
+                [UNKNOWN_POPULATION if x is None else x for x in values["population"]],
+                dtype=np.int64,
+            ),
+        }
+        for field in TEXT_COLUMNS:
+            data, offsets = encode_text_column([x or "" for x in values[field]])
+            columns[f"{field}.data"] = data
+            columns[f"{field}.offsets"] = offsets
+        for field in CATEGORY_COLUMNS:
+            encoded = encode_category_column([x or "" for x in values[field]])
+            for k, v in encoded.items():
+                columns[f"{field}.{k}"] = v
+        return cls(columns)
+
+    @classmethod
+    def from_es(cls, es: Elasticsearch, index_name: str) -> "ReverseGeocoder":
+        """ """
+        hits = helpers.scan(
+            es,
+            index=index_name,
+            query={
+                "query": {
+                    "terms": {"feature_class": list(REVERSE_GEOCODING_FEATURE_CLASSES)}
+                },
+                "_source": SOURCE_FIELDS,
+            },
+            size=5000,
+        )
+        return cls.from_items(hit["_source"] for hit in hits)
+
+    @classmethod
+    def from_gazetteer(cls, path: str) -> "ReverseGeocoder":
+        """
+        From the columnar gazetteer artifact (see geonames_api.gazetteer), without
+        going through ES
+        """
+        table = read_gazetteer(path).select(SOURCE_FIELDS)
+        return cls.from_items(
+            row for batch in table.to_batches() for row in batch.to_pylist()
+        )
+
+    def save(self, path: str):
+        """ """
+        np.savez(path, **self.columns)
+
+    @classmethod
+    def load(cls, path: str) -> "ReverseGeocoder":
+        """ """
+        with np.load(path) as data:
+            columns = {k: data[k] for k in data.files}
+        if "name.data" not in columns or columns["latitude"].dtype != np.int32:
+            raise ValueError(
+                f"Outdated reverse geocoding data at: {path}, rebuild it with "
+                f"scripts/build_reverse_geocoding_data.py"
+            )
+        return cls(columns)
+
+    def get_places_columns(self, rows: np.ndarray) -> Dict[str, list]:
+        """
+        Fields of the places of the rows, as columns (None for empty strings)
+        """
+        columns = {}
+        for field in TEXT_COLUMNS:
+            columns[field] = decode_text_rows(
+                self.columns[f"{field}.data"], self.columns[f"{field}.offsets"], rows
+            )
+        for field, categories in self.categories.items():
+            columns[field] = categories[self.columns[f"{field}.codes"][rows]].tolist()
+        columns["latitude"] = (self.latitude[rows] / COORDINATES_SCALE).tolist()
+        columns["longitude"] = (self.longitude[rows] / COORDINATES_SCALE).tolist()
+        population = self.population[rows]
+        columns["population"] = population.tolist()
+        if (population == UNKNOWN_POPULATION).any():
+            columns["population"] = [
+                None if x == UNKNOWN_POPULATION else x for x in columns["population"]
+            ]
+        return columns
+
+    def get_item(self, i: int) -> GeonameItem:
+        """ """
+        columns = self.get_places_columns(np.array([i]))
+        return GeonameItem(**{k: v[0] for k, v in columns.items()})
+
+    def nearest_indices(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        feature_class: str = "P",
+        min_population: int = 0,
+        k: int = 8,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized nearest place lookup
+
+        :param min_population: only consider places with at least this population,
+            the k nearest places are searched and the nearest one matching is kept
+            (the nearest place overall if none of them matches)
+        :return: row indices and distances (km) of the nearest places
+        :raise MissingFeatureClass: no place of the feature class in the data
+        """
+        if feature_class not in self.trees:
+            raise MissingFeatureClass(
+                f"No reverse geocoding places of feature class {feature_class}"
+            )
+        tree = self.trees[feature_class]
+        tree_indices = self.tree_indices[feature_class]
+        points = to_unit_vectors(latitudes, longitudes)
+        k = 1 if not min_population else min(k, len(tree_indices))
+        workers = -1 if len(points) >= PARALLEL_MIN_POINTS else 1
+        distances, neighbors = tree.query(points, k=k, workers=workers)
+        if k == 1:
+            return tree_indices[neighbors], chord_to_km(distances)
+
+        rows = tree_indices[neighbors]
+        ok = self.population[rows] >= min_population
+        # first matching neighbor, or the nearest one
+        best = np.where(ok.any(axis=1), ok.argmax(axis=1), 0)
+        arange = np.arange(len(rows))
+        return rows[arange, best], chord_to_km(distances[arange, best])
+
+    def reverse_geocode_columns(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        feature_class: str = "P",
+        min_population: int = 0,
+    ) -> Dict[str, list]:
+        """
+        Nearest places as columns: the place fields and `distance_km`
+        """
+        rows, distances = self.nearest_indices(
+            latitudes, longitudes, feature_class, min_population=min_population
+        )
+        columns = self.get_places_columns(rows)
+        columns["distance_km"] = distances.tolist()
+        return columns
+
+    def reverse_geocode_batch(
+        self,
+        latitudes: Sequence[float],
+        longitudes: Sequence[float],
+        feature_class: str = "P",
+        min_population: int = 0,
+    ) -> List[dict]:
+        """
+        Nearest places, as ReverseGeocodingResult like dicts (the models are only
+        built at the api edge, when needed)
+        """
+        if not len(latitudes):
+            return []
+        columns = self.reverse_geocode_columns(
+            latitudes, longitudes, feature_class, min_population=min_population
+        )
+        distances = columns.pop("distance_km")
+        for field, default in PLACE_DEFAULTS.items():
+            columns.setdefault(field, repeat(default))
+        fields = list(columns)
+        return [
+            {"place": dict(zip(fields, values)), "distance_km": distance}
+            for values, distance in zip(zip(*columns.values()), distances)
+        ]
+
+    def reverse_geocode(
+        self,
+        latitude: float,
+        longitude: float,
+        feature_class: str = "P",
+        min_population: int = 0,
+    ) -> ReverseGeocodingResult:
+        """ """
+        return ReverseGeocodingResult.parse_obj(
+            self.reverse_geocode_batch(
+                [latitude], [longitude], feature_class, min_population=min_population
+            )[0]
+        )
+
+
+def load_reverse_geocoder(path: str) -> Optional[ReverseGeocoder]:
+    """ """
+    if not path or not os.path.exists(path):
+        logger.info(f"No reverse geocoding data found at: {path}")
+        return None
+    try:
+        return ReverseGeocoder.load(path)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
@@ -0,0 +1,55 @@
+from typing import Dict, List, Optional
+
+from geonames_api.config import settings
+from geonames_api.es_index_settings import COUNTRY_GROUPS, DEFAULT_COUNTRY_GROUP
+
+COUNTRY_CODE_TO_GROUP = {
+    country_code: group
+    for group, country_codes in COUNTRY_GROUPS.items()
+    for country_code in country_codes
+}
+
+
+def get_country_groups() -> List[str]:
+    """ """
+    return list(COUNTRY_GROUPS.keys()) + [DEFAULT_COUNTRY_GROUP]
+
+
+def get_country_group(country_code: str) -> str:
+    """ """
+    return COUNTRY_CODE_TO_GROUP.get(country_code, DEFAULT_COUNTRY_GROUP)
+
+
+def get_country_group_index_name(index_name: str, group: str) -> str:
+    """ """
+    return f"{index_name}-{group}"
+
+
+def get_search_index(country_code: str = None) -> str:
+    """
+    Index (or alias) to search for a given country: the country group index when
+    the index is split per group of countries, the global alias otherwise
+    """
+    if country_code and settings.country_group_indices:
+        return get_country_group_index_name(
+            settings.geonames_index, get_country_group(country_code)
+        )
+    return settings.geonames_index
+
+
+def get_search_header(country_code: str = None) -> Dict[str, str]:
+    """
+    msearch header for a query, scoped to the country shard / index when routing
+    is enabled and the country is known
+    """
+    header = {"index": get_search_index(country_code)}
+    if country_code and settings.country_routing:
+        header["routing"] = country_code
+    return header
+
+
+def is_country_scoped(country_code: Optional[str]) -> bool:
+    """ """
+    return bool(country_code) and (
+        settings.country_routing or settings.country_group_indices
+    )
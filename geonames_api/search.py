@@ -0,0 +1,312 @@
+import logging
+from typing import Callable, List
+
+from elasticsearch import Elasticsearch, AsyncElasticsearch
+from pydantic import BaseModel
+
+from geonames_api import metrics
+from geonames_api.config import settings
+from geonames_api.es_client import msearch_async
+from geonames_api.limiter import AdaptiveConcurrencyLimiter
+from geonames_api.models import GeonameItemES, ParsedLocation, JobLocation
+from geonames_api.queries import (
+    build_keyword_name_query,
+    build_location_query,
+    get_job_location_name,
+    get_job_location_query_params,
+    get_parsed_location_country_code,
+    get_parsed_location_name,
+    get_parsed_location_query_params,
+)
+from geonames_api.ranking import FEATURE_CLASS_PRIORITY
+from geonames_api.routing import get_search_header, is_country_scoped
+from geonames_api.search_templates import (
+    KEYWORD_TEMPLATE,
+    LOCATION_TEMPLATE,
+    get_keyword_template_params,
+    get_location_template_params,
+    get_template_id,
+)
+
+logger = logging.getLogger(__name__)
+
+SEARCH_STAGES = ["keyword", "country", "global"]
+for _stage in SEARCH_STAGES:
+    metrics.register_rate(
+        f"search.{_stage}.fallback_rate",
+        numerator=f"search.{_stage}.fallback",
+        denominator=f"search.{_stage}.total",
+    )
+
+
+class SearchStage(BaseModel):
+    """
+    One step of the search of a location, a stage is only run when the previous
+    stages of the same location didn't match anything. Either a query or the id
+    of a stored search template and its parameters (settings.search_templates)
+    """
+
+    name: str
+    header: dict
+    query: dict = None
+    template: str = None
+    params: dict = None
+    # place searched (degraded mode lookups, see geonames_api.fallback)
+    place_name: str = None
+    country_code: str = None
+
+
+class SearchResult(BaseModel):
+    """ """
+
+    candidates: List[GeonameItemES] = []
+    stage: str = None
+    query: dict = None
+    # degraded mode source when not searched in ES (see geonames_api.fallback)
+    fallback: str = None
+    # type of the ES error of the location search (e.g. shard failure, rejected
+    # execution), the other locations of the msearch are still answered
+    error: str = None
+
+
+def build_keyword_stage(name: str, country_code: str) -> SearchStage:
+    """ """
+    header = get_search_header(country_code)
+    if settings.search_templates:
+        return SearchStage(
+            name="keyword",
+            header=header,
+            template=get_template_id(KEYWORD_TEMPLATE),
+            params=get_keyword_template_params(name, country_code),
+        )
+    return SearchStage(
+        name="keyword",
+        header=header,
+        query=build_keyword_name_query(name, country_code),
+    )
+
+
+def build_location_stage(name: str, header: dict, params: dict) -> SearchStage:
+    """
+    :param params: location query parameters (see queries.build_location_query)
+    """
+    if settings.search_templates:
+        return SearchStage(
+            name=name,
+            header=header,
+            template=get_template_id(LOCATION_TEMPLATE),
+            params=get_location_template_params(params),
+        )
+    return SearchStage(name=name, header=header, query=build_location_query(params))
+
+
+def get_search_stages(
+    params_builder: Callable[[bool], dict], name: str, country_code: str = None
+) -> List[SearchStage]:
+    """
+    :param params_builder: build the location query parameters given if it has to
+        be filtered on the country or not
+    :param name: name of the place searched
+    :param country_code:
+    :return: when the country is known: an exact lookup on the normalized name (if
+        enabled), then a country scoped stage (routed to the country shard / index,
+        if enabled), then the global search as fallback. Only the global search
+        otherwise
+    """
+    stages = []
+    if country_code and settings.keyword_first_stage:
+        stages.append(build_keyword_stage(name, country_code))
+    if is_country_scoped(country_code):
+        stages.append(
+            build_location_stage(
+                "country", get_search_header(country_code), params_builder(True)
+            )
+        )
+    stages.append(
+        build_location_stage(
+            "global", {"index": settings.geonames_index}, params_builder(False)
+        )
+    )
+    for stage in stages:
+        stage.place_name = name
+        stage.country_code = country_code
+    return stages
+
+
+def get_parsed_location_search_stages(
+    parsed_location: ParsedLocation, country_code: str = None
+) -> List[SearchStage]:
+    """ """
+    cc = get_parsed_location_country_code(parsed_location, country_code=country_code)
+    return get_search_stages(
+        lambda country_filter: get_parsed_location_query_params(
+            parsed_location, country_code=country_code, country_filter=country_filter
+        ),
+        name=get_parsed_location_name(parsed_location),
+        country_code=cc,
+    )
+
+
+def get_job_location_search_stages(job_location: JobLocation) -> List[SearchStage]:
+    """ """
+    return get_search_stages(
+        lambda country_filter: get_job_location_query_params(
+            job_location, country_filter=country_filter
+        ),
+        name=get_job_location_name(job_location),
+        country_code=job_location.country_code,
+    )
+
+
+def parse_es_hits(es_resp: dict) -> List[GeonameItemES]:
+    """ """
+    return [
+        GeonameItemES.parse_obj({"score": x["_score"], **x["_source"]})
+        for x in es_resp["hits"]["hits"]
+    ]
+
+
+def is_keyword_match_ambiguous(candidates: List[GeonameItemES]) -> bool:
+    """
+    An exact name match is ambiguous when several places of the preferred feature
+    class share the name (e.g. many "Saint-Denis" in France), the full text search
+    then has to break the tie with the admin names / postal codes
+    """
+    for feature_class in FEATURE_CLASS_PRIORITY:
+        n = sum(1 for x in candidates if x.feature_class == feature_class)
+        if n:
+            return n > 1
+    return True
+
+
+def is_stage_matching(stage: SearchStage, candidates: List[GeonameItemES]) -> bool:
+    """ """
+    if stage.name == "keyword":
+        return bool(candidates) and not is_keyword_match_ambiguous(candidates)
+    return bool(candidates)
+
+
+def build_search_body(stage: SearchStage) -> dict:
+    """
+    Total hits are never used, not tracking them lets ES skip non competitive
+    documents
+    """
+    if stage.template:
+        return {"id": stage.template, "params": stage.params}
+    body = {
+        "query": stage.query,
+        "size": settings.search_size,
+        "track_total_hits": False,
+    }
+    return body
+
+
+def build_msearch_body(
+    batch_stages: List[List[SearchStage]], pending: List[int], level: int
+) -> List[dict]:
+    """ """
+    body = []
+    for i in pending:
+        stage = batch_stages[i][level]
+        body.append(stage.header)
+        body.append(build_search_body(stage))
+    return body
+
+
+def process_msearch_responses(
+    batch_stages: List[List[SearchStage]],
+    pending: List[int],
+    level: int,
+    es_responses: List[dict],
+    results: List[SearchResult],
+    metrics_prefix: str = "search",
+) -> List[int]:
+    """
+    Store the results of the locations matched at this level, and of the locations
+    whose search failed (`error`, not searched further)
+
+    :param metrics_prefix: prefix of the stage counters (shadow searches are
+        counted apart)
+
+    :return: the locations that still need to go through the next stage
+    """
+    next_pending = []
+    for i, es_resp in zip(pending, es_responses):
+        stage = batch_stages[i][level]
+        if "error" in es_resp:
+            error = es_resp["error"]
+            error_type = error.get("type") if isinstance(error, dict) else str(error)
+            logger.warning(f"Search {stage.name} failed: {error}")
+            metrics.incr(f"{metrics_prefix}.{stage.name}.error")
+            results[i] = SearchResult(error=error_type or "unknown")
+            continue
+        candidates = parse_es_hits(es_resp)
+        metrics.incr(f"{metrics_prefix}.{stage.name}.total")
+        if is_stage_matching(stage, candidates) or level + 1 >= len(batch_stages[i]):
+            results[i] = SearchResult(
+                candidates=candidates,
+                stage=stage.name,
+                query=stage.query or build_search_body(stage),
+            )
+        else:
+            metrics.incr(f"{metrics_prefix}.{stage.name}.fallback")
+            next_pending.append(i)
+    return next_pending
+
+
+def staged_msearch(
+    es: Elasticsearch, batch_stages: List[List[SearchStage]]
+) -> List[SearchResult]:
+    """
+    Run the search stages of a batch of locations, one msearch per stage level
+
+    :param es:
+    :param batch_stages: search stages of each location (empty for locations that
+        must not be searched)
+    :return:
+    """
+    results = [SearchResult() for _ in batch_stages]
+    pending = [i for i, stages in enumerate(batch_stages) if stages]
+    level = 0
+    while pending:
+        body = build_msearch_body(batch_stages, pending, level)
+        if settings.search_templates:
+            es_responses = es.msearch_template(body=body)["responses"]
+        else:
+            es_responses = es.msearch(body=body)["responses"]
+        pending = process_msearch_responses(
+            batch_stages, pending, level, es_responses, results
+        )
+        level += 1
+    return results
+
+
+async def staged_msearch_async(
+    es: AsyncElasticsearch,
+    batch_stages: List[List[SearchStage]],
+    limiter: AdaptiveConcurrencyLimiter = None,
+) -> List[SearchResult]:
+    """
+    :param limiter: adaptive concurrency limit of the msearches (one slot per
+        stage level, see geonames_api.limiter)
+    """
+    results = [SearchResult() for _ in batch_stages]
+    pending = [i for i, stages in enumerate(batch_stages) if stages]
+    level = 0
+    while pending:
+        body = build_msearch_body(batch_stages, pending, level)
+        if limiter is not None:
+            async with limiter.slot(n_searches=len(pending)):
+                es_resp = await msearch_async(
+                    es, body, route="normalize", template=settings.search_templates
+                )
+        else:
+            es_resp = await msearch_async(
+                es, body, route="normalize", template=settings.search_templates
+            )
+        es_responses = es_resp["responses"]
+        pending = process_msearch_responses(
+            batch_stages, pending, level, es_responses, results
+        )
+        level += 1
+    return results
@@ -0,0 +1,191 @@
+"""
+Stored mustache search templates of the location searches: the query shapes are
+registered once in ES (at index build time and at startup) and the searches only
+send their parameters (see queries.get_*_query_params) through msearch_template.
+
+The template ids are prefixed with the index name, so the query logic is
+versioned together with the index. The templates mirror
+queries.build_location_query / build_keyword_name_query.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch, ElasticsearchException
+
+from geonames_api.config import settings
+from geonames_api.queries import build_admin_code_query, build_rank_feature_queries
+from geonames_api.utils import normalize_name_key
+
+logger = logging.getLogger(__name__)
+
+LOCATION_TEMPLATE = "location"
+KEYWORD_TEMPLATE = "keyword"
+
+# delay before retrying the registration of the templates at startup (seconds),
+# doubled after each failure up to the max
+REGISTER_RETRY_DELAY = 1
+REGISTER_RETRY_MAX_DELAY = 30
+
+# rank feature clauses, rendered when the `rank_features` parameter is set
+RANK_FEATURE_QUERIES = json.dumps(build_rank_feature_queries())[1:-1]
+# admin code boosts, rendered when the admin code parameters are set
+ADMIN1_CODE_QUERY = json.dumps(build_admin_code_query("admin1_code", "{{admin1_code}}"))
+ADMIN2_CODE_QUERY = json.dumps(build_admin_code_query("admin2_code", "{{admin2_code}}"))
+
+# the optional should clauses end with a match_none clause so that the rendered
+# list is always valid JSON, it never matches and doesn't change the scores
+LOCATION_TEMPLATE_SOURCE = (
+    """{
+  "query": {
+    "bool": {
+      "must": [
+        {
+          "dis_max": {
+            "queries": [
+              {
+                "nested": {
+                  "path": "alternative_names",
+                  "query": {"match": {"alternative_names.name": "{{name}}"}},
+                  "score_mode": "max"
+                }
+              },
+              {"match": {"asciiname": {"query": "{{asciiname}}", "boost": 2}}},
+              {"match": {"name": "{{name}}"}}
+            ],
+            "tie_breaker": 0.3
+          }
+        }
+      ],
+      "should": [
+        {
+          "dis_max": {
+            "queries": [
+              {{#admin1_name}}{"match": {"admin1_name": "{{admin1_name}}"}},{{/admin1_name}}
+              {{#admin2_name}}{"match": {"admin2_name": "{{admin2_name}}"}},{{/admin2_name}}
+              {{#postal_code}}{"match": {"postal_codes": "{{postal_code}}"}},{{/postal_code}}
+              {{#country_code}}{"match": {"country_code": {"query": "{{country_code}}", "boost": 5}}},{{/country_code}}
+              {"match_none": {}}
+            ],
+            "tie_breaker": 0.5
+          }
+        }
+        {{#admin1_code}},"""
+    + ADMIN1_CODE_QUERY
+    + """{{/admin1_code}}
+        {{#admin2_code}},"""
+    + ADMIN2_CODE_QUERY
+    + """{{/admin2_code}}
+        {{#rank_features}},"""
+    + RANK_FEATURE_QUERIES
+    + """{{/rank_features}}
+      ]
+      {{#country_filter}},"filter": [{"term": {"country_code": "{{country_code}}"}}]{{/country_filter}}
+    }
+  },
+  "size": {{size}},
+  "track_total_hits": false
+}"""
+)
+
+KEYWORD_TEMPLATE_SOURCE = (
+    """{
+  "query": {
+    "bool": {
+      "filter": [
+        {"terms": {"name_keys": ["{{name_key}}"]}},
+        {"term": {"country_code": "{{country_code}}"}}
+      ]
+      {{#rank_features}},"should": ["""
+    + RANK_FEATURE_QUERIES
+    + """]{{/rank_features}}
+    }
+  },
+  "size": {{size}},
+  "track_total_hits": false
+}"""
+)
+
+SEARCH_TEMPLATES = {
+    LOCATION_TEMPLATE: LOCATION_TEMPLATE_SOURCE,
+    KEYWORD_TEMPLATE: KEYWORD_TEMPLATE_SOURCE,
+}
+
+
+def get_template_id(template: str, index_name: str = None) -> str:
+    """ """
+    return f"{index_name or settings.geonames_index}-{template}"
+
+
+def get_template_scripts(index_name: str = None) -> Dict[str, dict]:
+    """
+    template id => stored script body
+    """
+    return {
+        get_template_id(template, index_name): {
+            "script": {"lang": "mustache", "source": source}
+        }
+        for template, source in SEARCH_TEMPLATES.items()
+    }
+
+
+def register_search_templates(es: Elasticsearch, index_name: str = None):
+    """ """
+    for template_id, body in get_template_scripts(index_name).items():
+        es.put_script(id=template_id, body=body)
+        logger.info(f"search template registered: {template_id}")
+
+
+async def register_search_templates_async(
+    es: AsyncElasticsearch, index_name: str = None
+):
+    """ """
+    for template_id, body in get_template_scripts(index_name).items():
+        await es.put_script(id=template_id, body=body)
+        logger.info(f"search template registered: {template_id}")
+
+
+async def register_search_templates_until_done_async(
+    es: AsyncElasticsearch, index_name: str = None
+):
+    """
+    Registration of the templates at startup, retried until ES accepts them: the
+    searches can't run without them (the api isn't ready meanwhile)
+    """
+    delay = REGISTER_RETRY_DELAY
+    while True:
+        try:
+            await register_search_templates_async(es, index_name)
+            return
+        except ElasticsearchException as e:
+            logger.warning(
+                f"Search templates registration failed, retrying in {delay}s: {e!r}"
+            )
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, REGISTER_RETRY_MAX_DELAY)
+
+
+def get_location_template_params(params: dict) -> dict:
+    """
+    Template parameters of the location query, the unset parameters are left out
+    (falsy mustache sections)
+    """
+    template_params = {k: v for k, v in params.items() if v}
+    if settings.es_ranking:
+        template_params["rank_features"] = True
+    template_params["size"] = settings.search_size
+    return template_params
+
+
+def get_keyword_template_params(name: str, country_code: str) -> dict:
+    """ """
+    template_params = {
+        "name_key": normalize_name_key(name),
+        "country_code": country_code,
+        "size": settings.search_size,
+    }
+    if settings.es_ranking:
+        template_params["rank_features"] = True
+    return template_params
@@ -0,0 +1,120 @@
+"""
+Preload-and-fork launcher: libpostal and the read-only tables (country table,
+reverse geocoding arrays, ...) are loaded once in the parent process, then the
+workers are forked and share these pages copy-on-write. The ES clients are
+created in each worker, after the fork (startup event).
+
+    python -m geonames_api.server --workers 8 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+def get_process_memory(pid: int) -> Dict[str, int]:
+    """
+    Memory of a process in kB (linux only): rss, pss (shared pages are divided
+    between the processes sharing them) and private (not shared) memory
+    """
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                memory[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": memory.get("Rss", 0),
+        "pss": memory.get("Pss", 0),
+        "private": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0),
+    }
+
+
+def log_memory_report(pids: List[int]):
+    """ """
+    for pid in pids:
+        try:
+            memory = get_process_memory(pid)
+        except OSError:
+            continue
+        logger.info(
+            f"worker {pid}: "
+            + " ".join(f"{k}={v / 1024:.0f}MB" for k, v in memory.items())
+        )
+
+
+def run_worker(app, sock: socket.socket, args: argparse.Namespace):
+    """ """
+    config = uvicorn.Config(app, log_level=args.log_level, lifespan="on")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def main():
+    """ """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument(
+        "--memory-report-delay",
+        type=float,
+        default=60,
+        help="log the memory of the workers after this delay (seconds), 0 to disable",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    # preload everything read-only before forking
+    from geonames_api.main import app, load_models
+
+    load_models()
+    # objects allocated so far are never collected, the gc doesn't touch (and
+    # un-share) their pages in the workers
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.set_inheritable(True)
+
+    pids = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(app, sock, args)
+            sys.exit(0)
+        pids.append(pid)
+    logger.info(f"Started {len(pids)} workers: {pids}")
+
+    def stop(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if args.memory_report_delay:
+        time.sleep(args.memory_report_delay)
+        log_memory_report([os.getpid()] + pids)
+
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Shadow traffic: a sampled fraction of the normalize searches is replayed against a
+candidate index (`settings.shadow_index`, with its own search templates when
+`settings.search_templates` is enabled), once the live request is answered and with
+a bounded number of shadow searches in flight.
+
+The comparison is exposed in the metrics:
+
+    * latencies `shadow.primary` / `shadow.candidate` of the sampled requests
+    * rate `shadow.agreement_rate`: same best matching geonameid (selected and
+      verified as the live responses are)
+    * counters `shadow.sampled`, `shadow.dropped` (too many in flight),
+      `shadow.errors` and `shadow.search.*` (stages of the candidate searches)
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, List, Optional, Set
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api import metrics
+from geonames_api.config import settings
+from geonames_api.search import (
+    SearchResult,
+    SearchStage,
+    build_msearch_body,
+    process_msearch_responses,
+)
+
+logger = logging.getLogger(__name__)
+
+metrics.register_rate(
+    "shadow.agreement_rate",
+    numerator="shadow.same_match",
+    denominator="shadow.compared",
+)
+metrics.register_rate(
+    "shadow.drop_rate", numerator="shadow.dropped", denominator="shadow.sampled"
+)
+
+# running shadow searches (references kept until they complete)
+shadow_tasks: Set[asyncio.Task] = set()
+
+
+def is_shadow_enabled() -> bool:
+    """ """
+    return bool(settings.shadow_index) and settings.shadow_sample_rate > 0
+
+
+def retarget(name: str) -> str:
+    """
+    Index / alias / group index / template id of the live index => the one of the
+    candidate index
+    """
+    if name.startswith(settings.geonames_index):
+        return settings.shadow_index + name[len(settings.geonames_index) :]
+    return name
+
+
+def get_shadow_stages(stages: List[SearchStage]) -> List[SearchStage]:
+    """ """
+    shadow_stages = []
+    for stage in stages:
+        update = {"header": {**stage.header, "index": retarget(stage.header["index"])}}
+        if stage.template:
+            update["template"] = retarget(stage.template)
+        shadow_stages.append(stage.copy(update=update))
+    return shadow_stages
+
+
+async def shadow_staged_msearch_async(
+    es: AsyncElasticsearch, batch_stages: List[List[SearchStage]]
+) -> List[SearchResult]:
+    """
+    Same as search.staged_msearch_async, without hedging and with the stages
+    counted apart
+    """
+    msearch = es.msearch_template if settings.search_templates else es.msearch
+    timeout = settings.es.get_request_timeout("shadow")
+    results = [SearchResult() for _ in batch_stages]
+    pending = [i for i, stages in enumerate(batch_stages) if stages]
+    level = 0
+    while pending:
+        body = build_msearch_body(batch_stages, pending, level)
+        es_responses = (await msearch(body=body, request_timeout=timeout))["responses"]
+        pending = process_msearch_responses(
+            batch_stages,
+            pending,
+            level,
+            es_responses,
+            results,
+            metrics_prefix="shadow.search",
+        )
+        level += 1
+    return results
+
+
+async def run_shadow_search(
+    es: AsyncElasticsearch,
+    batch_stages: List[List[SearchStage]],
+    primary_results: List[SearchResult],
+    get_match_ids: Callable[[List[SearchResult]], List[Optional[str]]],
+):
+    """ """
+    start = time.perf_counter()
+    try:
+        shadow_results = await shadow_staged_msearch_async(
+            es, [get_shadow_stages(stages) for stages in batch_stages]
+        )
+    except Exception as e:
+        metrics.incr("shadow.errors")
+        logger.warning(f"Shadow search failed: {e}")
+        return
+    metrics.observe_latency("shadow.candidate", 1000 * (time.perf_counter() - start))
+    #
+    primary_ids = get_match_ids(primary_results)
+    shadow_ids = get_match_ids(shadow_results)
+    for stages, primary_id, shadow_id in zip(batch_stages, primary_ids, shadow_ids):
+        if not stages:
+            continue
+        metrics.incr("shadow.compared")
+        if primary_id == shadow_id:
+            metrics.incr("shadow.same_match")
+
+
+def maybe_shadow_search(
+    es: AsyncElasticsearch,
+    batch_stages: List[List[SearchStage]],
+    primary_results: List[SearchResult],
+    primary_latency_ms: float,
+    get_match_ids: Callable[[List[SearchResult]], List[Optional[str]]],
+):
+    """
+    Mirror the searches of a live request to the candidate index (sampled,
+    not awaited)
+
+    :param primary_latency_ms: latency of the live searches, recorded for the
+        sampled requests only so that both distributions cover the same requests
+    :param get_match_ids: geonameid of the best matching place of each location of
+        the results, selected as the live responses are
+    """
+    if not is_shadow_enabled() or random.random() >= settings.shadow_sample_rate:
+        return
+    metrics.incr("shadow.sampled")
+    if len(shadow_tasks) >= settings.shadow_max_concurrency:
+        metrics.incr("shadow.dropped")
+        return
+    metrics.observe_latency("shadow.primary", primary_latency_ms)
+    task = asyncio.ensure_future(
+        run_shadow_search(es, batch_stages, primary_results, get_match_ids)
+    )
+    shadow_tasks.add(task)
+    task.add_done_callback(shadow_tasks.discard)
@@ -0,0 +1,157 @@
+"""
+Batched string similarity: Jaro-Winkler of many pairs of strings in one vectorized
+pass (same values as textdistance.jaro_winkler), used to verify and rerank the
+candidates of a whole search batch.
+
+The strings are encoded as padded arrays of code points, the matching loop runs
+over the char positions (not over the pairs), so the cost per pair is a few
+NumPy operations on small rows instead of a Python double loop. The pairs with a
+string longer than `max_length` chars (rare for place names) are scored one at a
+time, so that a few long strings don't widen the arrays of the whole batch.
+"""
+
+from typing import Sequence, Tuple
+
+import numpy as np
+import textdistance
+
+# under this number of pairs the NumPy overhead exceeds the per pair cost, the
+# pairs are scored one at a time
+MIN_BATCH_SIZE = 16
+
+
+def encode_strings(
+    strings: Sequence[str], length: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: code points (n, length) padded with 0, and lengths of the strings
+        (truncated to `length`)
+    """
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    chars = np.frombuffer("".join(strings).encode("utf-32-le"), dtype=np.uint32)
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    columns = np.arange(len(chars)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    kept = columns < length
+    codes = np.zeros((len(strings), length), dtype=np.uint32)
+    codes[rows[kept], columns[kept]] = chars[kept]
+    return codes, np.minimum(lengths, length)
+
+
+def jaro_winkler_similarity_list(
+    strings1: Sequence[str], strings2: Sequence[str], prefix_weight: float = 0.1
+) -> np.ndarray:
+    """
+    Jaro-Winkler similarities of the pairs scored one at a time
+    """
+    return np.array(
+        [
+            textdistance.jaro_winkler(x, y, prefix_weight=prefix_weight)
+            for x, y in zip(strings1, strings2)
+        ],
+        dtype=np.float64,
+    )
+
+
+def jaro_winkler_similarities(
+    strings1: Sequence[str],
+    strings2: Sequence[str],
+    prefix_weight: float = 0.1,
+    max_length: int = 32,
+) -> np.ndarray:
+    """
+    Jaro-Winkler similarity of each pair (strings1[k], strings2[k])
+
+    :param max_length: the pairs with a longer string are scored one at a time
+    """
+    n = len(strings1)
+    if n < MIN_BATCH_SIZE:
+        return jaro_winkler_similarity_list(strings1, strings2, prefix_weight)
+    lengths = np.fromiter(
+        (max(len(x), len(y)) for x, y in zip(strings1, strings2)),
+        dtype=np.int64,
+        count=n,
+    )
+    long_pairs = np.flatnonzero(lengths > max_length)
+    if not len(long_pairs):
+        return jaro_winkler_similarity_array(strings1, strings2, prefix_weight)
+    similarities = np.zeros(n, dtype=np.float64)
+    similarities[long_pairs] = jaro_winkler_similarity_list(
+        [strings1[k] for k in long_pairs],
+        [strings2[k] for k in long_pairs],
+        prefix_weight,
+    )
+    short_pairs = np.flatnonzero(lengths <= max_length)
+    if len(short_pairs):
+        similarities[short_pairs] = jaro_winkler_similarities(
+            [strings1[k] for k in short_pairs],
+            [strings2[k] for k in short_pairs],
+            prefix_weight,
+            max_length,
+        )
+    return similarities
+
+
+def jaro_winkler_similarity_array(
+    strings1: Sequence[str], strings2: Sequence[str], prefix_weight: float = 0.1
+) -> np.ndarray:
+    """
+    Jaro-Winkler similarities of the pairs scored in one vectorized pass, the
+    arrays are as wide as the longest string
+    """
+    n = len(strings1)
+    length = max(max(map(len, strings1)), max(map(len, strings2)), 1)
+    a, len_a = encode_strings(strings1, length)
+    b, len_b = encode_strings(strings2, length)
+    positions = np.arange(length)
+
+    # flag the matching chars: each char of a matches the first unmatched equal
+    # char of b within the search range (only the columns of b within the largest
+    # search range are compared)
+    search_range = np.maximum(np.maximum(len_a, len_b) // 2 - 1, 0)
+    max_range = int(search_range.max())
+    in_b = positions < len_b[:, None]
+    flags_a = np.zeros((n, length), dtype=bool)
+    flags_b = np.zeros((n, length), dtype=bool)
+    for i in range(int(len_a.max())):
+        start, end = max(0, i - max_range), min(length, i + max_range + 1)
+        matches = (
+            (np.abs(positions[start:end] - i) <= search_range[:, None])
+            & in_b[:, start:end]
+            & ~flags_b[:, start:end]
+            & (b[:, start:end] == a[:, i, None])
+        )
+        matches &= (i < len_a)[:, None]
+        flags_a[:, i] = matches.any(axis=1)
+        rows = np.flatnonzero(flags_a[:, i])
+        flags_b[rows, start + matches[rows].argmax(axis=1)] = True
+    common = flags_a.sum(axis=1)
+
+    # transpositions: matched chars of a and b, in order, that differ (both have
+    # `common` matched chars per row, so the flattened matched chars are aligned)
+    differ = a[flags_a] != b[flags_b]
+    rows = np.repeat(np.arange(n), common)
+    transpositions = (
+        np.bincount(rows, weights=differ, minlength=n).astype(np.int64) // 2
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarities = (
+            common / len_a + common / len_b + (common - transpositions) / common
+        ) / 3
+    similarities[common == 0] = 0.0
+
+    # winkler boost of the similar strings sharing a prefix (up to 4 chars)
+    min_length = np.minimum(len_a, len_b)
+    prefix_length = min(length, 4)
+    same_prefix = (a[:, :prefix_length] == b[:, :prefix_length]) & (
+        positions[:prefix_length] < min_length[:, None]
+    )
+    prefix = np.cumprod(same_prefix, axis=1).sum(axis=1)
+    boosted = similarities > 0.7
+    similarities[boosted] += (
+        prefix[boosted] * prefix_weight * (1.0 - similarities[boosted])
+    )
+
+    identical = np.array([x == y for x, y in zip(strings1, strings2)])
+    similarities[identical] = 1.0
+    return similarities
@@ -0,0 +1,344 @@
+"""
+Spelling correction of the place names (e.g. "Marseile" => "marseille"), with a
+symmetric delete dictionary (SymSpell): every term prefix and its deletes up to
+`max_distance` are indexed, a misspelled name is corrected by looking up its own
+deletes, then verifying the candidate terms with the Damerau-Levenshtein distance.
+
+The dictionary is built from the gazetteer at index build time (names of the
+populated places, weighted by population) and stored as flat NumPy arrays, memory
+mapped by the api:
+
+    * terms.npy (utf-8 bytes of the terms) and term_offsets.npy
+    * weights.npy: max population of the places of the term
+    * signatures.npy and char_counts.npy: sets and counts of the chars of the terms
+      (vectorized pre-filters of the candidates)
+    * delete_hashes.npy (sorted 64 bits hashes of the deletes) and delete_terms.npy
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pyarrow.compute as pc
+
+from geonames_api.config import settings
+from geonames_api.gazetteer import read_gazetteer
+from geonames_api.utils import normalize_name_key
+
+logger = logging.getLogger(__name__)
+
+ARRAYS = [
+    "terms",
+    "term_offsets",
+    "weights",
+    "signatures",
+    "char_counts",
+    "delete_hashes",
+    "delete_terms",
+]
+
+# number of set bits of each byte value
+POPCOUNTS = np.array([bin(x).count("1") for x in range(256)], dtype=np.uint8)
+
+
+def hash_delete(delete: str) -> int:
+    """
+    Stable (across processes) 64 bits hash
+    """
+    digest = hashlib.blake2b(delete.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def get_deletes(word: str, max_distance: int) -> Set[str]:
+    """
+    The word and all the strings obtained by deleting up to `max_distance` chars
+    """
+    deletes = {word}
+    edits = {word}
+    for _ in range(max_distance):
+        edits = {x[:i] + x[i + 1 :] for x in edits for i in range(len(x))}
+        deletes.update(edits)
+    return deletes
+
+
+def get_char_signature(word: str) -> int:
+    """
+    64 bits set of the chars of the word: an edit changes 2 bits at most, so the
+    signatures of words within `d` edits differ by 2 * d bits at most
+    """
+    signature = 0
+    for c in word:
+        signature |= 1 << (ord(c) % 64)
+    return signature
+
+
+def get_char_counts(word: str) -> int:
+    """
+    Counts (4 bits, saturated) of the chars of the word in 16 buckets: an edit
+    changes them by 2 at most, so the counts of words within `d` edits differ by
+    2 * d at most (L1)
+    """
+    counts = [0] * 16
+    for c in word:
+        bucket = ord(c) % 16
+        counts[bucket] = min(15, counts[bucket] + 1)
+    return sum(x << (4 * i) for i, x in enumerate(counts))
+
+
+def get_char_masks(word: str) -> Dict[str, int]:
+    """
+    Bit mask of the positions of each char of the word
+    """
+    masks = {}
+    for i, c in enumerate(word):
+        masks[c] = masks.get(c, 0) | (1 << i)
+    return masks
+
+
+def osa_distance(word: str, char_masks: Dict[str, int], term: str) -> int:
+    """
+    Optimal string alignment (restricted Damerau-Levenshtein) distance, with
+    Hyyrö's bit-parallel algorithm: a few int operations per char of the term, the
+    masks of the word (get_char_masks) are shared between the candidate terms
+    """
+    if not word:
+        return len(term)
+    full = (1 << len(word)) - 1
+    last = 1 << (len(word) - 1)
+    vp, vn, d0, pm_previous = full, 0, 0, 0
+    distance = len(word)
+    for c in term:
+        pm = char_masks.get(c, 0)
+        # transpositions
+        tr = ((~d0 & pm) << 1) & pm_previous
+        d0 = ((((pm & vp) + vp) ^ vp) | pm | vn | tr) & full
+        hp = (vn | ~(d0 | vp)) & full
+        hn = d0 & vp
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        hp = ((hp << 1) | 1) & full
+        vn = hp & d0
+        vp = ((hn << 1) | ~(d0 | hp)) & full
+        pm_previous = pm
+    return distance
+
+
+class SpellingCorrector:
+    """ """
+
+    def __init__(
+        self, arrays: Dict[str, np.ndarray], max_distance: int, prefix_length: int
+    ):
+        self.arrays = arrays
+        self.terms = arrays["terms"]
+        self.term_offsets = arrays["term_offsets"]
+        self.weights = arrays["weights"]
+        self.signatures = arrays["signatures"]
+        self.char_counts = arrays["char_counts"]
+        self.delete_hashes = arrays["delete_hashes"]
+        self.delete_terms = arrays["delete_terms"]
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+
+    def __len__(self):
+        return len(self.weights)
+
+    @classmethod
+    def from_terms(
+        cls,
+        term_weights: Dict[str, int],
+        max_distance: int = 2,
+        prefix_length: int = 7,
+    ) -> "SpellingCorrector":
+        """
+        :param term_weights: normalized name => weight (population)
+        """
+        terms = sorted(term_weights)
+        encoded = [x.encode() for x in terms]
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        term_offsets[1:] = np.cumsum([len(x) for x in encoded])
+        #
+        delete_hashes, delete_terms = [], []
+        for i, term in enumerate(terms):
+            for delete in get_deletes(term[:prefix_length], max_distance):
+                delete_hashes.append(hash_delete(delete))
+                delete_terms.append(i)
+        delete_hashes = np.array(delete_hashes, dtype=np.uint64)
+        order = np.argsort(delete_hashes, kind="stable")
+        arrays = {
+            "terms": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "term_offsets": term_offsets,
+            "weights": np.array([term_weights[x] for x in terms], dtype=np.int64),
+            "signatures": np.array(
+                [get_char_signature(x) for x in terms], dtype=np.uint64
+            ),
+            "char_counts": np.array(
+                [get_char_counts(x) for x in terms], dtype=np.uint64
+            ),
+            "delete_hashes": delete_hashes[order],
+            "delete_terms": np.array(delete_terms, dtype=np.uint32)[order],
+        }
+        return cls(arrays, max_distance=max_distance, prefix_length=prefix_length)
+
+    @classmethod
+    def from_gazetteer(
+        cls, path: str, min_population: int = 1000, **kwargs
+    ) -> "SpellingCorrector":
+        """
+        Names (and alternate names) of the populated places of at least
+        `min_population` inhabitants, weighted by the max population of the places
+        """
+        table = read_gazetteer(path)
+        table = table.filter(
+            pc.and_(
+                pc.equal(table["feature_class"], "P"),
+                pc.greater_equal(table["population"], min_population),
+            )
+        )
+        term_weights = {}
+        columns = ["name", "asciiname", "alternative_names", "population"]
+        for batch in table.select(columns).to_batches():
+            for place in batch.to_pylist():
+                names = [place["name"], place["asciiname"]]
+                names += place["alternative_names"] or []
+                for name in names:
+                    key = normalize_name_key(name or "")
+                    if len(key) >= 4 and not key.isdigit():
+                        term_weights[key] = max(
+                            term_weights.get(key, 0), place["population"]
+                        )
+        return cls.from_terms(term_weights, **kwargs)
+
+    def save(self, path: str):
+        """ """
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), self.arrays[name])
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "max_distance": self.max_distance,
+                    "prefix_length": self.prefix_length,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "SpellingCorrector":
+        """
+        Memory mapped: the pages are only read when looked up, and shared by the
+        workers
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ARRAYS
+        }
+        return cls(arrays, **meta)
+
+    def get_term(self, i: int) -> str:
+        """ """
+        start, end = self.term_offsets[i], self.term_offsets[i + 1]
+        return self.terms[start:end].tobytes().decode()
+
+    def get_candidate_terms(self, word: str, max_distance: int) -> np.ndarray:
+        """
+        Terms sharing a delete with the word prefix, of a compatible length (in
+        bytes: `max_distance` edits change it by 4 bytes at most) and with close
+        char sets and counts (filtered before deduplication: the deletes of common
+        prefixes, e.g. "saint-", match thousands of terms)
+        """
+        hashes = np.array(
+            [
+                hash_delete(x)
+                for x in get_deletes(word[: self.prefix_length], max_distance)
+            ],
+            dtype=np.uint64,
+        )
+        starts = np.searchsorted(self.delete_hashes, hashes, side="left")
+        ends = np.searchsorted(self.delete_hashes, hashes, side="right")
+        candidates = np.concatenate(
+            [self.delete_terms[s:e] for s, e in zip(starts, ends)]
+        )
+        #
+        n_bytes = len(word.encode())
+        lengths = self.term_offsets[candidates + 1] - self.term_offsets[candidates]
+        min_length = n_bytes - (max_distance if word.isascii() else 4 * max_distance)
+        candidates = candidates[
+            (lengths.astype(np.int64) >= min_length)
+            & (lengths <= n_bytes + 4 * max_distance)
+        ]
+        #
+        differences = self.signatures[candidates] ^ np.uint64(get_char_signature(word))
+        n_bits = POPCOUNTS[differences.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        candidates = candidates[n_bits <= 2 * max_distance]
+        #
+        counts = self.char_counts[candidates].view(np.uint8).reshape(-1, 8)
+        word_counts = np.array([get_char_counts(word)], dtype=np.uint64).view(np.uint8)
+        l1 = (
+            np.abs((counts & 15).astype(np.int16) - (word_counts & 15))
+            + np.abs((counts >> 4).astype(np.int16) - (word_counts >> 4))
+        ).sum(axis=1)
+        return np.unique(candidates[l1 <= 2 * max_distance])
+
+    def lookup(self, word: str, max_distance: int = None) -> List[Tuple[str, int, int]]:
+        """
+        :return: the closest terms (term, distance, weight), by decreasing weight
+        """
+        max_distance = min(max_distance or self.max_distance, self.max_distance)
+        candidates = self.get_candidate_terms(word, max_distance)
+        starts = self.term_offsets[candidates].tolist()
+        ends = self.term_offsets[candidates + 1].tolist()
+        terms = memoryview(self.terms)
+        char_masks = get_char_masks(word)
+        #
+        best_distance, suggestions = max_distance, []
+        for i, start, end in zip(candidates.tolist(), starts, ends):
+            term = terms[start:end].tobytes().decode()
+            if abs(len(term) - len(word)) > best_distance:
+                continue
+            distance = osa_distance(word, char_masks, term)
+            if distance > best_distance:
+                continue
+            if distance < best_distance:
+                best_distance, suggestions = distance, []
+            suggestions.append((term, distance, i))
+        return sorted(
+            [
+                (term, distance, int(self.weights[i]))
+                for term, distance, i in suggestions
+            ],
+            key=lambda x: (-x[2], x[0]),
+        )
+
+    def correct(self, name: str) -> Optional[str]:
+        """
+        Most populated closest name, up to 1 edit for names shorter than 8 chars
+        and 2 otherwise
+
+        :return: None if the name is known or no close name is found
+        """
+        word = normalize_name_key(name)
+        if len(word) < 4:
+            return None
+        suggestions = self.lookup(word, max_distance=1 if len(word) < 8 else 2)
+        if not suggestions or suggestions[0][1] == 0:
+            return None
+        return suggestions[0][0]
+
+
+def load_spelling_corrector(path: str) -> Optional[SpellingCorrector]:
+    """ """
+    if not path or not os.path.exists(os.path.join(path, "meta.json")):
+        logger.info(f"No spelling dictionary found at: {path}")
+        return None
+    return SpellingCorrector.load(path)
+
+
+spelling_corrector = load_spelling_corrector(settings.spelling_dictionary_path)
@@ -0,0 +1,75 @@
+"""
+Text normalization shared by the api and the indexer: same output as
+`ftfy.fix_text` and the unicodedata based deaccent, with fast paths for the
+(common) already clean strings and memoization of the repeated values.
+
+scripts/check_text_normalization.py checks both against the reference
+implementations.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+import ftfy
+
+# printable ascii without "&" (html entities): left unchanged by ftfy.fix_text,
+# control chars / line breaks / terminal escapes / entities are not
+FIX_TEXT_NOOP_PATTERN = re.compile(r"[\x20-\x25\x27-\x7e]*")
+
+# latin-1 supplement and latin extended-a/b: chars decomposing to a base char and
+# combining marks, deaccented one by one
+DEACCENT_TABLE_RANGE = range(0x80, 0x250)
+
+
+def deaccent_unicodedata(text: str) -> str:
+    """
+    Remove accentuation from the given string (reference implementation).
+
+    >>> deaccent_unicodedata("Šef chomutovských komunistů dostal poštou bílý prášek")
+    'Sef chomutovskych komunistu dostal postou bily prasek'
+
+    """
+    norm = unicodedata.normalize("NFD", text)
+    result = "".join(ch for ch in norm if unicodedata.category(ch) != "Mn")
+    return unicodedata.normalize("NFC", result)
+
+
+DEACCENT_TABLE = {
+    i: deaccent_unicodedata(chr(i))
+    for i in DEACCENT_TABLE_RANGE
+    if deaccent_unicodedata(chr(i)) != chr(i)
+}
+DEACCENT_TABLE_MAX = max(DEACCENT_TABLE_RANGE)
+
+
+@lru_cache(maxsize=100000)
+def deaccent_cached(text: str) -> str:
+    """ """
+    if max(map(ord, text)) <= DEACCENT_TABLE_MAX:
+        return text.translate(DEACCENT_TABLE)
+    return deaccent_unicodedata(text)
+
+
+def deaccent(text: str) -> str:
+    """
+    Remove accentuation from the given string.
+
+    >>> deaccent("Île-de-France")
+    'Ile-de-France'
+    """
+    if text.isascii():
+        return text
+    return deaccent_cached(text)
+
+
+fix_text_cached = lru_cache(maxsize=100000)(ftfy.fix_text)
+
+
+def fix_text(text: str) -> str:
+    """
+    ftfy.fix_text, skipped for clean ascii strings
+    """
+    if FIX_TEXT_NOOP_PATTERN.fullmatch(text):
+        return text
+    return fix_text_cached(text)
@@ -1,30 +1,23 @@
-import pycountry
-import unicodedata
+import re
+from typing import Iterable, List
 
+from geonames_api.text import deaccent
 
-def deaccent(text: str):
-    """
-    Remove accentuation from the given string.
-    Input text is either a unicode string or utf8 encoded bytestring.
-
-    Return input string with accents removed, as unicode.
 
-    >>> deaccent("`éf chomutovských komunisto dostal poatou bílý práaek")
-    u'Sef chomutovskych komunistu dostal postou bily prasek'
+def normalize_name_key(name: str) -> str:
+    """
+    Normalized (deaccented, lowercased) form of a name used for exact keyword
+    lookups, must be the same at index and query time
 
+    >>> normalize_name_key(" Île-de-France ")
+    'ile-de-france'
     """
-    norm = unicodedata.normalize("NFD", text)
-    result = "".join(ch for ch in norm if unicodedata.category(ch) != "Mn")
-    return unicodedata.normalize("NFC", result)
+    return " ".join(deaccent(name).lower().split())
 
 
-def get_pycountry(country: str):
+def get_name_keys(names: Iterable[str]) -> List[str]:
     """ """
-    try:
-        c = pycountry.countries.lookup(country)
-    except LookupError:
-        c = None
-    return c
+    return sorted({normalize_name_key(name) for name in names if name})
 
 
 BAD_CITY_KEYWORDS = {
@@ -43,6 +36,13 @@ BAD_CITY_KEYWORDS = {
 }
 
 
+# a bad keyword as a whole whitespace separated token
+BAD_CITY_KEYWORDS_PATTERN = re.compile(
+    r"(?<!\S)(?:"
+    + "|".join(re.escape(x) for x in sorted(BAD_CITY_KEYWORDS))
+    + r")(?!\S)"
+)
+
+
 def is_bad_loc(loc: str) -> bool:
-    tokens = loc.split()
-    return any(x in tokens for x in BAD_CITY_KEYWORDS)
+    return BAD_CITY_KEYWORDS_PATTERN.search(loc) is not None
@@ -0,0 +1,89 @@
+"""
+Compare the search latency of high-ambiguity names with and without the tracking of
+the total hits (the api searches don't track them, so ES can skip the non
+competitive documents)
+
+    python scripts/benchmark_ambiguous_names.py geonames-v1.5
+"""
+
+import statistics
+import sys
+import time
+
+from elasticsearch import Elasticsearch
+
+from geonames_api.config import settings
+from geonames_api.metrics import percentile
+from geonames_api.queries import build_keyword_name_query, build_must_dis_max_name_query
+
+AMBIGUOUS_NAMES = [
+    ("Springfield", "US"),
+    ("Franklin", "US"),
+    ("Clinton", "US"),
+    ("Washington", "US"),
+    ("San José", "CR"),
+    ("San José", "US"),
+    ("Santa Cruz", "BO"),
+    ("San Juan", "AR"),
+    ("Saint-Denis", "FR"),
+    ("Sainte-Marie", "FR"),
+    ("Neustadt", "DE"),
+    ("Newport", "GB"),
+    ("Victoria", "CA"),
+    ("Alexandria", "EG"),
+]
+
+
+def run_benchmark(
+    es: Elasticsearch, index_name: str, track_total_hits: bool, n_runs: int = 20
+) -> dict:
+    """ """
+    timings = {"keyword": [], "full_text": []}
+    for _ in range(n_runs):
+        for name, country_code in AMBIGUOUS_NAMES:
+            keyword_body = {
+                "query": build_keyword_name_query(name, country_code),
+                "size": 3,
+                "track_total_hits": track_total_hits,
+            }
+            full_text_body = {
+                "query": build_must_dis_max_name_query(name),
+                "size": 3,
+                "track_total_hits": track_total_hits,
+            }
+            for kind, body in [
+                ("keyword", keyword_body),
+                ("full_text", full_text_body),
+            ]:
+                start = time.perf_counter()
+                resp = es.search(index=index_name, body=body, request_cache=False)
+                timings[kind].append(
+                    {"took": resp["took"], "wall": 1000 * (time.perf_counter() - start)}
+                )
+    #
+    report = {}
+    for kind, values in timings.items():
+        took = [x["took"] for x in values]
+        wall = [x["wall"] for x in values]
+        report[kind] = {
+            "took_mean_ms": statistics.mean(took),
+            "took_p95_ms": percentile(took, 95),
+            "wall_p50_ms": percentile(wall, 50),
+            "wall_p99_ms": percentile(wall, 99),
+        }
+    return report
+
+
+def main():
+    """ """
+    es = Elasticsearch(**settings.es.es_client_params)
+    index_name = sys.argv[1] if len(sys.argv) > 1 else settings.geonames_index
+    for track_total_hits in (True, False):
+        report = run_benchmark(es, index_name, track_total_hits=track_total_hits)
+        print(f"{index_name} track_total_hits={track_total_hits}")
+        for kind, stats in report.items():
+            print(f"  {kind:<10}" + " ".join(f"{k}={v:.2f}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
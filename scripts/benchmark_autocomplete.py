@@ -0,0 +1,85 @@
+"""
+Load benchmark of the autocomplete: simulated users concurrently typing place
+names one character at a time.
+
+    python scripts/benchmark_autocomplete.py [n_users] [n_rounds]
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+from elasticsearch import AsyncElasticsearch
+
+from geonames_api.autocomplete import autocomplete_async, autocomplete_cache
+from geonames_api.config import settings
+from geonames_api.metrics import percentile
+
+TYPED_PLACES = [
+    ("Paris", "FR"),
+    ("Marseille", "FR"),
+    ("Saint-Étienne", "FR"),
+    ("Lyon", "FR"),
+    ("Berlin", "DE"),
+    ("München", "DE"),
+    ("Frankfurt am Main", "DE"),
+    ("Madrid", "ES"),
+    ("San Sebastián", "ES"),
+    ("New York", "US"),
+    ("San Francisco", "US"),
+    ("Springfield", "US"),
+    ("London", "GB"),
+    ("Manchester", "GB"),
+    ("Montréal", None),
+    ("São Paulo", None),
+]
+
+
+async def simulate_user(es: AsyncElasticsearch, n_rounds: int, latencies: list):
+    """ """
+    for _ in range(n_rounds):
+        name, country_code = random.choice(TYPED_PLACES)
+        for i in range(1, len(name) + 1):
+            start = time.perf_counter()
+            await autocomplete_async(es, name[:i], country_code=country_code)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+
+async def run_benchmark(n_users: int, n_rounds: int, use_cache: bool) -> dict:
+    """ """
+    es = AsyncElasticsearch(**settings.es.es_client_params)
+    autocomplete_cache.clear()
+    if not use_cache:
+        autocomplete_cache.maxsize = 0
+    latencies = []
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *[simulate_user(es, n_rounds, latencies) for _ in range(n_users)]
+        )
+    finally:
+        await es.close()
+    duration = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    """ """
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for use_cache in [False, True]:
+        report = asyncio.run(run_benchmark(n_users, n_rounds, use_cache=use_cache))
+        print(
+            f"cache={use_cache} " + " ".join(f"{k}={v:.2f}" for k, v in report.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
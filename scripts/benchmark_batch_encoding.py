@@ -0,0 +1,117 @@
+"""
+Compare the payload size and CPU cost per item of the batch encodings supported
+by the batch routes (see geonames_api/encoding.py): encoding, compression,
+decompression, decoding and pydantic validation of a JobLocation batch.
+
+    python scripts/benchmark_batch_encoding.py [batch_size]
+"""
+
+import gzip
+import json
+import random
+import sys
+import time
+
+import msgpack
+import zstandard
+
+from geonames_api.models import NormalizeRequestBatchData
+
+CITIES = [
+    ("FR", "Paris", "Île-de-France"),
+    ("FR", "Saint-Étienne", "Auvergne-Rhône-Alpes"),
+    ("DE", "München", "Bayern"),
+    ("US", "Springfield", "Illinois"),
+    ("US", "New York City", "New York"),
+    ("ES", "Málaga", "Andalucía"),
+    ("GB", "Newcastle upon Tyne", "England"),
+    ("BR", "São Paulo", "São Paulo"),
+]
+
+
+def build_batch(batch_size: int) -> dict:
+    """ """
+    rng = random.Random(0)
+    locations = []
+    for _ in range(batch_size):
+        country_code, city, state = rng.choice(CITIES)
+        locations.append(
+            {
+                "country_code": country_code,
+                "city": city,
+                "state": state,
+                "postcode": str(rng.randint(10000, 99999)),
+            }
+        )
+    return {"locations": locations}
+
+
+def encode_ndjson(batch: dict) -> bytes:
+    """ """
+    return b"".join(
+        json.dumps(x, ensure_ascii=False).encode() + b"\n" for x in batch["locations"]
+    )
+
+
+def decode_ndjson(body: bytes) -> dict:
+    """ """
+    return {"locations": [json.loads(line) for line in body.splitlines() if line]}
+
+
+ENCODINGS = {
+    "json": (lambda x: json.dumps(x, ensure_ascii=False).encode(), json.loads),
+    "msgpack": (msgpack.packb, msgpack.unpackb),
+    "ndjson": (encode_ndjson, decode_ndjson),
+}
+COMPRESSIONS = {
+    "none": (lambda x: x, lambda x: x),
+    "gzip": (lambda x: gzip.compress(x, compresslevel=5), gzip.decompress),
+    "zstd": (
+        zstandard.ZstdCompressor(level=3).compress,
+        lambda x: zstandard.ZstdDecompressor().decompressobj().decompress(x),
+    ),
+}
+
+
+def run_benchmark(batch: dict, encoding: str, compression: str, n_runs: int) -> dict:
+    """ """
+    encode, decode = ENCODINGS[encoding]
+    compress, decompress = COMPRESSIONS[compression]
+    n_items = len(batch["locations"])
+    start = time.process_time()
+    for _ in range(n_runs):
+        body = compress(encode(batch))
+    encode_time = time.process_time() - start
+    start = time.process_time()
+    for _ in range(n_runs):
+        NormalizeRequestBatchData(**decode(decompress(body)))
+    decode_time = time.process_time() - start
+    return {
+        "bytes_per_item": len(body) / n_items,
+        "encode_us_per_item": 1e6 * encode_time / (n_runs * n_items),
+        "decode_validate_us_per_item": 1e6 * decode_time / (n_runs * n_items),
+    }
+
+
+def main():
+    """ """
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch = build_batch(batch_size)
+    for encoding, compression in [
+        ("json", "none"),
+        ("json", "gzip"),
+        ("json", "zstd"),
+        ("msgpack", "none"),
+        ("msgpack", "zstd"),
+        ("ndjson", "none"),
+        ("ndjson", "zstd"),
+    ]:
+        stats = run_benchmark(batch, encoding, compression, n_runs=20)
+        print(
+            f"{encoding + '+' + compression:<14}"
+            + " ".join(f"{k}={v:.2f}" for k, v in stats.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Benchmark of the candidate verification (see geonames_api.similarity): cost per
+candidate of the jaro winkler similarity computed one pair at a time with
+textdistance vs batched in one vectorized pass, for several batch sizes, and of
+the whole verification of a search batch (names, then alternative names).
+
+    python scripts/benchmark_candidate_verification.py [n_locations] [n_candidates]
+"""
+
+import random
+import string
+import sys
+import time
+
+import numpy as np
+import textdistance
+
+from geonames_api.config import settings
+from geonames_api.models import AlternativeName, GeonameItemES
+from geonames_api.parse_and_normalize import (
+    get_batch_name_similarities,
+    normalize_name_key_cached,
+)
+from geonames_api.similarity import jaro_winkler_similarities
+from geonames_api.utils import normalize_name_key
+
+PLACE_NAMES = [
+    "Paris",
+    "Marseille",
+    "Saint-Étienne",
+    "Lyon",
+    "Berlin",
+    "München",
+    "Frankfurt am Main",
+    "Madrid",
+    "San Sebastián",
+    "New York",
+    "San Francisco",
+    "Springfield",
+    "London",
+    "Manchester",
+    "Montréal",
+    "São Paulo",
+    "Köln",
+    "Villeneuve-d'Ascq",
+    "Boulogne-Billancourt",
+    "Aix-en-Provence",
+]
+
+
+def add_typo(name: str) -> str:
+    """ """
+    i = random.randrange(len(name))
+    return name[:i] + random.choice(string.ascii_lowercase) + name[i + 1 :]
+
+
+def get_pairs(n: int) -> list:
+    """
+    Query names (with typos half of the time) and candidate names
+    """
+    pairs = []
+    for _ in range(n):
+        query = random.choice(PLACE_NAMES)
+        if random.random() < 0.5:
+            query = add_typo(query)
+        pairs.append((query.lower(), random.choice(PLACE_NAMES).lower()))
+    return pairs
+
+
+def get_candidate(name: str) -> GeonameItemES:
+    """ """
+    return GeonameItemES(
+        geonameid=str(random.randrange(10**7)),
+        name=name,
+        asciiname=name,
+        country_code="FR",
+        alternative_names=[
+            AlternativeName(name=random.choice(PLACE_NAMES)) for _ in range(20)
+        ],
+        score=1.0,
+    )
+
+
+def time_per_pair(function, pairs: list, n_runs: int = 3) -> float:
+    """
+    Best of `n_runs`, in microseconds per pair
+    """
+    durations = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        function(pairs)
+        durations.append(time.perf_counter() - start)
+    return 1e6 * min(durations) / len(pairs)
+
+
+def score_one_at_a_time(pairs: list) -> np.ndarray:
+    """ """
+    return np.array(
+        [textdistance.jaro_winkler.normalized_similarity(x, y) for x, y in pairs]
+    )
+
+
+def score_batched(pairs: list) -> np.ndarray:
+    """ """
+    return jaro_winkler_similarities(*zip(*pairs))
+
+
+def main():
+    """ """
+    n_locations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_candidates = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    random.seed(0)
+
+    pairs = get_pairs(10000)
+    error = np.abs(score_one_at_a_time(pairs) - score_batched(pairs)).max()
+    print(f"max difference with textdistance: {error:.2e}")
+
+    reference = time_per_pair(score_one_at_a_time, pairs[:2000])
+    print(f"textdistance, one pair at a time: {reference:.2f}us per pair")
+    for batch_size in [1, 10, 100, 1000, 10000]:
+        batches = [pairs[i : i + batch_size] for i in range(0, len(pairs), batch_size)][
+            : max(1, 1000 // batch_size)
+        ]
+        cost = time_per_pair(
+            lambda _: [score_batched(x) for x in batches],
+            [x for batch in batches for x in batch],
+        )
+        print(
+            f"batched, {batch_size:>5} pairs per pass: {cost:.2f}us per pair "
+            f"(x{reference / cost:.1f})"
+        )
+
+    # verification of a search batch: the candidates of a location mostly share its
+    # name (retrieved by name), the others are verified on their alternative names
+    names = [random.choice(PLACE_NAMES) for _ in range(n_locations)]
+    batch_candidates = [
+        [
+            get_candidate(name if random.random() < 0.7 else random.choice(PLACE_NAMES))
+            for _ in range(n_candidates)
+        ]
+        for name in names
+    ]
+    query_names = [add_typo(x) for x in names]
+    n = n_locations * n_candidates
+    # first run: the name keys of the candidates aren't cached yet
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        get_batch_name_similarities(batch_candidates, query_names)
+        duration = time.perf_counter() - start
+        print(
+            f"verification of {n_locations} locations x {n_candidates} candidates "
+            f"({label}): {1000 * duration:.1f}ms, {1e6 * duration / n:.1f}us per "
+            f"candidate"
+        )
+    start = time.perf_counter()
+    for candidates, query_name in zip(batch_candidates, query_names):
+        query_key = normalize_name_key(query_name)
+        for candidate in candidates:
+            for names in (
+                [candidate.name, candidate.asciiname],
+                [x.name for x in candidate.alternative_names],
+            ):
+                similarity = max(
+                    textdistance.jaro_winkler.normalized_similarity(query_key, x)
+                    for x in {normalize_name_key_cached(y) for y in names}
+                )
+                if similarity >= settings.min_name_similarity:
+                    break
+    duration = time.perf_counter() - start
+    print(
+        f"same verification, one pair at a time (textdistance): "
+        f"{1e6 * duration / n:.1f}us per candidate"
+    )
+
+
+if __name__ == "__main__":
+    main()
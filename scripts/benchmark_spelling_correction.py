@@ -0,0 +1,123 @@
+"""
+Benchmark of the spelling correction (see geonames_api.spelling): lookup latency
+of misspelled and correctly spelled names, correction accuracy on generated typos
+(1 or 2 random edits of the most populated names) and memory footprint of the
+memory mapped dictionary (on disk, and resident / private memory of the process
+after loading it and after the lookups).
+
+    python scripts/benchmark_spelling_correction.py [dictionary path] [n_queries]
+"""
+
+import os
+import random
+import string
+import sys
+import time
+
+import numpy as np
+
+from geonames_api.config import settings
+from geonames_api.metrics import percentile
+from geonames_api.server import get_process_memory
+from geonames_api.spelling import ARRAYS, SpellingCorrector
+
+MISSPELLED_NAMES = [
+    ("Marseile", "marseille"),
+    ("Frankfort am Main", "frankfurt am main"),
+    ("Bordeau", "bordeaux"),
+    ("Montpelier", "montpellier"),
+    ("Barcelone", "barcelona"),
+    ("Amsterdan", "amsterdam"),
+    ("Muenchen", "munchen"),
+    ("Philadelpia", "philadelphia"),
+]
+
+
+def add_typo(word: str) -> str:
+    """
+    One random deletion, insertion, substitution or transposition
+    """
+    i = random.randrange(len(word))
+    edit = random.choice(["delete", "insert", "substitute", "transpose"])
+    if edit == "delete":
+        return word[:i] + word[i + 1 :]
+    if edit == "insert":
+        return word[:i] + random.choice(string.ascii_lowercase) + word[i:]
+    if edit == "substitute":
+        return word[:i] + random.choice(string.ascii_lowercase) + word[i + 1 :]
+    if i == len(word) - 1:
+        i -= 1
+    return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+
+
+def get_top_terms(corrector: SpellingCorrector, n: int) -> list:
+    """
+    Most populated names (ascii only, the generated typos are ascii)
+    """
+    terms = []
+    for i in np.argsort(-np.asarray(corrector.weights))[: 10 * n]:
+        term = corrector.get_term(i)
+        if term.isascii() and len(term) >= 8:
+            terms.append(term)
+        if len(terms) == n:
+            break
+    return terms
+
+
+def time_lookups(corrector: SpellingCorrector, names: list) -> dict:
+    """ """
+    latencies, corrections = [], []
+    for name in names:
+        start = time.perf_counter()
+        corrections.append(corrector.correct(name))
+        latencies.append(1e6 * (time.perf_counter() - start))
+    return {
+        "corrections": corrections,
+        "p50_us": percentile(latencies, 50),
+        "p95_us": percentile(latencies, 95),
+        "p99_us": percentile(latencies, 99),
+    }
+
+
+def format_memory(memory: dict) -> str:
+    """ """
+    return " ".join(f"{k}={v / 1024:.1f}MB" for k, v in memory.items())
+
+
+def main():
+    """ """
+    path = sys.argv[1] if len(sys.argv) > 1 else settings.spelling_dictionary_path
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    random.seed(0)
+
+    size = sum(os.path.getsize(os.path.join(path, f"{x}.npy")) for x in ARRAYS)
+    print(f"dictionary: {path}, {size / 2**20:.1f}MB on disk")
+    print(f"before load: {format_memory(get_process_memory(os.getpid()))}")
+    corrector = SpellingCorrector.load(path)
+    print(f"after load:  {format_memory(get_process_memory(os.getpid()))}")
+    print(f"{len(corrector)} terms, {len(corrector.delete_hashes)} deletes")
+
+    top_terms = get_top_terms(corrector, n_queries)
+    typos = [(add_typo(x), x) for x in top_terms]
+    typos2 = [(add_typo(add_typo(x)), x) for x in top_terms]
+    for label, items in [
+        ("known typos", MISSPELLED_NAMES),
+        ("1 edit typos", typos),
+        ("2 edits typos", typos2),
+        ("exact names", [(x, None) for x in top_terms]),
+    ]:
+        # first lookups read the dictionary pages from the page cache / disk
+        cold = time_lookups(corrector, [x for x, _ in items])
+        result = time_lookups(corrector, [x for x, _ in items])
+        n_correct = sum(c == x for c, (_, x) in zip(result["corrections"], items))
+        print(
+            f"{label:>14}: n={len(items)} cold p50={cold['p50_us']:.0f}us "
+            f"p95={cold['p95_us']:.0f}us, warm p50={result['p50_us']:.0f}us "
+            f"p95={result['p95_us']:.0f}us p99={result['p99_us']:.0f}us "
+            f"accuracy={n_correct / len(items):.3f}"
+        )
+    print(f"after lookups: {format_memory(get_process_memory(os.getpid()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import sys
+
+from elasticsearch import Elasticsearch
+
+from geonames_api.config import settings
+from geonames_api.reverse_geocoding import ReverseGeocoder
+
+
+def main():
+    """
+    Dump the P / A features of the geonames index (or of the gazetteer artifact
+    given as argument, see scripts/index_geonames_data.py) to the in memory reverse
+    geocoding arrays loaded by the api
+    """
+    if len(sys.argv) > 1:
+        reverse_geocoder = ReverseGeocoder.from_gazetteer(sys.argv[1])
+    else:
+        es = Elasticsearch(**settings.es.es_client_params)
+        reverse_geocoder = ReverseGeocoder.from_es(es, settings.geonames_index)
+    reverse_geocoder.save(settings.reverse_geocoding_path)
+    print(f"{len(reverse_geocoder)} places saved to {settings.reverse_geocoding_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Bypass rate of the rule based pre-parser and its agreement with libpostal on a
+corpus of raw locations (one per line, optionally followed by a tab and the
+country code):
+
+    python scripts/check_pre_parser_agreement.py ./data/raw_locations.tsv
+"""
+
+import sys
+
+from geonames_api.config import settings
+from geonames_api.health import load_warmup_corpus
+from geonames_api.parse_and_normalize import parse_raw_location
+from geonames_api.pre_parser import pre_parse_location
+
+COMPARED_FIELDS = ["city", "state", "country", "postcode", "state_district"]
+
+
+def main():
+    """ """
+    corpus = load_warmup_corpus(sys.argv[1])
+    # reference: libpostal only
+    settings.pre_parser = False
+    n_bypassed, n_agree = 0, 0
+    for item in corpus:
+        pre_parsed = pre_parse_location(item.raw_location, item.country_code)
+        if pre_parsed is None:
+            continue
+        n_bypassed += 1
+        parsed = parse_raw_location(item.raw_location, country_code=item.country_code)
+        diff = {
+            field: (getattr(pre_parsed, field), getattr(parsed, field))
+            for field in COMPARED_FIELDS
+            if getattr(pre_parsed, field) != getattr(parsed, field)
+        }
+        if diff:
+            print(f"{item.raw_location!r} ({item.country_code}): {diff}")
+        else:
+            n_agree += 1
+    #
+    print(f"locations: {len(corpus)}")
+    print(f"bypass rate: {n_bypassed / max(len(corpus), 1):.1%}")
+    print(f"agreement with libpostal: {n_agree / max(n_bypassed, 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
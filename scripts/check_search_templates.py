@@ -0,0 +1,141 @@
+"""
+Check that the stored search templates render the same queries as the query
+builders, and compare the msearch request bytes per location of both. With
+`--es` the templates are registered and rendered by ES (render_search_template),
+a minimal local mustache rendering is used otherwise:
+
+    python scripts/check_search_templates.py [--es]
+"""
+
+import json
+import re
+import sys
+from typing import List
+
+from elasticsearch import Elasticsearch
+
+from geonames_api.config import settings
+from geonames_api.models import JobLocation, ParsedLocation
+from geonames_api.search import (
+    build_search_body,
+    get_job_location_search_stages,
+    get_parsed_location_search_stages,
+    SearchStage,
+)
+from geonames_api.search_templates import (
+    SEARCH_TEMPLATES,
+    register_search_templates,
+)
+
+PARSED_LOCATIONS = [
+    (ParsedLocation(city="paris", country="france"), None),
+    (ParsedLocation(city="saint-denis", postcode="93200"), "FR"),
+    (ParsedLocation(city="springfield", state="il"), "US"),
+    (ParsedLocation(city="neustadt", state="bayern", state_district="oberpfalz"), "DE"),
+    (ParsedLocation(state="île-de-france"), None),
+    (ParsedLocation(raw='Quote " and \\ backslash'), None),
+]
+JOB_LOCATIONS = [
+    JobLocation(country_code="FR", city="Lyon", postal_code="69001"),
+    JobLocation(country_code="US", city="Austin", state="TX"),
+    JobLocation(country_code="ES", city="Málaga", state="Andalucía", region="Málaga"),
+    JobLocation(raw="Remote - Berlin"),
+]
+
+section_pattern = re.compile(r"{{#(\w+)}}(.*?){{/\1}}", re.DOTALL)
+variable_pattern = re.compile(r"{{(\w+)}}")
+
+
+def render_locally(template: str, params: dict) -> dict:
+    """
+    Non nested sections and JSON escaped variables, enough for our templates
+    """
+    source = section_pattern.sub(
+        lambda m: m.group(2) if params.get(m.group(1)) else "",
+        SEARCH_TEMPLATES[template],
+    )
+    source = variable_pattern.sub(
+        lambda m: (
+            json.dumps(params[m.group(1)])[1:-1]
+            if isinstance(params[m.group(1)], str)
+            else json.dumps(params[m.group(1)])
+        ),
+        source,
+    )
+    return json.loads(source)
+
+
+def drop_match_none(query):
+    """
+    The match_none clause ending the template should list, and the dis_max left
+    with only this clause, aren't generated by the query builders
+    """
+    if isinstance(query, list):
+        items = [drop_match_none(x) for x in query if x != {"match_none": {}}]
+        return [
+            x for x in items if x != {"dis_max": {"queries": [], "tie_breaker": 0.5}}
+        ]
+    if isinstance(query, dict):
+        return {k: drop_match_none(v) for k, v in query.items()}
+    return query
+
+
+def get_all_stages() -> List[SearchStage]:
+    """ """
+    stages = []
+    for parsed_location, country_code in PARSED_LOCATIONS:
+        stages.extend(get_parsed_location_search_stages(parsed_location, country_code))
+    for job_location in JOB_LOCATIONS:
+        stages.extend(get_job_location_search_stages(job_location))
+    return stages
+
+
+def main():
+    """ """
+    es = None
+    if "--es" in sys.argv:
+        es = Elasticsearch(**settings.es.es_client_params)
+        register_search_templates(es)
+    settings.keyword_first_stage = True
+    settings.country_routing = True
+    n_errors = 0
+    for es_ranking in [False, True]:
+        settings.es_ranking = es_ranking
+        settings.search_templates = False
+        query_stages = get_all_stages()
+        settings.search_templates = True
+        template_stages = get_all_stages()
+        query_bytes, template_bytes = 0, 0
+        for query_stage, template_stage in zip(query_stages, template_stages):
+            expected = build_search_body(query_stage)
+            if es is not None:
+                rendered = es.render_search_template(
+                    id=template_stage.template,
+                    body={"params": template_stage.params},
+                )["template_output"]
+            else:
+                rendered = render_locally(
+                    template_stage.template.rsplit("-", 1)[1],
+                    template_stage.params,
+                )
+            if drop_match_none(rendered) != expected:
+                n_errors += 1
+                print(f"mismatch: {template_stage.params}")
+                print(f"  expected: {json.dumps(expected)}")
+                print(f"  rendered: {json.dumps(rendered)}")
+            query_bytes += len(json.dumps(query_stage.header))
+            query_bytes += len(json.dumps(expected))
+            template_bytes += len(json.dumps(template_stage.header))
+            template_bytes += len(json.dumps(build_search_body(template_stage)))
+        print(
+            f"es_ranking={es_ranking}: "
+            f"{len(query_stages)} searches, bytes per search: "
+            f"query={query_bytes / len(query_stages):.0f} "
+            f"template={template_bytes / len(template_stages):.0f}"
+        )
+    print(f"mismatches: {n_errors}")
+    sys.exit(1 if n_errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+False correction rate of the spelling correction (see geonames_api.spelling) on the
+golden set of the replay load test (see scripts/replay_load_test.py): the city
+names of the labelled items that are names of their expected place (correctly
+spelled, e.g. a village too small to be in the dictionary) must not be corrected.
+The names that aren't names of the expected place count as true corrections when
+corrected to one of them.
+
+The rates are upper bounds of the api ones: the api only searches the correction
+when the first search found no candidate similar enough to the name.
+
+    python scripts/check_spelling_false_corrections.py ./data/golden.jsonl \\
+        ./data/gazetteer/gazetteer-<version>.arrow [dictionary path]
+"""
+
+import json
+import sys
+from typing import Dict, Set
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from geonames_api.config import settings
+from geonames_api.gazetteer import read_gazetteer
+from geonames_api.parse_and_normalize import parse_raw_location
+from geonames_api.spelling import SpellingCorrector
+from geonames_api.utils import normalize_name_key
+
+
+def load_golden_items(path: str) -> list:
+    """
+    Labelled items of the golden set: (city name, expected geonameids)
+    """
+    items = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            expected = record.get("expected_geonameid")
+            if not expected:
+                continue
+            if isinstance(expected, str):
+                expected = [expected]
+            if "location" in record:
+                city = record["location"].get("city")
+            else:
+                city = parse_raw_location(
+                    record["raw_location"], country_code=record.get("country_code")
+                ).city
+            if city:
+                items.append((city, set(expected)))
+    return items
+
+
+def get_place_name_keys(path: str, geonameids: Set[str]) -> Dict[str, Set[str]]:
+    """
+    geonameid => normalized names (names, ascii names and alternate names)
+    """
+    table = read_gazetteer(path)
+    table = table.filter(
+        pc.is_in(table["geonameid"], value_set=pa.array(sorted(geonameids)))
+    )
+    name_keys = {}
+    columns = ["geonameid", "name", "asciiname", "alternative_names"]
+    for place in table.select(columns).to_pylist():
+        names = [place["name"], place["asciiname"]]
+        names += place["alternative_names"] or []
+        name_keys[place["geonameid"]] = {normalize_name_key(x) for x in names if x}
+    return name_keys
+
+
+def main():
+    """ """
+    items = load_golden_items(sys.argv[1])
+    geonameids = {x for _, expected in items for x in expected}
+    name_keys = get_place_name_keys(sys.argv[2], geonameids)
+    path = sys.argv[3] if len(sys.argv) > 3 else settings.spelling_dictionary_path
+    corrector = SpellingCorrector.load(path)
+
+    n_right, n_false, n_wrong, n_true = 0, 0, 0, 0
+    for city, expected in items:
+        expected_keys = set().union(*(name_keys.get(x, set()) for x in expected))
+        if not expected_keys:
+            continue
+        correction = corrector.correct(city)
+        if normalize_name_key(city) in expected_keys:
+            n_right += 1
+            if correction is not None:
+                n_false += 1
+                print(f"false correction: {city!r} => {correction!r}")
+        else:
+            n_wrong += 1
+            if correction in expected_keys:
+                n_true += 1
+    #
+    print(
+        f"{n_right} names of the expected place, {n_false} corrected: false "
+        f"correction rate={n_false / max(n_right, 1):.4f}"
+    )
+    print(
+        f"{n_wrong} other names, {n_true} corrected to the expected place: "
+        f"true correction rate={n_true / max(n_wrong, 1):.4f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
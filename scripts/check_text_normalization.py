@@ -0,0 +1,71 @@
+"""
+Property check of geonames_api.text against the reference implementations
+(ftfy.fix_text and the unicodedata based deaccent) on random strings, and on the
+names of a geonames dump when given:
+
+    python scripts/check_text_normalization.py [./data/allCountries.txt]
+"""
+
+import csv
+import random
+import sys
+
+import ftfy
+
+from geonames_api.text import deaccent, deaccent_unicodedata, fix_text
+
+ALPHABET = (
+    [chr(i) for i in range(0x20, 0x7F)]
+    + [chr(i) for i in range(0xA0, 0x250)]
+    + ["\t", "\n", "\r", "\x1b", "\x00", "́", "̈", "​", "﻿"]
+    + ["&amp;", "&eacute;", "Ã©", "Ã¨", "â€™", "Ã¼", "Â", "ï¬"]
+    + ["東京", "Москва", "القاهرة", "Ελλάδα", "ﬁ", "＂", "“", "”"]
+)
+
+
+def random_strings(n: int, seed: int = 0):
+    """ """
+    rng = random.Random(seed)
+    ascii_alphabet = [x for x in ALPHABET if x.isascii()]
+    for i in range(n):
+        # half of the strings are ascii only (fast paths)
+        alphabet = ascii_alphabet if i % 2 else ALPHABET
+        yield "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+
+
+def geonames_names(path: str):
+    """ """
+    with open(path) as f:
+        for row in csv.reader(f, delimiter="\t"):
+            yield row[1]
+            yield row[2]
+            yield from row[3].split(",")
+
+
+def check(strings) -> int:
+    """ """
+    n_errors = 0
+    for i, text in enumerate(strings):
+        for name, fast, reference in [
+            ("fix_text", fix_text, ftfy.fix_text),
+            ("deaccent", deaccent, deaccent_unicodedata),
+        ]:
+            if fast(text) != reference(text):
+                n_errors += 1
+                print(
+                    f"{name} mismatch on {text!r}: {fast(text)!r} != {reference(text)!r}"
+                )
+    print(f"{i + 1} strings checked, {n_errors} mismatches")
+    return n_errors
+
+
+def main():
+    """ """
+    n_errors = check(random_strings(100000))
+    if len(sys.argv) > 1:
+        n_errors += check(geonames_names(sys.argv[1]))
+    sys.exit(1 if n_errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,45 @@
 import csv
+import json
+import os
 from collections import defaultdict
-from typing import Generator, Iterable, List
+from typing import Dict, Generator, Iterable, List
 
+import pyarrow as pa
+import pyarrow.compute as pc
 from pydantic import BaseModel
 from tqdm import tqdm
-import pycountry
-from ftfy import fix_text
 
 from geonames_api.models import GeonameItem, AlternativeName
 from geonames_api.config import settings
+from geonames_api.countries import lookup_country
+from geonames_api.gazetteer import (
+    get_gazetteer_path,
+    get_sources_checksums,
+    iter_gazetteer_items,
+    read_gazetteer,
+    write_gazetteer,
+)
 from geonames_api.es_index_settings import (
+    GEONAMEID_IDS_META,
     geoname_index_settings,
     geoname_index_mappings,
 )
+from geonames_api.autocomplete import get_suggest_inputs, get_suggest_weight
+from geonames_api.spelling import SpellingCorrector
+from geonames_api.search_templates import register_search_templates
+from geonames_api.ranking import (
+    get_feature_rank_feature,
+    get_population_rank_feature,
+)
+from geonames_api.text import fix_text
+from geonames_api.utils import get_name_keys
+from geonames_api.routing import (
+    get_country_group,
+    get_country_group_index_name,
+    get_country_groups,
+)
 from elasticsearch import Elasticsearch, helpers
 
-
 INCLUDE_FEATURE_CLASSES = {"A", "P", "L"}
 INCLUDE_FEATURE_CODES = {
     # A:
@@ -46,11 +70,109 @@ INCLUDE_FEATURE_CODES = {
 
 def get_country(country_code):
     """ """
-    try:
-        c = pycountry.countries.lookup(country_code)
-    except LookupError:
-        c = None
-    return c
+    return lookup_country(country_code)
+
+
+def extract_country_localized_names(gazetteer: pa.Table) -> Dict[str, List[str]]:
+    """
+    Localized country names (country_code => names) from the names and alternate
+    names of the countries (PCLI) places of the gazetteer
+    """
+    country_names = defaultdict(set)
+    countries = gazetteer.filter(pc.equal(gazetteer["feature_code"], "PCLI"))
+    for place in countries.select(
+        ["country_code", "name", "asciiname", "alternative_names"]
+    ).to_pylist():
+        if not place["country_code"]:
+            continue
+        names = [place["name"], place["asciiname"]] + place["alternative_names"]
+        # skip the generated "name, admin name" combinations
+        country_names[place["country_code"]].update(
+            x.strip() for x in names if x and x.strip() and "," not in x
+        )
+    #
+    return {cc: sorted(names) for cc, names in country_names.items()}
+
+
+def save_country_localized_names(country_names: Dict[str, List[str]], path: str):
+    """ """
+    with open(path, "w") as f:
+        json.dump(country_names, f, ensure_ascii=False)
+
+
+def extract_admin_divisions(gazetteer: pa.Table) -> List[dict]:
+    """
+    Names of the admin1 / admin2 divisions used by the api admin resolution (see
+    geonames_api.admin_divisions): admin names of the gazetteer places (from the
+    admin codes files), and names, alternate names and abbreviations of the ADM1 /
+    ADM2 places (e.g. "Bayern", "NSW"), plus the alphabetic admin1 codes (e.g. US
+    states "NY")
+    """
+    division_names = defaultdict(set)
+    for code_keys, name_key in [
+        (["country_code", "admin1_code"], "admin1_name"),
+        (["country_code", "admin1_code", "admin2_code"], "admin2_name"),
+    ]:
+        keys = code_keys + [name_key]
+        names = gazetteer.select(keys).filter(pc.is_valid(gazetteer[name_key]))
+        for x in names.group_by(keys).aggregate([]).to_pylist():
+            code = ".".join(x[k] for k in code_keys)
+            division_names[code].add(x[name_key])
+            admin1_code = x["admin1_code"]
+            if (
+                name_key == "admin1_name"
+                and admin1_code.isalpha()
+                and len(admin1_code) <= 3
+            ):
+                division_names[code].add(admin1_code)
+
+    admin_places = gazetteer.filter(
+        pc.is_in(gazetteer["feature_code"], value_set=pa.array(["ADM1", "ADM2"]))
+    )
+    for place in admin_places.to_pylist():
+        code = f"{place['country_code']}.{place['admin1_code']}"
+        if place["feature_code"] == "ADM2":
+            code += f".{place['admin2_code']}"
+        if code not in division_names:
+            continue
+        names = [place["name"], place["asciiname"]] + place["alternative_names"]
+        division_names[code].update(
+            x for x in names if x and "," not in x and not x.isdigit()
+        )
+    #
+    return [
+        {"code": code, "names": sorted(names)}
+        for code, names in sorted(division_names.items())
+    ]
+
+
+def save_admin_divisions(admin_divisions: List[dict], path: str):
+    """ """
+    with open(path, "w") as f:
+        json.dump(admin_divisions, f, ensure_ascii=False)
+
+
+def extract_major_places(gazetteer: pa.Table, n_places: int = 5000) -> List[dict]:
+    """
+    Places answered by the api in degraded mode, when ES is unavailable (see
+    geonames_api.fallback): the `n_places` most populated populated places and the
+    countries
+    """
+    cities = gazetteer.filter(pc.equal(gazetteer["feature_class"], "P"))
+    top_k = pc.select_k_unstable(
+        cities, k=min(n_places, len(cities)), sort_keys=[("population", "descending")]
+    )
+    cities = cities.take(top_k)
+    countries = gazetteer.filter(pc.equal(gazetteer["feature_code"], "PCLI"))
+    return [
+        x.dict() for table in (cities, countries) for x in iter_gazetteer_items(table)
+    ]
+
+
+def save_major_places(major_places: List[dict], path: str):
+    """ """
+    with open(path, "w") as f:
+        json.dump(major_places, f, ensure_ascii=False)
 
 
 def get_index_geoname_items_it(
@@ -159,19 +281,93 @@ def get_index_geoname_items_it(
             yield item
 
 
+def build_gazetteer(
+    all_countries_path: str,
+    admin_codes_1_path: str,
+    admin_codes_2_path: str,
+    alternative_names_path: str,
+    gazetteer_dir: str,
+    include_countries: List[str] = None,
+) -> str:
+    """
+    Write the output of get_index_geoname_items_it to the columnar gazetteer
+    artifact (see geonames_api.gazetteer), reused as is if the sources didn't change
+
+    :return: path of the artifact
+    """
+    checksums = get_sources_checksums(
+        {
+            "all_countries": all_countries_path,
+            "admin_codes_1": admin_codes_1_path,
+            "admin_codes_2": admin_codes_2_path,
+            "alternative_names": alternative_names_path,
+        },
+        include_countries=include_countries,
+    )
+    gazetteer_path = get_gazetteer_path(gazetteer_dir, checksums["version"])
+    if os.path.exists(gazetteer_path):
+        print(f"Gazetteer up to date: {gazetteer_path}")
+        return gazetteer_path
+
+    admin_codes_1 = load_admin_codes(admin_codes_1_path)
+    admin_codes_2 = load_admin_codes(admin_codes_2_path)
+    place_id_to_postal_codes = load_postal_codes(alternative_names_path)
+    # place_id_to_alternative_names = load_alternative_names(alternative_names_path)
+    geoname_items_it = get_index_geoname_items_it(
+        all_countries_path,
+        admin_codes_1,
+        admin_codes_2,
+        place_id_to_postal_codes=place_id_to_postal_codes,
+        # place_id_to_alternative_names
+        include_countries=include_countries,
+    )
+    os.makedirs(gazetteer_dir, exist_ok=True)
+    n_items = write_gazetteer(
+        geoname_items_it, gazetteer_path, metadata={"checksums": checksums}
+    )
+    print(f"Gazetteer: {n_items} places written to {gazetteer_path}")
+    return gazetteer_path
+
+
 def get_es_actions_it(
     geoname_items_it: Iterable[GeonameItem],
     index_name: str,
-    use_geoname_id: bool = False,
+    use_geoname_id: bool = True,
+    country_routing: bool = False,
+    country_group_indices: bool = False,
 ):
-    """ """
+    """
+    :param country_routing: route documents to a shard by their country_code
+    :param country_group_indices: send documents to the index of their country
+        group (`index_name` is then the alias of all the groups indices)
+    """
     for item in geoname_items_it:
+        source = item.dict()
+        source["name_keys"] = get_name_keys(
+            [item.name, item.asciiname] + [x.name for x in item.alternative_names]
+        )
+        source["feature_rank"] = get_feature_rank_feature(
+            item.feature_class, item.feature_code
+        )
+        population_rank = get_population_rank_feature(item.population)
+        if population_rank:
+            source["population_rank"] = population_rank
+        source["suggest"] = {
+            "input": get_suggest_inputs(item),
+            "weight": get_suggest_weight(item),
+        }
         action = {
             "_index": index_name,
-            "_source": item.dict(),
+            "_source": source,
         }
         if use_geoname_id:
             action["_id"] = item.geonameid
+        if country_routing and item.country_code:
+            action["_routing"] = item.country_code
+        if country_group_indices:
+            action["_index"] = get_country_group_index_name(
+                index_name, get_country_group(item.country_code)
+            )
         #
         yield action
 
@@ -181,10 +377,18 @@ def index_geonames_data(
     geoname_items_it: Iterable[GeonameItem],
     index_name: str,
     n_threads: int = 1,
-    use_geoname_id: bool = False,
+    use_geoname_id: bool = True,
+    country_routing: bool = False,
+    country_group_indices: bool = False,
 ):
     """ """
-    actions = get_es_actions_it(geoname_items_it, index_name, use_geoname_id)
+    actions = get_es_actions_it(
+        geoname_items_it,
+        index_name,
+        use_geoname_id,
+        country_routing=country_routing,
+        country_group_indices=country_group_indices,
+    )
     if n_threads > 1:
         index_it = helpers.parallel_bulk(
             es, actions, thread_count=n_threads, raise_on_error=False
@@ -251,44 +455,112 @@ def load_postal_codes(
 #     return place_id_to_alternative_names
 
 
+def get_index_mappings(use_geoname_id: bool = True) -> dict:
+    """
+    Mappings flagged with the kind of document ids (checked by the places routes)
+    """
+    return {**geoname_index_mappings, "_meta": {GEONAMEID_IDS_META: use_geoname_id}}
+
+
+def create_index(
+    es: Elasticsearch,
+    index_name: str,
+    country_group_indices: bool,
+    use_geoname_id: bool = True,
+):
+    """
+    Create the geonames index, or one index per country group behind an
+    `index_name` alias when country_group_indices is set
+    """
+    index_settings = geoname_index_settings
+    index_mappings = get_index_mappings(use_geoname_id)
+    if not country_group_indices:
+        if es.indices.exists(index=index_name):
+            es.indices.delete(index=index_name)
+        es.indices.create(
+            index=index_name,
+            mappings=index_mappings,
+            settings=index_settings,
+        )
+        return
+
+    for group in get_country_groups():
+        group_index_name = get_country_group_index_name(index_name, group)
+        if es.indices.exists(index=group_index_name):
+            es.indices.delete(index=group_index_name)
+        es.indices.create(
+            index=group_index_name,
+            mappings=index_mappings,
+            settings=index_settings,
+            aliases={index_name: {}},
+        )
+
+
 def main():
     """ """
 
     es = Elasticsearch(**settings.es.es_client_params)
 
     #
-    index_name = "geonames-v1.5"
+    index_name = settings.geonames_index
+    country_routing = settings.country_routing
+    country_group_indices = settings.country_group_indices
 
     # create_index
-    if es.indices.exists(index=index_name):
-        es.indices.delete(index=index_name)
-
-    es.indices.create(
-        index=index_name,
-        mappings=geoname_index_mappings,
-        settings=geoname_index_settings,
+    create_index(
+        es,
+        index_name,
+        country_group_indices=country_group_indices,
+        use_geoname_id=True,
     )
+    # search templates of the api, versioned with the index
+    register_search_templates(es, index_name)
 
     #
     all_countries_path = "./data/allCountries.txt"
     admin_codes_1_path = "./data/admin1CodesASCII.txt"
     admin_codes_2_path = "./data/admin2Codes.txt"
     alternative_names_path = "./data/alternateNames/alternateNames.txt"
+    gazetteer_dir = "./data/gazetteer"
 
-    admin_codes_1 = load_admin_codes(admin_codes_1_path)
-    admin_codes_2 = load_admin_codes(admin_codes_2_path)
-    place_id_to_postal_codes = load_postal_codes(alternative_names_path)
-    # place_id_to_alternative_names = load_alternative_names(alternative_names_path)
-    geoname_items_it = get_index_geoname_items_it(
+    # transformed gazetteer, only rebuilt when the sources change
+    gazetteer_path = build_gazetteer(
         all_countries_path,
-        admin_codes_1,
-        admin_codes_2,
-        place_id_to_postal_codes=place_id_to_postal_codes,
-        # place_id_to_alternative_names
+        admin_codes_1_path,
+        admin_codes_2_path,
+        alternative_names_path,
+        gazetteer_dir=gazetteer_dir,
         # include_countries=["FR"],
     )
+    gazetteer = read_gazetteer(gazetteer_path)
+
+    # localized country names used by the api country lookup table
+    save_country_localized_names(
+        extract_country_localized_names(gazetteer), settings.country_names_path
+    )
+    # admin divisions names used by the api admin resolution
+    save_admin_divisions(
+        extract_admin_divisions(gazetteer), settings.admin_divisions_path
+    )
+    # major places answered by the api in degraded mode
+    save_major_places(extract_major_places(gazetteer), settings.major_places_path)
+    # spelling dictionary of the place names used by the api spelling correction
+    SpellingCorrector.from_gazetteer(gazetteer_path).save(
+        settings.spelling_dictionary_path
+    )
+
+    geoname_items_it = iter_gazetteer_items(gazetteer)
     #
-    index_geonames_data(es, geoname_items_it, index_name=index_name, n_threads=6)
+    index_geonames_data(
+        es,
+        geoname_items_it,
+        index_name=index_name,
+        n_threads=6,
+        # the places are fetched by geonameid (/places routes)
+        use_geoname_id=True,
+        country_routing=country_routing,
+        country_group_indices=country_group_indices,
+    )
 
 
 if __name__ == "__main__":
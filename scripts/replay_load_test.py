@@ -0,0 +1,266 @@
+"""
+Replay a recorded corpus of locations against a running api at a given
+concurrency, and report throughput, latency percentiles and the top-1 accuracy on
+the labelled items (golden set, the failed requests count as misses), so that a
+tuning change (margins, tie breakers, similarities, ...) is measured for both
+performance and quality in one run.
+
+The corpus is a JSON lines file, one item per line, either a raw location or a job
+location, optionally labelled with the expected geonameid (or a list of accepted
+ones):
+
+    {"raw_location": "Mérignac (33)", "country_code": "FR", "expected_geonameid": "2994651"}
+    {"location": {"country_code": "FR", "city": "Lyon"}, "expected_geonameid": "2996944"}
+
+    python scripts/replay_load_test.py ./data/replay.jsonl ./data/golden.jsonl \\
+        --url http://localhost:8000 --concurrency 32 --batch-size 1 --repeat 3
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Union
+
+import aiohttp
+from pydantic import BaseModel
+
+from geonames_api.metrics import percentile
+from geonames_api.models import (
+    NormalizeRequestData,
+    ParseAndNormalizeRequestData,
+)
+
+RAW_LOCATION = "raw_location"
+JOB_LOCATION = "job_location"
+
+# match id of the items of the failed requests (errors, shed with a 429 / 503)
+FAILED = "failed"
+
+# kind => (single route, batch route, batch field)
+ROUTES = {
+    RAW_LOCATION: (
+        "/parse_and_normalize_raw_location",
+        "/parse-and-normalize-raw-location-batch",
+        "data",
+    ),
+    JOB_LOCATION: (
+        "/normalize-job-location",
+        "/normalize-job-location-batch",
+        "locations",
+    ),
+}
+
+
+class ReplayItem(BaseModel):
+    """ """
+
+    id: int
+    kind: str
+    payload: dict
+    expected_geonameids: Optional[Set[str]] = None
+
+
+class ReplayRequest(BaseModel):
+    """ """
+
+    path: str
+    body: dict
+    items: List[ReplayItem]
+
+
+def get_replay_item(record: dict, item_id: int) -> ReplayItem:
+    """ """
+    expected = record.pop("expected_geonameid", None)
+    if isinstance(expected, str):
+        expected = [expected]
+    if "location" in record:
+        kind = JOB_LOCATION
+        payload = NormalizeRequestData(**record).location.dict(exclude_none=True)
+    else:
+        kind = RAW_LOCATION
+        payload = ParseAndNormalizeRequestData(**record).dict(exclude_none=True)
+    return ReplayItem(
+        id=item_id,
+        kind=kind,
+        payload=payload,
+        expected_geonameids=set(expected) if expected else None,
+    )
+
+
+def load_replay_items(paths: List[str]) -> List[ReplayItem]:
+    """ """
+    items = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    items.append(get_replay_item(json.loads(line), item_id=len(items)))
+    return items
+
+
+def build_requests(items: List[ReplayItem], batch_size: int) -> List[ReplayRequest]:
+    """
+    One request per item with batch_size 1 (single routes), batches of items of the
+    same kind otherwise (batch routes)
+    """
+    requests = []
+    if batch_size <= 1:
+        for item in items:
+            path = ROUTES[item.kind][0]
+            body = (
+                item.payload
+                if item.kind == RAW_LOCATION
+                else {"location": item.payload}
+            )
+            requests.append(ReplayRequest(path=path, body=body, items=[item]))
+        return requests
+
+    by_kind = defaultdict(list)
+    for item in items:
+        by_kind[item.kind].append(item)
+    for kind, kind_items in by_kind.items():
+        _, path, field = ROUTES[kind]
+        for i in range(0, len(kind_items), batch_size):
+            batch = kind_items[i : i + batch_size]
+            requests.append(
+                ReplayRequest(
+                    path=path, body={field: [x.payload for x in batch]}, items=batch
+                )
+            )
+    return requests
+
+
+def get_match_ids(response: Union[dict, list]) -> List[Optional[str]]:
+    """ """
+    results = response if isinstance(response, list) else [response]
+    return [(x.get("match") or {}).get("geonameid") for x in results]
+
+
+async def replay(
+    url: str, requests: List[ReplayRequest], concurrency: int, timeout: float
+) -> dict:
+    """
+    Send the requests with `concurrency` workers
+
+    :return: latencies (ms), errors and match ids of the items (FAILED for the
+        items of the failed requests)
+    """
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    latencies, errors = [], defaultdict(int)
+    # item id => match ids (one per replay of the item)
+    matches: Dict[int, List[Optional[str]]] = defaultdict(list)
+
+    async def worker(session: aiohttp.ClientSession):
+        while not queue.empty():
+            request = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                async with session.post(url + request.path, json=request.body) as resp:
+                    body = await resp.json() if resp.status == 200 else None
+                    status = resp.status
+            except Exception as e:
+                body, status = None, type(e).__name__
+            latencies.append(1000 * (time.perf_counter() - start))
+            if body is None:
+                errors[str(status)] += 1
+                for item in request.items:
+                    matches[item.id].append(FAILED)
+                continue
+            for item, match_id in zip(request.items, get_match_ids(body)):
+                matches[item.id].append(match_id)
+
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": dict(errors), "matches": matches}
+
+
+def get_accuracy(items: List[ReplayItem], matches: Dict[int, list]) -> dict:
+    """
+    Top-1 accuracy of the labelled items (per kind and overall), over all the
+    replays of each item: the failed requests (errors, shed load) count as misses,
+    the accuracy over the answered items only is reported next to it
+    """
+    n_total, n_correct, n_failed = defaultdict(int), defaultdict(int), defaultdict(int)
+    for item in items:
+        if not item.expected_geonameids:
+            continue
+        for match_id in matches.get(item.id, []):
+            for key in (item.kind, "all"):
+                n_total[key] += 1
+                n_failed[key] += match_id == FAILED
+                n_correct[key] += match_id in item.expected_geonameids
+    return {
+        key: {
+            "n": n_total[key],
+            "n_failed": n_failed[key],
+            "top1_accuracy": n_correct[key] / n_total[key],
+            "answered_top1_accuracy": (
+                n_correct[key] / (n_total[key] - n_failed[key])
+                if n_total[key] > n_failed[key]
+                else None
+            ),
+        }
+        for key in n_total
+    }
+
+
+def main():
+    """ """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("corpus", nargs="+", help="replay / golden JSON lines files")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="replays of the corpus")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    items = load_replay_items(args.corpus)
+    requests = build_requests(items, args.batch_size) * args.repeat
+
+    start = time.perf_counter()
+    result = asyncio.run(
+        replay(args.url, requests, concurrency=args.concurrency, timeout=args.timeout)
+    )
+    duration = time.perf_counter() - start
+
+    latencies = result["latencies"]
+    n_items = sum(len(x.items) for x in requests)
+    report = {
+        "requests": len(requests),
+        "items": n_items,
+        "concurrency": args.concurrency,
+        "batch_size": args.batch_size,
+        "duration_s": duration,
+        "requests_per_s": len(requests) / duration,
+        "items_per_s": n_items / duration,
+        "latency_ms": (
+            {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies),
+            }
+            if latencies
+            else None
+        ),
+        "errors": result["errors"],
+        "accuracy": get_accuracy(items, result["matches"]),
+    }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
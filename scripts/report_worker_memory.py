@@ -0,0 +1,41 @@
+"""
+Memory per worker of a running api, to compare the preload launcher with plain
+uvicorn workers (each worker loading its own libpostal model):
+
+    uvicorn geonames_api.main:app --workers 4 &
+    python scripts/report_worker_memory.py $(pgrep -f "geonames_api.main:app")
+
+    python -m geonames_api.server --workers 4 &
+    python scripts/report_worker_memory.py $(pgrep -f "geonames_api.server")
+
+PSS (shared pages split between the processes sharing them) is the relevant
+number: summed over the workers it is the actual memory used by the api.
+"""
+
+import sys
+
+from geonames_api.server import get_process_memory
+
+
+def main():
+    """ """
+    pids = [int(x) for x in sys.argv[1:]]
+    total = {"rss": 0, "pss": 0, "private": 0}
+    for pid in pids:
+        memory = get_process_memory(pid)
+        for k, v in memory.items():
+            total[k] += v
+        print(
+            f"{pid:>8} " + " ".join(f"{k}={v / 1024:.0f}MB" for k, v in memory.items())
+        )
+    #
+    if pids:
+        print(
+            f"{'total':>8} "
+            + " ".join(f"{k}={v / 1024:.0f}MB" for k, v in total.items())
+        )
+        print(f"{'per proc':>8} pss={total['pss'] / len(pids) / 1024:.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import pytest
+
+from geonames_api import admin_divisions
+from geonames_api.admin_divisions import (
+    AdminDivision,
+    build_admin_division_table,
+    resolve_admin_division,
+)
+from geonames_api.config import settings
+from geonames_api.queries import resolve_admin_names
+
+
+@pytest.fixture(autouse=True)
+def admin_division_table(monkeypatch):
+    table = build_admin_division_table(
+        [
+            {"code": "FR.11", "names": ["Île-de-France", "IDF"]},
+            {"code": "FR.11.75", "names": ["Paris"]},
+            {"code": "FR.11.91", "names": ["Essonne"]},
+            {"code": "FR.94", "names": ["Corse", "Corsica"]},
+            {"code": "FR.94.2A", "names": ["Corse-du-Sud", "Corsica"]},
+        ]
+    )
+    monkeypatch.setattr(admin_divisions, "admin_division_table", table)
+    monkeypatch.setattr(settings, "admin_resolution", True)
+
+
+def test_resolve_admin_division():
+    assert resolve_admin_division(" ile-de-FRANCE", "FR") == AdminDivision("FR", "11")
+    assert resolve_admin_division("Essonne", "FR") == AdminDivision("FR", "11", "91")
+    assert resolve_admin_division("Essonne", "BE") is None
+    assert resolve_admin_division("Nowhere", "FR") is None
+
+
+def test_resolve_admin_division_level():
+    # the region takes precedence, unless an admin2 division is asked for
+    assert resolve_admin_division("Corsica", "FR") == AdminDivision("FR", "94")
+    assert resolve_admin_division("Corsica", "FR", level=1) == AdminDivision("FR", "94")
+    assert resolve_admin_division("Corsica", "FR", level=2) == AdminDivision(
+        "FR", "94", "2A"
+    )
+    assert resolve_admin_division("Essonne", "FR", level=1) is None
+
+
+def test_resolve_admin_names():
+    params, admin1_name, admin2_name = resolve_admin_names("IDF", "Essonne", "FR")
+    assert params == {"admin1_code": "11", "admin2_code": "91"}
+    assert admin1_name is None and admin2_name is None
+
+
+def test_resolve_admin_names_state_district_level():
+    # state district resolved among the admin2 divisions
+    params, _, _ = resolve_admin_names("Corse", "Corsica", "FR")
+    assert params == {"admin1_code": "94", "admin2_code": "2A"}
+    # a single name is resolved at either level
+    params, _, _ = resolve_admin_names("Corsica", "Corsica", "FR")
+    assert params == {"admin1_code": "94"}
+
+
+def test_unresolved_admin_names_are_kept():
+    params, admin1_name, admin2_name = resolve_admin_names("Essonne", "Nowhere", "FR")
+    assert params == {}
+    assert (admin1_name, admin2_name) == ("Essonne", "Nowhere")
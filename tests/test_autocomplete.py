@@ -0,0 +1,89 @@
+import asyncio
+
+from geonames_api.autocomplete import (
+    autocomplete_async,
+    autocomplete_cache,
+    build_suggest_body,
+    get_suggest_inputs,
+    get_suggest_weight,
+)
+from geonames_api.models import AlternativeName, GeonameItem
+
+
+class FakeEs:
+    """ """
+
+    def __init__(self):
+        self.bodies = []
+
+    async def search(self, index, body, request_timeout=None):
+        self.bodies.append(body)
+        return {
+            "suggest": {
+                "place": [
+                    {
+                        "options": [
+                            {
+                                "text": "Paris, Île-de-France",
+                                "_source": {
+                                    "geonameid": "2988507",
+                                    "name": "Paris",
+                                    "country_code": "FR",
+                                    "population": 2138551,
+                                },
+                            }
+                        ]
+                    }
+                ]
+            }
+        }
+
+
+def get_item(**kwargs) -> GeonameItem:
+    """ """
+    return GeonameItem(geonameid="1", name="Paris", asciiname="Paris", **kwargs)
+
+
+def test_suggest_inputs():
+    item = get_item(
+        alternative_names=[
+            AlternativeName(name="Parigi"),
+            AlternativeName(name="Paris, Île-de-France"),
+            AlternativeName(name="Paris, Île-de-France"),
+        ]
+    )
+    assert get_suggest_inputs(item) == ["Paris", "Paris, Île-de-France"]
+
+
+def test_suggest_weight():
+    city = get_item(population=2138551, feature_class="P", feature_code="PPLC")
+    town = get_item(population=20000, feature_class="P", feature_code="PPLC")
+    village = get_item(population=0, feature_class="P", feature_code="PPL")
+    hamlet = get_item(feature_class="P", feature_code="PPLX")
+    assert get_suggest_weight(city) > get_suggest_weight(town)
+    assert get_suggest_weight(town) > get_suggest_weight(village)
+    # same population: by feature rank
+    assert get_suggest_weight(village) > get_suggest_weight(hamlet) > 0
+
+
+def test_suggest_body():
+    body = build_suggest_body("par", country_code="FR", size=3)
+    completion = body["suggest"]["place"]["completion"]
+    assert body["suggest"]["place"]["prefix"] == "par"
+    assert completion["size"] == 3
+    assert completion["contexts"] == {"country_code": ["FR"]}
+    assert "contexts" not in build_suggest_body("par")["suggest"]["place"]["completion"]
+
+
+def test_autocomplete_cache():
+    autocomplete_cache.clear()
+    es = FakeEs()
+    for prefix in ["Par", " par ", "PAR"]:
+        suggestions = asyncio.run(autocomplete_async(es, prefix, country_code="FR"))
+        assert [(x.text, x.geonameid) for x in suggestions] == [
+            ("Paris, Île-de-France", "2988507")
+        ]
+    assert len(es.bodies) == 1
+    assert asyncio.run(autocomplete_async(es, "  ")) == []
+    assert len(es.bodies) == 1
+    autocomplete_cache.clear()
@@ -0,0 +1,56 @@
+from geonames_api import cache, metrics
+from geonames_api.cache import LRUCache
+
+
+class FakeClock:
+    """ """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_lru_eviction():
+    lru = LRUCache("test_lru", maxsize=2)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    # "b" is the least recently used
+    lru.set("c", 3)
+    assert "b" not in lru
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert len(lru) == 2
+    lru.clear()
+    assert len(lru) == 0
+
+
+def test_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock.monotonic)
+    lru = LRUCache("test_ttl", maxsize=10, ttl=60)
+    lru.set("a", 1)
+    clock.now += 59
+    assert lru.get("a") == 1
+    clock.now += 2
+    assert lru.get("a", "expired") == "expired"
+    assert len(lru) == 0
+
+
+def test_disabled_cache():
+    lru = LRUCache("test_disabled", maxsize=0)
+    lru.set("a", 1)
+    assert lru.get("a") is None
+
+
+def test_hit_rate():
+    lru = LRUCache("test_hit_rate", maxsize=10)
+    lru.set("a", 1)
+    lru.get("a")
+    lru.get("b")
+    # membership tests aren't counted
+    assert "a" in lru
+    assert metrics.counters["cache.test_hit_rate.get"] == 2
+    assert metrics.counters["cache.test_hit_rate.hit"] == 1
+    assert metrics.get_rate("cache.test_hit_rate.hit_rate") == 0.5
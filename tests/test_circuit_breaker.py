@@ -0,0 +1,104 @@
+import pytest
+
+from geonames_api import circuit_breaker
+from geonames_api.circuit_breaker import CircuitBreaker, CircuitOpen
+
+
+class Clock:
+    """ """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def get_breaker() -> CircuitBreaker:
+    """ """
+    return CircuitBreaker(
+        "test",
+        window=10,
+        min_calls=4,
+        error_rate=0.5,
+        slow_rate=0.5,
+        slow_ms=100,
+        open_duration=5,
+        half_open_calls=2,
+    )
+
+
+def open_breaker(breaker: CircuitBreaker):
+    """ """
+    for _ in range(4):
+        breaker.record(10, failed_ratio=1.0)
+    assert breaker.state == circuit_breaker.OPEN
+
+
+def test_opens_on_failed_searches(clock):
+    breaker = get_breaker()
+    breaker.record(10)
+    breaker.check()
+    open_breaker(breaker)
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+
+def test_opens_on_slow_searches(clock):
+    breaker = get_breaker()
+    for _ in range(4):
+        breaker.record(500)
+    assert breaker.is_open
+
+
+def test_a_failed_item_of_a_large_batch_does_not_open_it(clock):
+    breaker = get_breaker()
+    for _ in range(10):
+        breaker.record(10, failed_ratio=1 / 500)
+    assert breaker.state == circuit_breaker.CLOSED
+
+
+def test_half_open_lets_a_bounded_number_of_trials_through(clock):
+    breaker = get_breaker()
+    open_breaker(breaker)
+    clock.now += 5
+    breaker.check()
+    breaker.check()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+    # the trials succeed
+    breaker.record(10)
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    breaker.record(10)
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.check()
+
+
+def test_failed_trial_opens_it_again(clock):
+    breaker = get_breaker()
+    open_breaker(breaker)
+    clock.now += 5
+    breaker.check()
+    breaker.record(10, failed_ratio=1.0)
+    assert breaker.state == circuit_breaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.check()
+
+
+def test_trials_that_never_complete_are_given_again(clock):
+    breaker = get_breaker()
+    open_breaker(breaker)
+    clock.now += 5
+    breaker.check()
+    breaker.check()
+    clock.now += 5
+    breaker.check()
+    assert breaker.state == circuit_breaker.HALF_OPEN
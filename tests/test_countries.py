@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from geonames_api import countries
+from geonames_api.countries import (
+    build_country_table,
+    load_country_localized_names,
+    lookup_country,
+)
+
+
+@pytest.mark.parametrize(
+    "country, alpha_2",
+    [
+        ("FR", "FR"),
+        ("fra", "FR"),
+        ("250", "FR"),
+        ("France", "FR"),
+        ("french republic", "FR"),
+        ("United Kingdom", "GB"),
+        ("  GERMANY ", "DE"),
+        ("Côte d'Ivoire", "CI"),
+        ("cote d'ivoire", "CI"),
+    ],
+)
+def test_lookup_country(country, alpha_2):
+    assert lookup_country(country).alpha_2 == alpha_2
+
+
+def test_unknown_country():
+    assert lookup_country("Atlantis") is None
+    assert lookup_country("") is None
+    assert lookup_country(None) is None
+
+
+def test_localized_names(monkeypatch):
+    table = build_country_table(
+        {"DE": ["Deutschland", "Allemagne", "Austria"], "ES": ["España", "Espagne"]}
+    )
+    monkeypatch.setattr(countries, "country_table", table)
+    assert lookup_country("Deutschland").alpha_2 == "DE"
+    assert lookup_country("espana").alpha_2 == "ES"
+    assert lookup_country("Espagne").alpha_2 == "ES"
+    # codes and english names take precedence over the localized names
+    assert lookup_country("Austria").alpha_2 == "AT"
+    with pytest.raises(TypeError):
+        table["Atlantis"] = None
+
+
+def test_load_country_localized_names(tmp_path):
+    assert load_country_localized_names(str(tmp_path / "missing.json")) == {}
+    path = tmp_path / "country_names.json"
+    path.write_text(json.dumps({"DE": ["Deutschland"]}))
+    assert load_country_localized_names(str(path)) == {"DE": ["Deutschland"]}
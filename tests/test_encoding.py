@@ -0,0 +1,192 @@
+import gzip
+import json
+from typing import List
+
+import msgpack
+import pytest
+import zstandard
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from geonames_api.config import settings
+from geonames_api.encoding import (
+    BatchRoute,
+    NegotiatedResponse,
+    decompress,
+    negotiate_encoding,
+    negotiate_media_type,
+)
+
+
+class Item(BaseModel):
+    """ """
+
+    name: str
+
+
+class Batch(BaseModel):
+    """ """
+
+    items: List[Item]
+    upper: bool = False
+
+
+class TwoLists(BaseModel):
+    """ """
+
+    a: List[int]
+    b: List[int]
+
+
+router = APIRouter(route_class=BatchRoute, default_response_class=NegotiatedResponse)
+
+
+@router.post("/batch")
+def batch_route(data: Batch):
+    """ """
+    return NegotiatedResponse(
+        content=[
+            {"name": x.name.upper() if data.upper else x.name, "i": i}
+            for i, x in enumerate(data.items)
+        ]
+    )
+
+
+@router.post("/two-lists")
+def two_lists_route(data: TwoLists):
+    """ """
+    return NegotiatedResponse(content=data.a + data.b)
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+ITEMS = [{"name": f"place {i}"} for i in range(100)]
+EXPECTED = [{"name": f"place {i}", "i": i} for i in range(100)]
+
+
+def test_negotiation():
+    assert negotiate_media_type("application/x-msgpack") == "application/msgpack"
+    assert negotiate_media_type("application/x-ndjson, */*") == "application/x-ndjson"
+    assert negotiate_media_type("text/html") == "application/json"
+    assert negotiate_encoding("gzip, deflate, zstd") == "zstd"
+    assert negotiate_encoding("gzip;q=1.0") == "gzip"
+    assert negotiate_encoding(None) is None
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip", "zstd"])
+def test_compressed_json_body(encoding):
+    body = json.dumps({"items": ITEMS}).encode()
+    headers = {"content-type": "application/json"}
+    if encoding == "gzip":
+        body = gzip.compress(body)
+    elif encoding == "zstd":
+        body = zstandard.ZstdCompressor().compress(body)
+    if encoding:
+        headers["content-encoding"] = encoding
+    resp = client.post("/batch", data=body, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json() == EXPECTED
+
+
+def test_msgpack_round_trip():
+    resp = client.post(
+        "/batch",
+        data=msgpack.packb({"items": ITEMS, "upper": True}),
+        headers={
+            "content-type": "application/msgpack",
+            "accept": "application/msgpack",
+        },
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(resp.content) == [
+        {"name": x["name"].upper(), "i": x["i"]} for x in EXPECTED
+    ]
+
+
+def test_ndjson_round_trip():
+    body = "".join(json.dumps(x) + "\n" for x in ITEMS).encode()
+    resp = client.post(
+        "/batch",
+        data=body,
+        headers={
+            "content-type": "application/x-ndjson",
+            "accept": "application/x-ndjson",
+        },
+    )
+    assert resp.status_code == 200
+    assert [json.loads(x) for x in resp.text.splitlines()] == EXPECTED
+
+
+def test_ndjson_body_needs_a_single_list_field():
+    resp = client.post(
+        "/two-lists",
+        data=b"1\n2\n",
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert resp.status_code == 415
+
+
+def test_zstd_response():
+    resp = client.post(
+        "/batch", json={"items": ITEMS}, headers={"accept-encoding": "zstd"}
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == "zstd"
+    assert resp.headers["vary"] == "Accept-Encoding"
+    body = resp.content
+    # not decoded by the client (requests)
+    if not body.startswith(b"["):
+        body = zstandard.ZstdDecompressor().stream_reader(body).read()
+    assert json.loads(body) == EXPECTED
+
+
+def test_small_responses_are_not_compressed():
+    resp = client.post(
+        "/batch", json={"items": ITEMS[:1]}, headers={"accept-encoding": "zstd"}
+    )
+    assert "content-encoding" not in resp.headers
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_decompression_bomb(monkeypatch, encoding):
+    monkeypatch.setattr(settings, "max_body_size", 100_000)
+    body = b'{"items": [' + b" " * 10_000_000 + b"]}"
+    if encoding == "gzip":
+        body = gzip.compress(body)
+    else:
+        body = zstandard.ZstdCompressor().compress(body)
+    assert len(body) < 100_000
+    resp = client.post(
+        "/batch",
+        data=body,
+        headers={"content-type": "application/json", "content-encoding": encoding},
+    )
+    assert resp.status_code == 413
+
+
+def test_invalid_bodies():
+    headers = {"content-type": "application/json"}
+    resp = client.post(
+        "/batch", data=b"not gzip", headers={**headers, "content-encoding": "gzip"}
+    )
+    assert resp.status_code == 400
+    resp = client.post(
+        "/batch", data=b"{}", headers={**headers, "content-encoding": "br"}
+    )
+    assert resp.status_code == 415
+
+
+def test_decompress():
+    body = b"x" * 1000
+    assert decompress(gzip.compress(body) + gzip.compress(body), "gzip") == body * 2
+    assert decompress(body, "identity") == body
+    with pytest.raises(HTTPException) as e:
+        decompress(gzip.compress(body), "gzip", max_size=999)
+    assert e.value.status_code == 413
+    with pytest.raises(HTTPException) as e:
+        decompress(body, None, max_size=999)
+    assert e.value.status_code == 413
@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import ConnectionError as EsConnectionError
+
+from geonames_api import es_client, metrics
+from geonames_api.config import settings
+
+
+@pytest.fixture(autouse=True)
+def hedging(monkeypatch):
+    monkeypatch.setattr(settings.es, "hedging", True)
+    monkeypatch.setattr(settings.es, "hosts", ["es-1:9200", "es-2:9200"])
+    monkeypatch.setattr(settings.es, "hedge_min_delay_ms", 10)
+    metrics.latencies.pop("es.msearch", None)
+    metrics.latencies.pop("es.msearch.first_attempt", None)
+    es_client.hedge_delay.computed_at = float("-inf")
+
+
+class FakeNode:
+    """
+    Connection of a node answering after `latency` seconds, or failing
+    """
+
+    def __init__(self, name: str, latency: float = 0.0, error: Exception = None):
+        self.name = name
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def perform_request(self, method, url, body=None, timeout=None, headers=None):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        resp = {"responses": [{"node": self.name}]}
+        return 200, {"Content-Type": "application/json"}, json.dumps(resp)
+
+
+async def get_es(*nodes: FakeNode) -> AsyncElasticsearch:
+    """
+    Client whose pool connections are replaced by the fake nodes (the async client
+    creates its connections on first use)
+    """
+    es = AsyncElasticsearch(hosts=settings.es.hosts, max_retries=1)
+    await es.transport._async_call()
+    for connection, node in zip(es.transport.connection_pool.connections, nodes):
+        connection.perform_request = node.perform_request
+    return es
+
+
+def test_hedge_delay_is_a_cached_percentile_of_the_first_attempts():
+    for _ in range(100):
+        metrics.observe_latency("es.msearch.first_attempt", 50)
+        # hedged responses are faster, they don't lower the delay
+        metrics.observe_latency("es.msearch", 20)
+    assert es_client.get_hedge_delay() == pytest.approx(0.05)
+    for _ in range(1000):
+        metrics.observe_latency("es.msearch.first_attempt", 200)
+    # recomputed at most every second
+    assert es_client.get_hedge_delay() == pytest.approx(0.05)
+
+
+def test_slow_first_attempt_is_hedged_on_the_other_node():
+    async def run():
+        slow, fast = FakeNode("slow", latency=0.5), FakeNode("fast")
+        es = await get_es(slow, fast)
+        connections = es.transport.connection_pool.connections
+        resp = await es_client.hedged_request(
+            lambda connection, avoid: es_client.perform_request_on(
+                es, connection, "/_msearch", [{}, {}], 1, avoid=avoid
+            ),
+            (connections[0], connections[1]),
+            delay=0.01,
+        )
+        return resp, slow, fast
+
+    resp, slow, fast = asyncio.run(run())
+    assert resp == {"responses": [{"node": "fast"}]}
+    assert slow.cancelled == 1
+    # the cancelled first attempt is recorded, at least as slow as the delay
+    assert min(metrics.latencies["es.msearch.first_attempt"].values) >= 10
+
+
+def test_cancelled_hedged_request_cancels_its_attempts():
+    async def run():
+        nodes = FakeNode("a", latency=1), FakeNode("b", latency=1)
+        es = await get_es(*nodes)
+        connections = es.transport.connection_pool.connections
+        task = asyncio.ensure_future(
+            es_client.hedged_request(
+                lambda connection, avoid: es_client.perform_request_on(
+                    es, connection, "/_msearch", [{}, {}], 2, avoid=avoid
+                ),
+                (connections[0], connections[1]),
+                delay=0.01,
+            )
+        )
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return nodes
+
+    nodes = asyncio.run(run())
+    assert [x.calls for x in nodes] == [1, 1]
+    assert [x.cancelled for x in nodes] == [1, 1]
+
+
+def test_request_on_a_failing_node_is_retried_on_another_node():
+    async def run():
+        down = FakeNode("down", error=EsConnectionError("N/A", "down", None))
+        up = FakeNode("up")
+        es = await get_es(down, up)
+        connection = es.transport.connection_pool.connections[0]
+        resp = await es_client.perform_request_on(
+            es, connection, "/_msearch", [{}, {}], 1
+        )
+        return resp, es.transport.connection_pool
+
+    resp, pool = asyncio.run(run())
+    assert resp == {"responses": [{"node": "up"}]}
+    # marked dead, as the transport does
+    assert len(pool.connections) == 1
+
+
+def test_msearch_is_hedged_only_with_two_live_nodes():
+    async def run():
+        es = await get_es(FakeNode("a"), FakeNode("b"))
+        pool = es.transport.connection_pool
+        connections = es_client.get_hedge_connections(es)
+        pool.mark_dead(pool.connections[0])
+        return connections, es_client.get_hedge_connections(es)
+
+    connections, single_node_connections = asyncio.run(run())
+    assert connections[0] is not connections[1]
+    assert single_node_connections is None
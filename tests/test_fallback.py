@@ -0,0 +1,116 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from geonames_api import fallback
+from geonames_api.config import settings
+from geonames_api.models import GeonameItemES
+from geonames_api.search import SearchResult, SearchStage
+
+
+def get_stages(name: str, country_code: str = None) -> list:
+    """ """
+    return [
+        SearchStage(
+            name="global",
+            header={"index": "geonames"},
+            query={"match": {"name": name}},
+            place_name=name,
+            country_code=country_code,
+        )
+    ]
+
+
+def get_place(geonameid: str, name: str, country_code: str, population: int) -> dict:
+    """ """
+    return {
+        "geonameid": geonameid,
+        "name": name,
+        "asciiname": name,
+        "country_code": country_code,
+        "population": population,
+        "alternative_names": [],
+    }
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    """
+    Empty stale results store, in a temporary directory
+    """
+    monkeypatch.setattr(settings, "search_templates", False)
+    store = fallback.StaleResultStore(str(tmp_path / "stale" / "results.sqlite"))
+    monkeypatch.setattr(fallback, "stale_result_store", store)
+    monkeypatch.setattr(fallback, "major_places", fallback.load_major_places(None))
+    return store
+
+
+def test_stored_results_are_read_back(store):
+    stages = get_stages("Lyon", "FR")
+    lyon = GeonameItemES(geonameid="2996944", name="Lyon", asciiname="Lyon", score=10)
+    fallback.store_search_results([stages, []], [SearchResult(candidates=[lyon])] * 2)
+    # pending, then written
+    assert store.get(fallback.get_stages_key(stages)) == [lyon]
+    fallback.stale_result_store.flush()
+    assert store.pending == {}
+    results = asyncio.run(fallback.get_fallback_results_async([stages, []]))
+    assert results[0].fallback == fallback.STORE
+    assert results[0].candidates == [lyon]
+    assert results[1] == SearchResult()
+    # persisted across restarts
+    assert fallback.StaleResultStore(store.path).get(
+        fallback.get_stages_key(stages)
+    ) == [lyon]
+
+
+def test_store_keeps_the_best_candidates(store):
+    stages = get_stages("Saint-Denis")
+    candidates = [
+        GeonameItemES(
+            geonameid=str(i), name="Saint-Denis", asciiname="Saint-Denis", score=10 - i
+        )
+        for i in range(5)
+    ]
+    fallback.store_search_results([stages], [SearchResult(candidates=candidates)])
+    stored = store.get(fallback.get_stages_key(stages))
+    assert [x.geonameid for x in stored] == ["0", "1", "2"]
+
+
+def test_failed_writes_are_kept_pending(store, monkeypatch):
+    def connect():
+        raise sqlite3.OperationalError("disk I/O error")
+
+    key = fallback.get_stages_key(get_stages("Lyon"))
+    store.put(
+        key, [GeonameItemES(geonameid="1", name="Lyon", asciiname="Lyon", score=1)]
+    )
+    monkeypatch.setattr(store, "connect", connect)
+    store.flush()
+    assert key in store.pending
+    # unreadable store: not stored
+    assert store.get("unknown") is None
+
+
+def test_major_places_fallback(store, monkeypatch, tmp_path):
+    path = tmp_path / "major_places.json"
+    path.write_text(
+        json.dumps(
+            [
+                get_place("4717560", "Paris", "US", 25171),
+                get_place("2988507", "Paris", "FR", 2138551),
+            ]
+        )
+    )
+    monkeypatch.setattr(fallback, "major_places", fallback.load_major_places(path))
+    results = asyncio.run(
+        fallback.get_fallback_results_async(
+            [get_stages("paris"), get_stages("Paris", "US"), get_stages("Nowhere")]
+        )
+    )
+    assert [x.fallback for x in results] == [fallback.MAJOR_PLACES] * 3
+    # most populated place of the name, unless the country is known
+    assert results[0].candidates[0].geonameid == "2988507"
+    assert results[1].candidates[0].geonameid == "4717560"
+    assert results[2].candidates == []
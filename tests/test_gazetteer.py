@@ -0,0 +1,93 @@
+import os
+
+from geonames_api.gazetteer import (
+    get_gazetteer_metadata,
+    get_gazetteer_path,
+    get_sources_checksums,
+    iter_gazetteer_items,
+    read_gazetteer,
+    write_gazetteer,
+)
+from geonames_api.models import AlternativeName, GeonameItem
+from geonames_api.reverse_geocoding import ReverseGeocoder
+from geonames_api.spelling import SpellingCorrector
+
+ITEMS = [
+    GeonameItem(
+        geonameid="2988507",
+        name="Paris",
+        asciiname="Paris",
+        alternative_names=[AlternativeName(name="Parigi", langs=["it"])],
+        latitude=48.85341,
+        longitude=2.3488,
+        feature_class="P",
+        feature_code="PPLC",
+        country_code="FR",
+        population=2138551,
+        postal_codes=["75001", "75002"],
+        admin1_name="Île-de-France",
+    ),
+    GeonameItem(
+        geonameid="2996944",
+        name="Lyon",
+        asciiname="Lyon",
+        latitude=45.74846,
+        longitude=4.84671,
+        feature_class="P",
+        feature_code="PPLA",
+        country_code="FR",
+        population=522969,
+    ),
+    GeonameItem(
+        geonameid="3017382",
+        name="France",
+        asciiname="France",
+        feature_class="A",
+        feature_code="PCLI",
+        country_code="FR",
+    ),
+]
+
+
+def write(tmp_path, **kwargs) -> str:
+    """ """
+    path = get_gazetteer_path(str(tmp_path), "test")
+    assert write_gazetteer(ITEMS, path, **kwargs) == len(ITEMS)
+    return path
+
+
+def test_round_trip(tmp_path):
+    path = write(tmp_path, metadata={"version": "test"}, batch_size=2)
+    assert not os.path.exists(f"{path}.tmp")
+    table = read_gazetteer(path)
+    assert table.num_rows == len(ITEMS)
+    assert get_gazetteer_metadata(table) == {"version": "test"}
+    items = list(iter_gazetteer_items(table))
+    assert [x.geonameid for x in items] == [x.geonameid for x in ITEMS]
+    assert items[0].alternative_names[0].name == "Parigi"
+    assert items[0].postal_codes == ["75001", "75002"]
+    assert items[0].admin1_name == "Île-de-France"
+    assert items[2].population is None
+
+
+def test_version_follows_the_sources(tmp_path):
+    source = tmp_path / "allCountries.txt"
+    source.write_text("a")
+    version = get_sources_checksums({"geonames": str(source)})["version"]
+    assert get_sources_checksums({"geonames": str(source)})["version"] == version
+    assert (
+        get_sources_checksums({"geonames": str(source)}, include_countries=["FR"])[
+            "version"
+        ]
+        != version
+    )
+    source.write_text("b")
+    assert get_sources_checksums({"geonames": str(source)})["version"] != version
+
+
+def test_readers(tmp_path):
+    path = write(tmp_path)
+    reverse_geocoder = ReverseGeocoder.from_gazetteer(path)
+    assert reverse_geocoder.reverse_geocode(45.7, 4.8).place.name == "Lyon"
+    corrector = SpellingCorrector.from_gazetteer(path)
+    assert corrector.correct("Parrigi") == "parigi"
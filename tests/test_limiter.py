@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from geonames_api.limiter import AdaptiveConcurrencyLimiter, Overloaded
+from geonames_api.search import SearchStage, staged_msearch_async
+
+
+def get_limiter(name: str, **kwargs) -> AdaptiveConcurrencyLimiter:
+    """ """
+    params = dict(
+        initial_limit=4,
+        min_limit=1,
+        max_limit=20,
+        latency_target_ms=50,
+        queue_size=2,
+        queue_timeout=0.05,
+    )
+    params.update(kwargs)
+    return AdaptiveConcurrencyLimiter(name, **params)
+
+
+class FakeEs:
+    """
+    ES answering an msearch of n searches after n * `search_ms` (no hits)
+    """
+
+    def __init__(self, search_ms: float):
+        self.search_ms = search_ms
+
+    async def msearch(self, body: list, request_timeout: float = None) -> dict:
+        n_searches = len(body) // 2
+        await asyncio.sleep(n_searches * self.search_ms / 1000)
+        return {"responses": [{"hits": {"hits": []}}] * n_searches}
+
+
+def get_batch_stages(n_locations: int) -> list:
+    """ """
+    return [
+        [SearchStage(name="global", header={"index": "geonames"}, query={})]
+        for _ in range(n_locations)
+    ]
+
+
+def test_limit_backs_off_over_the_target_and_grows_under_it():
+    limiter = get_limiter("test_aimd")
+    limiter.in_flight = 1
+    limiter.release(latency_ms=100, ok=True)
+    assert limiter.limit == pytest.approx(4 * 0.9)
+
+    limit = limiter.limit
+    limiter.in_flight = 3
+    limiter.release(latency_ms=10, ok=True)
+    assert limiter.limit == pytest.approx(limit + 1 / limit)
+
+    limit = limiter.limit
+    limiter.in_flight = 1
+    limiter.release(latency_ms=10, ok=False)
+    assert limiter.limit == pytest.approx(limit * 0.9)
+
+
+def test_limit_never_goes_under_the_min_limit():
+    limiter = get_limiter("test_min", initial_limit=2, min_limit=2)
+    for _ in range(10):
+        limiter.in_flight = 1
+        limiter.release(latency_ms=1000, ok=True)
+    assert limiter.limit == 2
+
+
+def test_searches_over_the_limit_are_shed_with_a_429():
+    async def run():
+        limiter = get_limiter("test_shed", initial_limit=1, queue_size=1)
+
+        async def search():
+            async with limiter.slot():
+                await asyncio.sleep(0.2)
+
+        return await asyncio.gather(
+            *[search() for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    rejected = [x for x in results if isinstance(x, Overloaded)]
+    # one search running, one waiting in the queue (times out), one shed
+    assert len(rejected) == 2
+    assert all(x.status_code == 429 for x in rejected)
+    assert all(int(x.headers["Retry-After"]) >= 1 for x in rejected)
+
+
+def test_latency_is_compared_per_search_of_the_msearch():
+    limiter = get_limiter("test_per_search")
+    limiter.in_flight = 0
+
+    async def run():
+        async with limiter.slot(n_searches=100):
+            await asyncio.sleep(0.2)
+
+    asyncio.run(run())
+    # 200ms for 100 searches: 2ms per search, under the 50ms target
+    assert limiter.limit >= 4
+
+
+def test_large_batches_on_a_healthy_backend_keep_the_limit():
+    """
+    Batches of 500 locations take 500 * 0.2ms = 100ms per msearch, over the 50ms
+    target of a single search, on a backend that isn't overloaded
+    """
+    limiter = get_limiter("test_large_batches")
+    es = FakeEs(search_ms=0.2)
+
+    async def run():
+        for _ in range(5):
+            await asyncio.gather(
+                *[
+                    staged_msearch_async(es, get_batch_stages(500), limiter=limiter)
+                    for _ in range(4)
+                ]
+            )
+
+    asyncio.run(run())
+    assert limiter.limit >= 4
+    assert limiter.in_flight == 0
+
+
+def test_slow_single_searches_shrink_the_limit():
+    limiter = get_limiter("test_slow_searches")
+    es = FakeEs(search_ms=100)
+
+    async def run():
+        for _ in range(5):
+            await staged_msearch_async(es, get_batch_stages(1), limiter=limiter)
+
+    asyncio.run(run())
+    assert limiter.limit < 4
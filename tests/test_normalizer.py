@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("postal")
+
+from geonames_api import normalizer  # noqa: E402
+from geonames_api.config import settings  # noqa: E402
+
+
+class FakeEs:
+    """ """
+
+    closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def es(monkeypatch):
+    """
+    Client created by the normalizer, no background tasks
+    """
+    es = FakeEs()
+    monkeypatch.setattr(normalizer, "create_es_async", lambda: es)
+    monkeypatch.setattr(settings, "circuit_breaker", False)
+    return es
+
+
+def test_batches_keep_the_order_of_the_locations(es, monkeypatch):
+    batches = []
+    running, max_running = 0, 0
+
+    async def normalise_location_batch_async(es, locations):
+        nonlocal running, max_running
+        batches.append(locations)
+        running += 1
+        max_running = max(max_running, running)
+        # the first batches complete last
+        await asyncio.sleep(0.01 * (10 - locations[0] // 3))
+        running -= 1
+        return [2 * x for x in locations]
+
+    monkeypatch.setattr(
+        normalizer, "normalise_location_batch_async", normalise_location_batch_async
+    )
+    with normalizer.GeonamesNormalizer(batch_size=3, concurrency=2) as instance:
+        results = instance.normalize_job_locations(list(range(10)))
+    assert results == [2 * x for x in range(10)]
+    assert sorted(len(x) for x in batches) == [1, 3, 3, 3]
+    assert max_running == 2
+    # closed with the own loop of the normalizer
+    assert es.closed
+    assert instance.clients == {}
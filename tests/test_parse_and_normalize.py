@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("postal")
+
+from geonames_api import parse_and_normalize  # noqa: E402
+from geonames_api.config import settings  # noqa: E402
+from geonames_api.models import GeonameItemES, ParsedLocation  # noqa: E402
+from geonames_api.search import SearchResult  # noqa: E402
+from geonames_api.spelling import SpellingCorrector  # noqa: E402
+
+
+def get_place(geonameid: str, name: str) -> GeonameItemES:
+    """ """
+    return GeonameItemES(
+        geonameid=geonameid, name=name, asciiname=name, feature_class="P", score=10
+    )
+
+
+MARSEILLE = get_place("2995469", "Marseille")
+LYON = get_place("2996944", "Lyon")
+# hamlet, too small to be in the spelling dictionary
+LYONS = get_place("3000000", "Lyons")
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    """
+    Searched corrections, answered from a fake index
+    """
+    searched = []
+    places = {"marseille": MARSEILLE, "lyon": LYON}
+
+    async def search_async(es, batch_stages, locations):
+        results = []
+        for stages in batch_stages:
+            name = stages[-1].params["name"] if stages[-1].params else None
+            if name is None:
+                name = stages[-1].query["bool"]["must"][0]["dis_max"]["queries"][2]
+                name = name["match"]["name"]
+            searched.append(name)
+            place = places.get(name)
+            results.append(
+                SearchResult(stage="location", candidates=[place] if place else [])
+            )
+        return results
+
+    monkeypatch.setattr(parse_and_normalize, "search_async", search_async)
+    monkeypatch.setattr(
+        parse_and_normalize,
+        "spelling_corrector",
+        SpellingCorrector.from_terms({"marseille": 870000, "lyon": 520000}),
+    )
+    monkeypatch.setattr(settings, "candidate_verification", True)
+    return searched
+
+
+def search_corrected(city: str, candidates: list):
+    """ """
+    locations = [ParsedLocation(city=city, raw=city)]
+    search_results = [SearchResult(stage="location", candidates=candidates)]
+    similarities = parse_and_normalize.get_locations_name_similarities(
+        locations, search_results
+    )
+    return asyncio.run(
+        parse_and_normalize.search_corrected_async(
+            None, locations, ["FR"], search_results, similarities
+        )
+    )
+
+
+def test_unmatched_name_is_corrected(searched):
+    search_results, similarities = search_corrected("Marseile", [])
+    assert searched == ["marseille"]
+    assert search_results[0].candidates == [MARSEILLE]
+    assert similarities[0][0] >= settings.min_name_similarity
+
+
+def test_name_without_similar_candidate_is_corrected(searched):
+    search_results, _ = search_corrected("Marseile", [get_place("1", "Tulle")])
+    assert searched == ["marseille"]
+    assert search_results[0].candidates == [MARSEILLE]
+
+
+def test_matched_rare_name_is_not_corrected(searched):
+    search_results, similarities = search_corrected("Lyons", [LYONS])
+    assert searched == []
+    assert search_results[0].candidates == [LYONS]
+    assert similarities[0][0] == 1
+
+
+def test_match_ids_are_verified(monkeypatch):
+    monkeypatch.setattr(settings, "candidate_verification", True)
+    monkeypatch.setattr(settings, "es_ranking", True)
+    tulle = get_place("2971482", "Tulle")
+    locations = [ParsedLocation(city="Marseille"), ParsedLocation(city="Marseille")]
+    search_results = [
+        SearchResult(stage="location", candidates=[tulle, MARSEILLE]),
+        SearchResult(stage="location", candidates=[tulle]),
+    ]
+    assert parse_and_normalize.get_match_ids(locations, search_results) == [
+        MARSEILLE.geonameid,
+        None,
+    ]
+
+
+@pytest.mark.parametrize("es_ranking", [False, True])
+def test_select_best_matching_place(monkeypatch, es_ranking):
+    monkeypatch.setattr(settings, "es_ranking", es_ranking)
+    region = GeonameItemES(
+        geonameid="2968815",
+        name="Paris",
+        asciiname="Paris",
+        feature_class="A",
+        feature_code="ADM2",
+        score=12,
+    )
+    capital = GeonameItemES(
+        geonameid="2988507",
+        name="Paris",
+        asciiname="Paris",
+        feature_class="P",
+        feature_code="PPLC",
+        score=11,
+    )
+    best = parse_and_normalize.select_best_matching_place([region, capital])
+    # ranked by ES: its first hit, otherwise the best feature among the top scores
+    assert best is (region if es_ranking else capital)
+
+
+def test_unmatched_location_is_not_searched_again():
+    parse_and_normalize.negative_cache.clear()
+    parsed_location = ParsedLocation(city="Nowhere", raw="Nowhere")
+    parse_and_normalize.cache_if_unmatched(
+        "Nowhere ", "FR", parsed_location, SearchResult(stage="global")
+    )
+    # same location, normalized: skips the parsing and the search
+    cached, stages = parse_and_normalize.get_raw_location_search_stages(
+        "  nowhere", country_code="FR"
+    )
+    assert cached == parsed_location
+    assert stages == []
+    # other country
+    assert not parse_and_normalize.negative_cache.get(
+        parse_and_normalize.get_negative_cache_key("Nowhere", "BE")
+    )
+    parse_and_normalize.negative_cache.clear()
+
+
+def test_matched_or_not_searched_locations_are_not_cached():
+    parse_and_normalize.negative_cache.clear()
+    parsed_location = ParsedLocation(city="Lyon", raw="Lyon")
+    parse_and_normalize.cache_if_unmatched(
+        "Lyon", "FR", parsed_location, SearchResult(stage="global", candidates=[LYON])
+    )
+    # degraded mode / ES error results have no stage
+    parse_and_normalize.cache_if_unmatched(
+        "Lyon", "FR", parsed_location, SearchResult(fallback="store")
+    )
+    assert len(parse_and_normalize.negative_cache) == 0
+
+
+def test_batch_name_similarities():
+    bratislava = GeonameItemES(
+        geonameid="3060972",
+        name="Bratislava",
+        asciiname="Bratislava",
+        alternative_names=[{"name": "Pressburg"}, {"name": "Pozsony"}],
+        score=10,
+    )
+    similarities = parse_and_normalize.get_batch_name_similarities(
+        [[MARSEILLE, LYON], [bratislava], [LYON]], ["Marseille", "Pressburg", None]
+    )
+    assert similarities[0][0] == 1
+    assert similarities[0][1] < settings.min_name_similarity
+    # matched by an alternative name
+    assert similarities[1][0] == 1
+    # no query name: not verified
+    assert similarities[2] is None
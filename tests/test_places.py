@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from elasticsearch import ConnectionError
+from fastapi import HTTPException
+
+from geonames_api import places
+from geonames_api.config import settings
+from geonames_api.es_index_settings import GEONAMEID_IDS_META
+
+
+class FakeEs:
+    """ """
+
+    def __init__(self, meta: dict = None, error: Exception = None):
+        self.meta = meta
+        self.error = error
+        self.calls = 0
+        self.indices = SimpleNamespace(get_mapping=self.get_mapping)
+
+    async def get_mapping(self, index: str, request_timeout: float = None) -> dict:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {index: {"mappings": {"_meta": self.meta}}}
+
+    async def mget(self, index: str, ids: list, request_timeout: float = None) -> dict:
+        self.calls += 1
+        return {
+            "docs": [
+                (
+                    {
+                        "found": True,
+                        "_source": {"geonameid": x, "name": x, "asciiname": x},
+                    }
+                    if x != "0"
+                    else {"found": False}
+                )
+                for x in ids
+            ]
+        }
+
+
+@pytest.fixture(autouse=True)
+def clear_caches(monkeypatch):
+    monkeypatch.setattr(settings, "country_routing", False)
+    monkeypatch.setattr(settings, "country_group_indices", False)
+    places.geonameid_ids_cache.clear()
+    places.places_cache.clear()
+
+
+def check(es: FakeEs):
+    """ """
+    asyncio.run(places.check_geonameid_ids_async(es))
+
+
+def test_index_with_geonameid_ids_is_checked_once():
+    es = FakeEs(meta={GEONAMEID_IDS_META: True})
+    check(es)
+    check(es)
+    assert es.calls == 1
+
+
+def test_index_without_geonameid_ids_is_checked_again_once_rebuilt():
+    es = FakeEs(meta=None)
+    with pytest.raises(HTTPException) as e:
+        check(es)
+    assert e.value.status_code == 503
+    # the index is rebuilt, the check expires
+    es.meta = {GEONAMEID_IDS_META: True}
+    places.geonameid_ids_cache.clear()
+    check(es)
+
+
+def test_check_failing_in_es_is_a_503_and_not_cached():
+    es = FakeEs(error=ConnectionError("N/A", "down", None))
+    with pytest.raises(HTTPException) as e:
+        check(es)
+    assert e.value.status_code == 503
+    es.error, es.meta = None, {GEONAMEID_IDS_META: True}
+    check(es)
+
+
+def test_only_found_places_are_cached():
+    es = FakeEs()
+    results = asyncio.run(places.get_places_async(es, ["1", "0", "1"]))
+    assert [x and x.geonameid for x in results] == ["1", None, "1"]
+    assert "1" in places.places_cache
+    assert "0" not in places.places_cache
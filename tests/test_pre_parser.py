@@ -0,0 +1,64 @@
+import pytest
+
+from geonames_api import metrics
+from geonames_api.models import ParsedLocation
+from geonames_api.pre_parser import pre_parse_location, try_pre_parse_location
+
+
+@pytest.mark.parametrize(
+    "raw_location, country_code, parsed",
+    [
+        # french department numbers
+        ("Mérignac (33)", "FR", ParsedLocation(city="mérignac", postcode="33000")),
+        (
+            "Chamonix-Mont-Blanc (74)",
+            "FR",
+            ParsedLocation(city="chamonix-mont-blanc", postcode="74000"),
+        ),
+        ("Rezé 44", "FR", ParsedLocation(city="rezé", postcode="44000")),
+        ("Lyon -69", "FR", ParsedLocation(city="lyon", postcode="69000")),
+        # US state codes
+        ("Austin, TX", "US", ParsedLocation(city="austin", state="tx")),
+        # countries
+        ("Berlin, Germany", "DE", ParsedLocation(city="berlin", country="germany")),
+        ("Madrid, Spain", None, ParsedLocation(city="madrid", country="spain")),
+        # postcodes
+        ("75011", "FR", ParsedLocation(postcode="75011")),
+        (" 1000 ", "BE", ParsedLocation(postcode="1000")),
+    ],
+)
+def test_pre_parsed_shapes(raw_location, country_code, parsed):
+    assert pre_parse_location(raw_location, country_code) == parsed
+
+
+@pytest.mark.parametrize(
+    "raw_location, country_code",
+    [
+        # department numbers are french only
+        ("Mérignac (33)", "BE"),
+        ("Mérignac (33)", None),
+        # 2 letters regions are ambiguous out of the US
+        ("Berlin, DE", "DE"),
+        ("Austin, TX", None),
+        # conflicting country, US states named as countries
+        ("Berlin, Germany", "FR"),
+        ("Atlanta, Georgia", "US"),
+        ("Atlanta, Georgia", None),
+        # unknown regions and other shapes
+        ("Saint-Nazaire, Pays de la Loire", "FR"),
+        ("10 rue de Rivoli, 75001 Paris", "FR"),
+        ("Paris", "FR"),
+        ("123", "FR"),
+    ],
+)
+def test_shapes_left_to_libpostal(raw_location, country_code):
+    assert pre_parse_location(raw_location, country_code) is None
+
+
+def test_bypass_rate():
+    total = metrics.counters["pre_parser.total"]
+    bypass = metrics.counters["pre_parser.bypass"]
+    assert try_pre_parse_location("Mérignac (33)", "FR") is not None
+    assert try_pre_parse_location("Paris", "FR") is None
+    assert metrics.counters["pre_parser.total"] - total == 2
+    assert metrics.counters["pre_parser.bypass"] - bypass == 1
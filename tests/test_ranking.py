@@ -0,0 +1,55 @@
+import pytest
+
+from geonames_api.config import settings
+from geonames_api.queries import build_location_query
+from geonames_api.ranking import (
+    UNKNOWN_FEATURE_RANK,
+    get_feature_rank,
+    get_feature_rank_feature,
+    get_population_rank_feature,
+)
+
+
+def test_feature_rank_order():
+    ranks = [
+        get_feature_rank("P", "PPLC"),
+        get_feature_rank("P", "PPLA"),
+        get_feature_rank("P", "PPL"),
+        get_feature_rank("P", "PPLX"),
+        get_feature_rank("A", "ADM1"),
+        get_feature_rank("L", "RGN"),
+        get_feature_rank("S", "HTL"),
+    ]
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert get_feature_rank("S", "HTL") == UNKNOWN_FEATURE_RANK
+    # a known class with an unknown code comes after the known codes of its class
+    assert get_feature_rank("P", "PPLX") == get_feature_rank("P", None)
+
+
+def test_rank_features_are_positive_and_higher_is_better():
+    capital = get_feature_rank_feature("P", "PPLC")
+    city = get_feature_rank_feature("P", "PPL")
+    unknown = get_feature_rank_feature("S", "HTL")
+    assert capital > city > unknown > 0
+
+
+@pytest.mark.parametrize(
+    "population, rank", [(None, None), (0, None), (-1, None), (2138551, 2138551.0)]
+)
+def test_population_rank_feature(population, rank):
+    assert get_population_rank_feature(population) == rank
+
+
+@pytest.mark.parametrize("es_ranking", [False, True])
+def test_location_query_rank_features(monkeypatch, es_ranking):
+    monkeypatch.setattr(settings, "es_ranking", es_ranking)
+    query = build_location_query(
+        {"name": "Paris", "asciiname": "Paris", "country_code": "FR"}
+    )
+    fields = [
+        x["rank_feature"]["field"]
+        for x in query["bool"]["should"]
+        if "rank_feature" in x
+    ]
+    assert fields == (["feature_rank", "population_rank"] if es_ranking else [])
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import socket
+
+import pytest
+from aiohttp import web
+
+from scripts.replay_load_test import (
+    FAILED,
+    JOB_LOCATION,
+    RAW_LOCATION,
+    build_requests,
+    get_accuracy,
+    get_match_ids,
+    load_replay_items,
+    replay,
+)
+
+RECORDS = [
+    {"raw_location": "Mérignac (33)", "country_code": "FR", "expected_geonameid": "1"},
+    {"raw_location": "Lyon", "expected_geonameid": ["2", "20"]},
+    {"location": {"country_code": "FR", "city": "Paris"}, "expected_geonameid": "3"},
+    {"raw_location": "Remote"},
+]
+
+
+@pytest.fixture
+def unused_tcp_port() -> int:
+    """ """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_items(tmp_path):
+    """ """
+    path = tmp_path / "golden.jsonl"
+    path.write_text("\n".join(json.dumps(x) for x in RECORDS) + "\n\n")
+    return load_replay_items([str(path)])
+
+
+def test_load_replay_items(tmp_path):
+    items = load_items(tmp_path)
+    assert [x.id for x in items] == [0, 1, 2, 3]
+    assert [x.kind for x in items] == [RAW_LOCATION] * 2 + [JOB_LOCATION, RAW_LOCATION]
+    assert items[0].payload == {"raw_location": "Mérignac (33)", "country_code": "FR"}
+    assert items[1].expected_geonameids == {"2", "20"}
+    assert items[2].payload == {"country_code": "FR", "city": "Paris"}
+    assert items[3].expected_geonameids is None
+
+
+def test_build_requests(tmp_path):
+    items = load_items(tmp_path)
+    requests = build_requests(items, batch_size=1)
+    assert [x.path for x in requests] == [
+        "/parse_and_normalize_raw_location",
+        "/parse_and_normalize_raw_location",
+        "/normalize-job-location",
+        "/parse_and_normalize_raw_location",
+    ]
+    assert requests[2].body == {"location": {"country_code": "FR", "city": "Paris"}}
+    requests = build_requests(items, batch_size=2)
+    assert [(x.path, len(x.items)) for x in requests] == [
+        ("/parse-and-normalize-raw-location-batch", 2),
+        ("/parse-and-normalize-raw-location-batch", 1),
+        ("/normalize-job-location-batch", 1),
+    ]
+    assert requests[2].body == {"locations": [{"country_code": "FR", "city": "Paris"}]}
+
+
+def test_match_ids():
+    assert get_match_ids({"match": {"geonameid": "1"}}) == ["1"]
+    assert get_match_ids([{"match": None}, {"match": {"geonameid": "2"}}]) == [
+        None,
+        "2",
+    ]
+
+
+def test_accuracy_counts_the_failed_requests_as_misses(tmp_path):
+    items = load_items(tmp_path)
+    matches = {0: ["1", "1"], 1: ["20", FAILED], 2: ["4", None], 3: [None, None]}
+    accuracy = get_accuracy(items, matches)
+    assert accuracy["all"] == {
+        "n": 6,
+        "n_failed": 1,
+        "top1_accuracy": 3 / 6,
+        "answered_top1_accuracy": 3 / 5,
+    }
+    assert accuracy[RAW_LOCATION]["top1_accuracy"] == 3 / 4
+    assert accuracy[JOB_LOCATION]["top1_accuracy"] == 0
+
+
+def test_replay(tmp_path, unused_tcp_port):
+    items = load_items(tmp_path)
+
+    async def parse_and_normalize(request):
+        body = await request.json()
+        if body["raw_location"] == "Lyon":
+            return web.json_response({"detail": "overloaded"}, status=429)
+        return web.json_response({"match": {"geonameid": "1"}})
+
+    async def normalize(request):
+        return web.json_response({"match": None})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/parse_and_normalize_raw_location", parse_and_normalize)
+        app.router.add_post("/normalize-job-location", normalize)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", unused_tcp_port)
+        await site.start()
+        try:
+            return await replay(
+                f"http://127.0.0.1:{unused_tcp_port}",
+                build_requests(items, batch_size=1),
+                concurrency=2,
+                timeout=5,
+            )
+        finally:
+            await runner.cleanup()
+
+    result = asyncio.run(run())
+    assert len(result["latencies"]) == 4
+    assert result["errors"] == {"429": 1}
+    assert dict(result["matches"]) == {0: ["1"], 1: [FAILED], 2: [None], 3: ["1"]}
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from geonames_api.reverse_geocoding import MissingFeatureClass, ReverseGeocoder
+
+ITEMS = [
+    {
+        "geonameid": "2988507",
+        "name": "Paris",
+        "asciiname": "Paris",
+        "feature_class": "P",
+        "feature_code": "PPLC",
+        "country_code": "FR",
+        "latitude": 48.85341,
+        "longitude": 2.3488,
+        "population": 2138551,
+    },
+    {
+        "geonameid": "2996944",
+        "name": "Lyon",
+        "asciiname": "Lyon",
+        "feature_class": "P",
+        "feature_code": "PPLA",
+        "country_code": "FR",
+        "latitude": 45.74846,
+        "longitude": 4.84671,
+        "population": 522969,
+    },
+    {
+        "geonameid": "3031582",
+        "name": "Boulogne-Billancourt",
+        "asciiname": "Boulogne-Billancourt",
+        "feature_class": "P",
+        "feature_code": "PPL",
+        "country_code": "FR",
+        "latitude": 48.83545,
+        "longitude": 2.24128,
+        "population": None,
+    },
+    {
+        "geonameid": "6252001",
+        "name": "United States",
+        "asciiname": "United States",
+        "feature_class": "S",
+        "latitude": 39.76,
+        "longitude": -98.5,
+    },
+]
+
+
+def test_nearest_place():
+    reverse_geocoder = ReverseGeocoder.from_items(ITEMS)
+    assert len(reverse_geocoder) == 3
+    results = reverse_geocoder.reverse_geocode_batch([45.75, 48.85], [4.85, 2.35])
+    assert [x["place"]["name"] for x in results] == ["Lyon", "Paris"]
+    assert results[0]["distance_km"] < 1
+
+
+def test_nearest_place_min_population():
+    reverse_geocoder = ReverseGeocoder.from_items(ITEMS)
+    # Boulogne-Billancourt is the nearest place, but its population is unknown
+    result = reverse_geocoder.reverse_geocode(48.835, 2.24, min_population=1000)
+    assert result.place.name == "Paris"
+
+
+def test_coordinates_and_population_are_returned_as_indexed():
+    reverse_geocoder = ReverseGeocoder.from_items(ITEMS)
+    result = reverse_geocoder.reverse_geocode(45.75, 4.85)
+    assert result.place.latitude == 45.74846
+    assert result.place.longitude == 4.84671
+    assert result.place.population == 522969
+    result = reverse_geocoder.reverse_geocode(48.835, 2.24)
+    assert result.place.name == "Boulogne-Billancourt"
+    assert result.place.population is None
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "reverse_geocoding.npz")
+    ReverseGeocoder.from_items(ITEMS).save(path)
+    reverse_geocoder = ReverseGeocoder.load(path)
+    result = reverse_geocoder.reverse_geocode(48.85, 2.35)
+    assert result.place.name == "Paris"
+    assert result.place.latitude == 48.85341
+
+
+def test_load_outdated_data(tmp_path):
+    path = str(tmp_path / "reverse_geocoding.npz")
+    columns = dict(ReverseGeocoder.from_items(ITEMS).columns)
+    columns["latitude"] = (columns["latitude"] / 1e5).astype(np.float32)
+    np.savez(path, **columns)
+    with pytest.raises(ValueError):
+        ReverseGeocoder.load(path)
+
+
+def test_missing_feature_class():
+    reverse_geocoder = ReverseGeocoder.from_items(ITEMS)
+    with pytest.raises(MissingFeatureClass):
+        reverse_geocoder.reverse_geocode(48.85, 2.35, feature_class="A")
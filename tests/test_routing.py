@@ -0,0 +1,35 @@
+from geonames_api.config import settings
+from geonames_api.routing import (
+    get_country_group,
+    get_search_header,
+    get_search_index,
+    is_country_scoped,
+)
+
+
+def test_search_header_without_routing(monkeypatch):
+    monkeypatch.setattr(settings, "country_routing", False)
+    monkeypatch.setattr(settings, "country_group_indices", False)
+    assert get_search_header("FR") == {"index": settings.geonames_index}
+    assert not is_country_scoped("FR")
+
+
+def test_search_header_routed_on_the_country(monkeypatch):
+    monkeypatch.setattr(settings, "country_routing", True)
+    monkeypatch.setattr(settings, "country_group_indices", False)
+    assert get_search_header("FR") == {
+        "index": settings.geonames_index,
+        "routing": "FR",
+    }
+    # unknown country: the whole index
+    assert get_search_header(None) == {"index": settings.geonames_index}
+    assert is_country_scoped("FR")
+    assert not is_country_scoped(None)
+
+
+def test_search_index_of_the_country_group(monkeypatch):
+    monkeypatch.setattr(settings, "country_group_indices", True)
+    assert get_country_group("FR") == "europe"
+    assert get_country_group("ZZ") == "other"
+    assert get_search_index("FR") == f"{settings.geonames_index}-europe"
+    assert get_search_index(None) == settings.geonames_index
@@ -0,0 +1,114 @@
+import pytest
+
+from geonames_api.config import settings
+from geonames_api.models import GeonameItemES, JobLocation
+from geonames_api.search import (
+    SearchStage,
+    build_search_body,
+    get_job_location_search_stages,
+    is_keyword_match_ambiguous,
+    staged_msearch,
+)
+
+
+def test_search_body_does_not_track_total_hits(monkeypatch):
+    monkeypatch.setattr(settings, "search_templates", False)
+    stage = SearchStage(name="global", header={}, query={"match_all": {}})
+    body = build_search_body(stage)
+    assert body["track_total_hits"] is False
+    assert body["size"] == settings.search_size
+    assert "sort" not in body
+
+
+def get_hit(geonameid: str, name: str, feature_class: str = "P") -> dict:
+    """ """
+    return {
+        "_score": 10,
+        "_source": {
+            "geonameid": geonameid,
+            "name": name,
+            "asciiname": name,
+            "feature_class": feature_class,
+        },
+    }
+
+
+class FakeEs:
+    """
+    msearch answering the hits of the stage of each search (keyword lookup or
+    full text)
+    """
+
+    def __init__(self, hits_by_stage: dict):
+        self.hits_by_stage = hits_by_stage
+        self.searched_stages = []
+
+    def msearch(self, body):
+        responses = []
+        for search in body[1::2]:
+            if "terms" in str(search["query"]):
+                stage = "keyword"
+            else:
+                stage = "global"
+            self.searched_stages.append(stage)
+            responses.append({"hits": {"hits": self.hits_by_stage.get(stage, [])}})
+        return {"responses": responses}
+
+
+@pytest.fixture
+def keyword_stage(monkeypatch):
+    monkeypatch.setattr(settings, "keyword_first_stage", True)
+    monkeypatch.setattr(settings, "search_templates", False)
+    monkeypatch.setattr(settings, "country_routing", False)
+    monkeypatch.setattr(settings, "country_group_indices", False)
+
+
+def test_keyword_stage_needs_the_country(keyword_stage):
+    stages = get_job_location_search_stages(
+        JobLocation(city="Saint-Denis", country_code="FR")
+    )
+    assert [x.name for x in stages] == ["keyword", "global"]
+    assert stages[0].query["bool"]["filter"] == [
+        {"terms": {"name_keys": ["saint-denis"]}},
+        {"term": {"country_code": "FR"}},
+    ]
+    stages = get_job_location_search_stages(JobLocation(city="Saint-Denis"))
+    assert [x.name for x in stages] == ["global"]
+
+
+def test_keyword_match_ambiguity():
+    paris = GeonameItemES.parse_obj({**get_hit("1", "Paris")["_source"], "score": 1})
+    region = GeonameItemES.parse_obj(
+        {**get_hit("2", "Paris", "A")["_source"], "score": 1}
+    )
+    assert not is_keyword_match_ambiguous([region, paris])
+    assert is_keyword_match_ambiguous([paris, paris.copy(update={"geonameid": "3"})])
+    assert is_keyword_match_ambiguous([])
+
+
+def test_unambiguous_keyword_match_skips_the_full_text_search(keyword_stage):
+    es = FakeEs({"keyword": [get_hit("1", "Lyon")], "global": [get_hit("2", "Lyon")]})
+    stages = get_job_location_search_stages(JobLocation(city="Lyon", country_code="FR"))
+    (result,) = staged_msearch(es, [stages])
+    assert es.searched_stages == ["keyword"]
+    assert result.stage == "keyword"
+    assert [x.geonameid for x in result.candidates] == ["1"]
+
+
+def test_ambiguous_keyword_match_falls_back_to_the_full_text_search(keyword_stage):
+    es = FakeEs(
+        {
+            "keyword": [get_hit("1", "Saint-Denis"), get_hit("2", "Saint-Denis")],
+            "global": [get_hit("2", "Saint-Denis")],
+        }
+    )
+    batch_stages = [
+        get_job_location_search_stages(
+            JobLocation(city="Saint-Denis", country_code="FR")
+        ),
+        # no country: full text only
+        get_job_location_search_stages(JobLocation(city="Saint-Denis")),
+    ]
+    results = staged_msearch(es, batch_stages)
+    assert es.searched_stages == ["keyword", "global", "global"]
+    assert [x.stage for x in results] == ["global", "global"]
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import re
+
+import pytest
+from elasticsearch import ConnectionError as EsConnectionError
+
+from geonames_api import search_templates
+from geonames_api.config import settings
+from geonames_api.models import JobLocation
+from geonames_api.queries import build_keyword_name_query, build_location_query
+from geonames_api.search import build_search_body, get_job_location_search_stages
+from geonames_api.search_templates import (
+    KEYWORD_TEMPLATE_SOURCE,
+    LOCATION_TEMPLATE_SOURCE,
+    get_keyword_template_params,
+    get_location_template_params,
+    get_template_scripts,
+    register_search_templates_until_done_async,
+)
+
+SECTION = re.compile(r"{{#(\w+)}}(.*?){{/\1}}", re.DOTALL)
+VARIABLE = re.compile(r"{{(\w+)}}")
+
+
+def render(source: str, params: dict) -> dict:
+    """
+    Minimal mustache rendering (sections and variables) of a search template
+    """
+    source = SECTION.sub(lambda m: m.group(2) if params.get(m.group(1)) else "", source)
+    source = VARIABLE.sub(lambda m: str(params[m.group(1)]), source)
+    return json.loads(source)
+
+
+def without_match_none(query):
+    """ """
+    if isinstance(query, dict):
+        return {k: without_match_none(v) for k, v in query.items()}
+    if isinstance(query, list):
+        return [without_match_none(x) for x in query if x != {"match_none": {}}]
+    return query
+
+
+@pytest.mark.parametrize("es_ranking", [False, True])
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"name": "Paris", "asciiname": "Paris", "country_code": "FR"},
+        {
+            "name": "Évry",
+            "asciiname": "Evry",
+            "admin1_code": "11",
+            "admin2_code": "91",
+            "postal_code": "91000",
+            "country_code": "FR",
+            "country_filter": True,
+        },
+        {
+            "name": "Springfield",
+            "asciiname": "Springfield",
+            "admin1_name": "Illinois",
+            "admin2_name": "Sangamon",
+            "country_code": "US",
+            "country_filter": False,
+        },
+    ],
+)
+def test_location_template_parity(monkeypatch, params, es_ranking):
+    monkeypatch.setattr(settings, "es_ranking", es_ranking)
+    rendered = render(LOCATION_TEMPLATE_SOURCE, get_location_template_params(params))
+    assert without_match_none(rendered["query"]) == build_location_query(params)
+    assert rendered["size"] == settings.search_size
+    assert rendered["track_total_hits"] is False
+
+
+def test_admin_codes_are_constant_score_terms():
+    params = {"name": "Evry", "asciiname": "Evry", "country_code": "FR"}
+    query = build_location_query({**params, "admin1_code": "11", "admin2_code": "91"})
+    dis_max, *boosts = query["bool"]["should"]
+    assert "admin1_code" not in json.dumps(dis_max)
+    assert [x["constant_score"]["filter"] for x in boosts] == [
+        {"term": {"admin1_code": "11"}},
+        {"term": {"admin2_code": "91"}},
+    ]
+
+
+@pytest.mark.parametrize("es_ranking", [False, True])
+def test_keyword_template_parity(monkeypatch, es_ranking):
+    monkeypatch.setattr(settings, "es_ranking", es_ranking)
+    rendered = render(
+        KEYWORD_TEMPLATE_SOURCE, get_keyword_template_params("Saint-Denis", "FR")
+    )
+    assert rendered["query"] == build_keyword_name_query("Saint-Denis", "FR")
+
+
+class FakeEs:
+    """
+    put_script failing the first `n_failures` calls
+    """
+
+    def __init__(self, n_failures: int):
+        self.n_failures = n_failures
+        self.scripts = {}
+
+    async def put_script(self, id, body):
+        if self.n_failures:
+            self.n_failures -= 1
+            raise EsConnectionError("N/A", "connection refused", None)
+        self.scripts[id] = body
+
+
+def test_template_registration_is_retried(monkeypatch):
+    monkeypatch.setattr(search_templates, "REGISTER_RETRY_DELAY", 0)
+    es = FakeEs(n_failures=3)
+    asyncio.run(register_search_templates_until_done_async(es, "geonames"))
+    assert es.n_failures == 0
+    assert es.scripts == get_template_scripts("geonames")
+
+
+def test_template_ids_are_versioned_with_the_index(monkeypatch):
+    monkeypatch.setattr(settings, "geonames_index", "geonames-v2")
+    assert set(get_template_scripts()) == {
+        "geonames-v2-location",
+        "geonames-v2-keyword",
+    }
+    assert set(get_template_scripts("geonames-v3")) == {
+        "geonames-v3-location",
+        "geonames-v3-keyword",
+    }
+
+
+def test_templated_stages_only_send_the_parameters(monkeypatch):
+    monkeypatch.setattr(settings, "geonames_index", "geonames")
+    monkeypatch.setattr(settings, "search_templates", True)
+    monkeypatch.setattr(settings, "keyword_first_stage", True)
+    monkeypatch.setattr(settings, "country_routing", False)
+    monkeypatch.setattr(settings, "country_group_indices", False)
+    stages = get_job_location_search_stages(
+        JobLocation(city="Évry", country_code="FR", postal_code="91000")
+    )
+    keyword, location = [build_search_body(x) for x in stages]
+    assert keyword == {
+        "id": "geonames-keyword",
+        "params": get_keyword_template_params("Évry", "FR"),
+    }
+    assert location["id"] == "geonames-location"
+    assert location["params"]["asciiname"] == "Evry"
+    assert location["params"]["postal_code"] == "91000"
+    # unset parameters are left out of the rendered sections
+    assert "admin1_name" not in location["params"]
+    assert "country_filter" not in location["params"]
@@ -0,0 +1,45 @@
+import logging
+import os
+import time
+
+import pytest
+
+from geonames_api.server import get_process_memory, log_memory_report
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists("/proc/self/smaps_rollup"), reason="linux only"
+)
+
+
+def test_process_memory():
+    memory = get_process_memory(os.getpid())
+    assert set(memory) == {"rss", "pss", "private"}
+    assert memory["rss"] >= memory["pss"] >= memory["private"] > 0
+
+
+def test_forked_process_shares_the_preloaded_pages():
+    preloaded = b"x" * (64 * 2**20)  # noqa: F841 (shared copy-on-write)
+    pid = os.fork()
+    if pid == 0:
+        time.sleep(10)
+        os._exit(0)
+    try:
+        time.sleep(0.2)
+        memory = get_process_memory(pid)
+        # the pages are shared with the parent: counted half in the pss
+        assert memory["private"] < memory["rss"] / 2
+        assert memory["pss"] < memory["rss"]
+    finally:
+        os.kill(pid, 9)
+        os.waitpid(pid, 0)
+
+
+def test_memory_report_skips_exited_processes(caplog):
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    with caplog.at_level(logging.INFO, logger="geonames_api.server"):
+        log_memory_report([os.getpid(), pid])
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage().startswith(f"worker {os.getpid()}: rss=")
@@ -0,0 +1,91 @@
+import asyncio
+
+from geonames_api import metrics
+from geonames_api.config import settings
+from geonames_api.search import SearchResult, SearchStage
+from geonames_api.shadow import get_shadow_stages, run_shadow_search
+
+
+class FakeEs:
+    """
+    msearch answering the hits of each searched index
+    """
+
+    def __init__(self, hits_by_index: dict):
+        self.hits_by_index = hits_by_index
+        self.indices = []
+
+    async def msearch(self, body, request_timeout=None):
+        responses = []
+        for header in body[::2]:
+            self.indices.append(header["index"])
+            hits = self.hits_by_index.get(header["index"], [])
+            responses.append({"hits": {"hits": hits}})
+        return {"responses": responses}
+
+
+def get_hit(geonameid: str, name: str) -> dict:
+    """ """
+    return {
+        "_score": 10,
+        "_source": {"geonameid": geonameid, "name": name, "asciiname": name},
+    }
+
+
+def get_stages(index: str) -> list:
+    """ """
+    return [SearchStage(name="location", header={"index": index}, query={})]
+
+
+def test_shadow_stages(monkeypatch):
+    monkeypatch.setattr(settings, "geonames_index", "geonames")
+    monkeypatch.setattr(settings, "shadow_index", "geonames-next")
+    stage = SearchStage(
+        name="keyword",
+        header={"index": "geonames-europe", "routing": "FR"},
+        template="geonames-keyword",
+        params={"name_key": "paris"},
+    )
+    (shadow_stage,) = get_shadow_stages([stage])
+    assert shadow_stage.header == {"index": "geonames-next-europe", "routing": "FR"}
+    assert shadow_stage.template == "geonames-next-keyword"
+    assert shadow_stage.params == stage.params
+
+
+def test_shadow_compares_the_selected_matches(monkeypatch):
+    monkeypatch.setattr(settings, "geonames_index", "geonames")
+    monkeypatch.setattr(settings, "shadow_index", "geonames-next")
+    monkeypatch.setattr(settings, "search_templates", False)
+    es = FakeEs(
+        {
+            "geonames-next": [get_hit("1", "Parigi"), get_hit("2", "Paris")],
+        }
+    )
+    primary_results = [
+        SearchResult(stage="location", candidates=[]),
+        SearchResult(stage="location", candidates=[]),
+    ]
+    compared = []
+
+    def get_match_ids(search_results):
+        # selection of the live path: the candidates named as the location
+        compared.append(search_results)
+        return [
+            next((x.geonameid for x in result.candidates if x.name == "Paris"), "2")
+            for result in search_results
+        ]
+
+    before = dict(metrics.counters)
+    asyncio.run(
+        run_shadow_search(
+            es, [get_stages("geonames"), []], primary_results, get_match_ids
+        )
+    )
+    assert es.indices == ["geonames-next"]
+    assert compared[0] is primary_results
+    assert [x.geonameid for x in compared[1][0].candidates] == ["1", "2"]
+    # only the searched locations are compared, and they agree
+    assert metrics.counters["shadow.compared"] - before.get("shadow.compared", 0) == 1
+    assert (
+        metrics.counters["shadow.same_match"] - before.get("shadow.same_match", 0) == 1
+    )
@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+import pytest
+import textdistance
+
+from geonames_api.similarity import encode_strings, jaro_winkler_similarities
+
+PAIRS = [
+    ("marseille", "marseille"),
+    ("marseile", "marseille"),
+    ("koln", "cologne"),
+    ("saint-denis", "saint-etienne"),
+    ("lyon", "noyl"),
+    ("dixon", "dicksonx"),
+    ("martha", "marhta"),
+    ("", "paris"),
+    ("", ""),
+    ("évry", "evry"),
+    ("東京", "東京都"),
+    ("a", "b"),
+    ("llanfairpwllgwyngyllgogerychwyrndrobwllllantysiliogogogoch", "llanfair"),
+]
+
+
+def get_reference(pairs, prefix_weight: float = 0.1) -> np.ndarray:
+    """ """
+    return np.array(
+        [textdistance.jaro_winkler(x, y, prefix_weight=prefix_weight) for x, y in pairs]
+    )
+
+
+def random_name(rng: random.Random) -> str:
+    """ """
+    return "".join(rng.choice("aeinorst-é ") for _ in range(rng.randint(0, 40)))
+
+
+def test_encode_strings():
+    codes, lengths = encode_strings(["ab", "", "évry"], length=3)
+    assert lengths.tolist() == [2, 0, 3]
+    assert codes.tolist() == [[97, 98, 0], [0, 0, 0], [233, 118, 114]]
+
+
+@pytest.mark.parametrize("n_repeat", [1, 10])
+def test_parity_with_textdistance(n_repeat):
+    # small batches are scored one at a time, large ones vectorized
+    pairs = PAIRS * n_repeat
+    similarities = jaro_winkler_similarities(*zip(*pairs))
+    np.testing.assert_allclose(similarities, get_reference(pairs), atol=1e-12)
+
+
+def test_parity_on_random_names():
+    rng = random.Random(0)
+    pairs = [(random_name(rng), random_name(rng)) for _ in range(2000)]
+    # near duplicates, as the candidates of a search
+    pairs += [(x, x[::-1][:5] + x[5:]) for x, _ in pairs[:500]]
+    similarities = jaro_winkler_similarities(*zip(*pairs), max_length=16)
+    np.testing.assert_allclose(similarities, get_reference(pairs), atol=1e-12)
+
+
+def test_prefix_weight():
+    pairs = [("marseile", "marseille"), ("paris", "parigi")] * 10
+    similarities = jaro_winkler_similarities(*zip(*pairs), prefix_weight=0.2)
+    np.testing.assert_allclose(
+        similarities, get_reference(pairs, prefix_weight=0.2), atol=1e-12
+    )
+
+
+def test_empty_batch():
+    assert len(jaro_winkler_similarities([], [])) == 0
@@ -0,0 +1,68 @@
+import pytest
+
+from geonames_api.spelling import SpellingCorrector, get_char_masks, osa_distance
+
+TERM_WEIGHTS = {
+    "marseille": 870000,
+    "marseilles": 1200,
+    "bordeaux": 260000,
+    "montpellier": 290000,
+    "lyon": 520000,
+    "lyons": 6000,
+    "saint-etienne": 170000,
+    "saint-denis": 110000,
+}
+
+
+@pytest.fixture(scope="module")
+def corrector():
+    return SpellingCorrector.from_terms(TERM_WEIGHTS)
+
+
+@pytest.mark.parametrize(
+    "word, term, distance",
+    [
+        ("marseile", "marseille", 1),
+        ("bordeau", "bordeaux", 1),
+        ("montpelleir", "montpellier", 1),
+        ("lyon", "lyon", 0),
+        ("lyon", "noyl", 3),
+        ("", "lyon", 4),
+    ],
+)
+def test_osa_distance(word, term, distance):
+    assert osa_distance(word, get_char_masks(word), term) == distance
+
+
+def test_lookup(corrector):
+    # only the closest terms
+    assert corrector.lookup("marseile") == [("marseille", 1, 870000)]
+    # same distance: by decreasing weight
+    assert [x[0] for x in corrector.lookup("lyonn")] == ["lyon", "lyons"]
+    assert corrector.lookup("toulouse") == []
+
+
+@pytest.mark.parametrize(
+    "name, correction",
+    [
+        ("Marseile", "marseille"),
+        ("Bordeau", "bordeaux"),
+        ("Montpelier", "montpellier"),
+        ("Saint Etiene", "saint-etienne"),
+        ("Saint-Étiene", "saint-etienne"),
+        # known names and short names are never corrected
+        ("Marseille", None),
+        ("Lyons", None),
+        ("Lyn", None),
+        ("Toulouse", None),
+    ],
+)
+def test_correct(corrector, name, correction):
+    assert corrector.correct(name) == correction
+
+
+def test_save_and_load(corrector, tmp_path):
+    corrector.save(str(tmp_path))
+    loaded = SpellingCorrector.load(str(tmp_path))
+    assert len(loaded) == len(corrector)
+    assert loaded.correct("Marseile") == "marseille"
@@ -0,0 +1,50 @@
+import ftfy
+import pytest
+
+from geonames_api.text import deaccent, deaccent_unicodedata, fix_text
+
+TEXTS = [
+    "Paris",
+    "Île-de-France",
+    "Šef chomutovských komunistů dostal poštou bílý prášek",
+    "Łódź",
+    "Ærøskøbing",
+    "Straße",
+    "İstanbul",
+    "Hà Nội",
+    "Ṭarābulus",
+    "東京",
+    "Züricḧ",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_deaccent_parity(text):
+    assert deaccent(text) == deaccent_unicodedata(text)
+
+
+def test_deaccent():
+    assert deaccent("Île-de-France") == "Ile-de-France"
+    assert deaccent("Mérignac") == "Merignac"
+
+
+@pytest.mark.parametrize(
+    "text",
+    TEXTS
+    + [
+        "Saint-Ã‰tienne",
+        "Mont &amp; Blanc",
+        "Lyon\x1b[31m",
+        "Paris\r\nFrance",
+        "Nantes (44)",
+        "“Bordeaux”",
+    ],
+)
+def test_fix_text_parity(text):
+    assert fix_text(text) == ftfy.fix_text(text)
+
+
+def test_fix_text():
+    assert fix_text("Saint-Ã‰tienne") == "Saint-Étienne"
+    assert fix_text("Chamonix-Mont-Blanc (74)") == "Chamonix-Mont-Blanc (74)"
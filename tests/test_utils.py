@@ -0,0 +1,25 @@
+import pytest
+
+from geonames_api.utils import get_name_keys, is_bad_loc, normalize_name_key
+
+
+@pytest.mark.parametrize(
+    "loc, bad",
+    [
+        ("remote", True),
+        ("full remote", True),
+        ("anywhere in france", True),
+        ("null", True),
+        ("remotely", False),
+        ("null-sur-mer", False),
+        ("paris", False),
+    ],
+)
+def test_is_bad_loc(loc, bad):
+    assert is_bad_loc(loc) is bad
+
+
+def test_name_keys():
+    assert normalize_name_key("  Île-de-France ") == "ile-de-france"
+    assert normalize_name_key("Saint  Étienne") == "saint etienne"
+    assert get_name_keys(["Évry", "Evry", None, ""]) == ["evry"]